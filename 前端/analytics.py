@@ -0,0 +1,346 @@
+"""投資組合分析：以 NumPy 對整個交易陣列做 FIFO（累積成本曲線內插），算已實現／未實現損益、含費用成本與 TWR / MWR"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import String, select, type_coerce
+
+from models import db, Trade, DailyBar
+from money import CENTS
+from positions import BUY_TYPES
+
+# 台股預設費率：手續費 0.1425%（可打折、有最低金額）、賣出證交稅 0.3%
+DEFAULT_FEES = {
+    "rate": 0.001425,
+    "discount": 1.0,
+    "min_fee": 20.0,      # 整股每筆最低手續費
+    "min_fee_odd": 1.0,   # 零股每筆最低手續費
+    "tax_rate": 0.003,    # 賣出證交稅
+}
+
+
+def load_trades(user_id: int, after_id: int = 0) -> pd.DataFrame:
+    """
+    查出該帳號 id > after_id 的交易，依成交順序排列。
+    不建 ORM 物件：Core 查詢後逐欄轉成陣列；時間欄不經 SQLAlchemy 逐列解析，交給 pandas 一次轉換。
+    """
+    stmt = (select(Trade.id, Trade.ticker, Trade.trade_type, Trade.mode, Trade.quantity, Trade.price_cents,
+                   type_coerce(Trade.created_at, String))
+            .where(Trade.user_id == user_id, Trade.id > after_id)
+            .order_by(Trade.created_at, Trade.id))
+    cols = list(zip(*db.session.execute(stmt).all())) or [()] * 7
+    df = pd.DataFrame({
+        "id": np.array(cols[0], dtype=np.int64),
+        "ticker": np.array(cols[1], dtype=object),
+        "trade_type": np.array(cols[2], dtype=object),
+        "mode": np.array(cols[3], dtype=object),
+        "quantity": np.array(cols[4], dtype=np.int64),
+        "price_cents": np.array(cols[5], dtype=np.int64),
+        "created_at": pd.to_datetime(pd.Series(cols[6], dtype=object), format="ISO8601"),
+    })
+    df["is_buy"] = df["trade_type"].isin(BUY_TYPES)
+    df["price"] = df["price_cents"] / CENTS
+    return df
+
+
+def apply_fees(df: pd.DataFrame, fees: Optional[dict] = None) -> pd.DataFrame:
+    """加上 gross / fee / tax / cash（買入為含費成本，賣出為扣費稅後淨收入）欄位"""
+    f = {**DEFAULT_FEES, **(fees or {})}
+    # 成交金額先以整數分相乘再換回元，與帳戶扣款一致
+    gross = (df["quantity"].to_numpy() * df["price_cents"].to_numpy()) / CENTS
+    odd = (df["mode"] == "零股").to_numpy()
+    fee = np.maximum(np.floor(gross * f["rate"] * f["discount"]), np.where(odd, f["min_fee_odd"], f["min_fee"]))
+    fee = np.where(gross > 0, fee, 0.0)
+    is_buy = df["is_buy"].to_numpy()
+    tax = np.where(is_buy, 0.0, np.floor(gross * f["tax_rate"]))
+    return df.assign(gross=gross, fee=fee, tax=tax,
+                     cash=np.where(is_buy, gross + fee, gross - fee - tax))
+
+
+def _fifo_one(g: pd.DataFrame):
+    """
+    單一代號的 FIFO，全部以陣列運算完成：
+    - 累積買入股數 Bc 與累積含費成本 Cc 構成分段線性成本曲線，賣出第 x 股的成本 = interp(x)
+    - 有效累積賣出 x_i = min(x_{i-1} + q_i, 當時累積買入)（舊資料超賣時與 rebuild_positions 一致），
+      等價於 Q_i + min(0, cummin(b_i - Q_i))，可一次算完
+    回傳 (每筆賣出, 每個買入批次) 兩個 DataFrame；批次的 closed_at 為最後一筆配對到它的賣出時間
+    """
+    is_buy = g["is_buy"].to_numpy()
+    q = g["quantity"].to_numpy(dtype=float)
+    cash = g["cash"].to_numpy(dtype=float)
+
+    buy_q, buy_cost = q[is_buy], cash[is_buy]
+    Bc = np.concatenate(([0.0], np.cumsum(buy_q)))
+    Cc = np.concatenate(([0.0], np.cumsum(buy_cost)))
+
+    sell_q = q[~is_buy]
+    b = np.cumsum(np.where(is_buy, q, 0.0))[~is_buy]   # 每筆賣出當下的累積買入
+    Q = np.cumsum(sell_q)
+    x = Q + np.minimum(0.0, np.minimum.accumulate(b - Q)) if len(Q) else Q
+    x_prev = np.concatenate(([0.0], x[:-1]))
+    matched = x - x_prev
+    cost = np.interp(x, Bc, Cc) - np.interp(x_prev, Bc, Cc)
+    proceeds = cash[~is_buy] * np.divide(matched, sell_q, out=np.zeros_like(sell_q), where=sell_q > 0)
+
+    sells = pd.DataFrame({
+        "trade_id": g["id"].to_numpy()[~is_buy],
+        "created_at": g["created_at"].to_numpy()[~is_buy],
+        "quantity": sell_q,
+        "matched": matched,
+        "proceeds": proceeds,
+        "cost": cost,
+        "realized": proceeds - cost,
+    })
+
+    # 每個買入批次：已賣出部分 [Bc_j, min(Bc_{j+1}, X)]，對應的賣出淨收入由累積收入曲線內插
+    X = x[-1] if len(x) else 0.0
+    lo, hi = Bc[:-1], Bc[1:]
+    sold = np.clip(X - lo, 0.0, buy_q)
+    Xc = np.concatenate(([0.0], x))
+    Pc = np.concatenate(([0.0], np.cumsum(proceeds)))
+    lot_proceeds = np.interp(np.minimum(hi, X), Xc, Pc) - np.interp(np.minimum(lo, X), Xc, Pc) if len(x) else np.zeros_like(buy_q)
+    frac_sold = np.divide(sold, buy_q, out=np.zeros_like(buy_q), where=buy_q > 0)
+    # 批次已賣出部分的終點 min(hi, X) 落在哪一筆賣出：累積賣出 x 第一次到達該點的那筆
+    sell_times = g["created_at"].to_numpy()[~is_buy]
+    if len(x):
+        closing = np.minimum(np.searchsorted(x, np.minimum(hi, X), side="left"), len(x) - 1)
+        closed_at = np.where(sold > 0, sell_times[closing], np.datetime64("NaT"))
+    else:
+        closed_at = np.full(len(buy_q), np.datetime64("NaT"), dtype="datetime64[us]")
+    lots = pd.DataFrame({
+        "trade_id": g["id"].to_numpy()[is_buy],
+        "created_at": g["created_at"].to_numpy()[is_buy],
+        "quantity": buy_q,
+        "price": g["price"].to_numpy()[is_buy],
+        "cost": buy_cost,
+        "sold": sold,
+        "open": buy_q - sold,
+        "closed_cost": buy_cost * frac_sold,
+        "open_cost": buy_cost * (1 - frac_sold),
+        "proceeds": lot_proceeds,
+        "closed_at": closed_at,
+    })
+    lots["realized"] = lots["proceeds"] - lots["closed_cost"]
+    return sells, lots
+
+
+def fifo(df: pd.DataFrame):
+    """全部代號的 FIFO；回傳 (sells, lots)，都帶 ticker 欄"""
+    sells, lots = [], []
+    for ticker, g in df.groupby("ticker", sort=False):
+        s, l = _fifo_one(g)
+        sells.append(s.assign(ticker=ticker))
+        lots.append(l.assign(ticker=ticker))
+    if not sells:
+        empty = pd.DataFrame(columns=["ticker"])
+        return empty, empty
+    return pd.concat(sells, ignore_index=True), pd.concat(lots, ignore_index=True)
+
+
+def _daily_prices(tickers, start: date, end: date, trades: pd.DataFrame) -> pd.DataFrame:
+    """本地日線收盤（不打上游），缺的日期用當天最後成交價補，再往前填"""
+    rows = (db.session.query(DailyBar.date, DailyBar.code, DailyBar.close)
+            .filter(DailyBar.code.in_(list(tickers)), DailyBar.date.between(start, end))
+            .all())
+    closes = pd.DataFrame(rows, columns=["date", "ticker", "close"])
+    closes = (closes.pivot_table(index="date", columns="ticker", values="close", aggfunc="last")
+              if not closes.empty else pd.DataFrame())
+    traded = trades.assign(date=trades["created_at"].dt.date).pivot_table(
+        index="date", columns="ticker", values="price", aggfunc="last")
+    return closes.combine_first(traded) if not closes.empty else traded
+
+
+def xirr(amounts: np.ndarray, years: np.ndarray) -> Optional[float]:
+    """年化資金加權報酬（IRR）；amounts 以投資人角度（投入為負），years 為距第一筆的年數"""
+    if len(amounts) < 2 or not (amounts < 0).any() or not (amounts > 0).any():
+        return None
+
+    def npv(r):
+        return float(np.sum(amounts / np.power(1.0 + r, years)))
+
+    # 先用二分法夾出根，再交給牛頓法收斂
+    lo, hi = -0.9999, 10.0
+    f_lo, f_hi = npv(lo), npv(hi)
+    if np.sign(f_lo) == np.sign(f_hi):
+        return None
+    r = 0.1
+    for _ in range(100):
+        mid = (lo + hi) / 2
+        f_mid = npv(mid)
+        if np.sign(f_mid) == np.sign(f_lo):
+            lo, f_lo = mid, f_mid
+        else:
+            hi = mid
+        if hi - lo < 1e-4:
+            r = (lo + hi) / 2
+            break
+    for _ in range(20):
+        f = npv(r)
+        d = float(np.sum(-years * amounts / np.power(1.0 + r, years + 1)))
+        if d == 0:
+            break
+        step = f / d
+        r -= step
+        if abs(step) < 1e-10 or r <= -1:
+            break
+    return float(r) if r > -1 else None
+
+
+def returns(df: pd.DataFrame, sells: pd.DataFrame, quotes: Dict[str, Optional[float]], today: date) -> dict:
+    """
+    股票部位的時間加權（TWR，逐日 Modified Dietz 連乘，現金流視為當日開盤發生）
+    與資金加權（MWR / XIRR，買入為投入、賣出為取回、期末市值為取回）報酬
+    """
+    if df.empty:
+        return {"twr": None, "twr_annualized": None, "mwr": None, "days": 0}
+    df = df.assign(date=df["created_at"].dt.date)
+    start = df["date"].min()
+    # 賣出只計實際配對到的股數（舊資料超賣的部分不算），與 FIFO 的持股一致
+    matched = df["id"].map(sells.set_index("trade_id")["matched"]) if not sells.empty else 0.0
+    signed = np.where(df["is_buy"], df["quantity"], -matched)
+    holdings = (df.assign(signed=signed)
+                .pivot_table(index="date", columns="ticker", values="signed", aggfunc="sum")
+                .cumsum())
+    flows = df.assign(flow=np.where(df["is_buy"], df["cash"], -df["cash"])).groupby("date")["flow"].sum()
+
+    prices = _daily_prices(holdings.columns, start, today, df)
+    live = {t: p for t, p in quotes.items() if p is not None and t in holdings.columns}
+    if live:
+        prices = prices.reindex(prices.index.union([today]))
+        for t, p in live.items():
+            prices.loc[today, t] = p
+    days = holdings.index.union(prices.index)
+    days = days[days >= start]
+    holdings = holdings.reindex(days).ffill().fillna(0)
+    prices = prices.reindex(index=days, columns=holdings.columns).ffill()
+    value = (holdings * prices).sum(axis=1, min_count=1).fillna(0.0).to_numpy()
+    flow = flows.reindex(days).fillna(0.0).to_numpy()
+
+    prev = np.concatenate(([0.0], value[:-1]))
+    base = prev + flow
+    r = np.divide(value - prev - flow, base, out=np.zeros_like(value), where=base > 0)
+    twr = float(np.prod(1 + r) - 1)
+    span = max((days[-1] - days[0]).days, 1)
+    twr_ann = float((1 + twr) ** (365.0 / span) - 1) if span >= 365 and twr > -1 else None
+
+    years = np.array([(d - days[0]).days for d in days], dtype=float) / 365.0
+    cf = -flow.copy()
+    cf[-1] += value[-1]
+    mwr = xirr(cf[cf != 0], years[cf != 0])
+    return {
+        "twr": round(twr, 6),
+        "twr_annualized": round(twr_ann, 6) if twr_ann is not None else None,
+        "mwr": round(mwr, 6) if mwr is not None else None,
+        "days": span,
+        "market_value": round(float(value[-1]), 2),
+    }
+
+
+_PREPARED: "OrderedDict[tuple, tuple]" = OrderedDict()
+_PREPARED_MAX = 256
+_PREPARED_LOCK = threading.Lock()
+
+
+def prepared(user_id: int, fees: Optional[dict] = None):
+    """
+    (交易含費用, sells, lots)。交易只會新增，以 (筆數, 最大 id) 判斷是否有新交易：
+    沒有就重用上次 FIFO 的結果，每次只多一個彙總查詢；有新交易且只是往後追加時，
+    只讀 id 較大的那幾筆接在後面再重算 FIFO，不重讀全部交易。
+    """
+    count, max_id = (db.session.query(db.func.count(Trade.id), db.func.max(Trade.id))
+                     .filter(Trade.user_id == user_id).one())
+    key = (user_id, tuple(sorted((fees or {}).items())))
+    with _PREPARED_LOCK:
+        hit = _PREPARED.get(key)
+        if hit is not None:
+            _PREPARED.move_to_end(key)
+    if hit is not None and hit[:2] == (count, max_id):
+        return hit[2:]
+
+    df = None
+    if hit is not None and hit[1] is not None and max_id is not None and max_id > hit[1]:
+        tail = apply_fees(load_trades(user_id, after_id=hit[1]), fees)
+        if hit[0] + len(tail) == count:
+            df = pd.concat([hit[2], tail], ignore_index=True)
+            if not df["created_at"].is_monotonic_increasing:
+                df = df.sort_values(["created_at", "id"], kind="stable", ignore_index=True)
+    if df is None:
+        df = apply_fees(load_trades(user_id), fees)
+    sells, lots = fifo(df)
+    with _PREPARED_LOCK:
+        _PREPARED[key] = (count, max_id, df, sells, lots)
+        _PREPARED.move_to_end(key)
+        while len(_PREPARED) > _PREPARED_MAX:
+            _PREPARED.popitem(last=False)
+    return df, sells, lots
+
+
+def portfolio_analytics(user_id: int, quotes: Dict[str, Optional[float]], fees: Optional[dict] = None,
+                        lot_limit: int = 0, today: Optional[date] = None) -> dict:
+    """
+    quotes：{代號: 現價}（呼叫端一次批次查好）。lot_limit > 0 時附上最近平倉（依最後一筆配對的賣出時間）的批次明細。
+    需在 app context 內呼叫。
+    """
+    today = today or datetime.now().date()
+    df, sells, lots = prepared(user_id, fees)
+
+    positions = []
+    totals = {"cost_basis": 0.0, "market_value": 0.0, "unrealized": 0.0, "realized": 0.0, "fees": 0.0, "tax": 0.0}
+    if not df.empty:
+        fee_by = df.groupby("ticker")[["fee", "tax"]].sum()
+        realized_by = sells.groupby("ticker")["realized"].sum() if not sells.empty else pd.Series(dtype=float)
+        open_by = lots.groupby("ticker")[["open", "open_cost"]].sum()
+        for ticker, row in open_by.iterrows():
+            qty, cost = float(row["open"]), float(row["open_cost"])
+            price = quotes.get(ticker)
+            mv = qty * price if price is not None else None
+            realized = float(realized_by.get(ticker, 0.0))
+            if qty <= 0 and realized == 0:
+                continue
+            positions.append({
+                "ticker": ticker,
+                "quantity": qty,
+                "cost_basis": round(cost, 2),
+                "avg_cost": round(cost / qty, 4) if qty else None,
+                "price": price,
+                "market_value": round(mv, 2) if mv is not None else None,
+                "unrealized": round(mv - cost, 2) if mv is not None else None,
+                "unrealized_pct": round((mv - cost) / cost * 100, 2) if mv is not None and cost else None,
+                "realized": round(realized, 2),
+                "fees": round(float(fee_by.loc[ticker, "fee"]), 2),
+                "tax": round(float(fee_by.loc[ticker, "tax"]), 2),
+            })
+            totals["cost_basis"] += cost
+            totals["market_value"] += mv or 0.0
+            totals["unrealized"] += (mv - cost) if mv is not None else 0.0
+            totals["realized"] += realized
+        totals["fees"] = float(df["fee"].sum())
+        totals["tax"] = float(df["tax"].sum())
+
+    out = {
+        "trades": int(len(df)),
+        "positions": positions,
+        "totals": {k: round(v, 2) for k, v in totals.items()},
+        "returns": returns(df, sells, quotes, today),
+    }
+    if lot_limit > 0 and not lots.empty:
+        closed = (lots[lots["sold"] > 0]
+                  .sort_values(["closed_at", "trade_id"], ascending=False, kind="stable")
+                  .head(lot_limit))
+        out["closed_lots"] = [{
+            "trade_id": int(r.trade_id),
+            "ticker": r.ticker,
+            "bought_at": pd.Timestamp(r.created_at).isoformat(),
+            "closed_at": pd.Timestamp(r.closed_at).isoformat(),
+            "quantity": float(r.quantity),
+            "sold": float(r.sold),
+            "price": float(r.price),
+            "cost": round(float(r.closed_cost), 2),
+            "proceeds": round(float(r.proceeds), 2),
+            "realized": round(float(r.realized), 2),
+        } for r in closed.itertuples(index=False)]
+    return out
@@ -1,19 +1,16 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for
-import requests
 import yfinance as yf
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, User, Trade, Result
+from models import db, User, Trade, Result, DailyBar, Position, RestingOrder
 from flask_cors import CORS
 import openai
 from dotenv import load_dotenv
-from decimal import Decimal, ROUND_HALF_UP
 import pandas as pd
-from collections import defaultdict, deque
 from openai import OpenAI 
 from FinMind.data import DataLoader
-from datetime import datetime, time as dtime, timedelta
+from datetime import datetime, timedelta, timezone
 import math
 import time
 import html as py_html
@@ -27,7 +24,26 @@ from zoneinfo import ZoneInfo
 from flask import Blueprint, Response
 import os, re, tempfile
 from typing import Tuple, Dict, Any, Optional
-from flask import request, Response, stream_with_context
+from flask import request, Response, stream_with_context, send_file
+from quote_cache import QuoteCache
+from upstream import UpstreamClient
+from symbol_master import SymbolMaster
+from quote_stream import QuoteHub
+from order_book import LIMIT, STOP, OrderBook, OrderMatcher
+from trade_history import PAGE_SIZE, CursorError, page_trades, trade_dict
+from analytics import portfolio_analytics
+from risk import SORT_KEYS, RiskBoard
+from ledger import record_opening, state_at, take_snapshots
+from trade_export import iter_csv, iter_trade_chunks, parquet_available, write_parquet
+from provider_health import ProviderHealth, CircuitOpenError
+import market_calendar
+from bar_store import BarStore, period_start
+from intraday import IntradayBars
+from leaderboard import Leaderboard
+from equity import EquitySettler, equity_series, top_user_ids
+from positions import BUY_TYPES, portfolio_rows
+from orders import BUY, SELL, MAX_BATCH_ORDERS, OrderError, execute_batch, execute_order, fill_price_cents
+from money import CENTS, from_cents, parse_cents, to_cents
 # 載入 .env 檔案
 load_dotenv()
 
@@ -412,37 +428,328 @@ def index():
 def home():
     return render_template('ai.html')
 
-# Price history
+# Price history（本地日線庫，只向 Yahoo 補缺少的交易日）
+def _yahoo_daily_bars(code: str, start, end) -> pd.DataFrame:
+    """Yahoo 日線（未還原權息，與收盤價一致）；所有後綴都出錯才丟例外"""
+    last_error = None
+    for symbol in symbols.yahoo_candidates(code):
+        try:
+            df = provider_health.call("yahoo", lambda: yf.Ticker(symbol).history(
+                start=start.isoformat(), end=(end + timedelta(days=1)).isoformat(),
+                interval="1d", auto_adjust=False, actions=False))
+        except Exception as e:
+            last_error = e
+            continue
+        last_error = None
+        if df is not None and not df.empty:
+            df = df.dropna(subset=["Close"]).reset_index()
+            return pd.DataFrame({
+                "date": pd.to_datetime(df["Date"]).dt.date,
+                "open": df["Open"], "high": df["High"], "low": df["Low"],
+                "close": df["Close"], "volume": df["Volume"],
+            })
+    if last_error is not None:
+        raise last_error
+    return pd.DataFrame(columns=["date", "open", "high", "low", "close", "volume"])
+
+bar_store = BarStore(app, _yahoo_daily_bars)
+
 @app.route("/history")
 @login_required
 def get_history():
-    
+    """/history?ticker=2330&period=1mo 或 &start=2024-01-01&end=2024-06-30"""
     ticker = request.args.get("ticker", "").strip()
     if not ticker:
         return jsonify(success=False, message="缺少股票代碼")
 
     try:
-        # 試著用 .TW，若 404 就用 .TWO
-        try:
-            data = yf.Ticker(f"{ticker}.TW").history(period="1mo")
-            if data.empty:
-                raise Exception("empty")
-        except:
-            data = yf.Ticker(f"{ticker}.TWO").history(period="1mo")
-            if data.empty:
-                raise Exception("empty")
-
-        data = data.reset_index()[["Date", "Close"]].dropna()
-        data["Date"] = pd.to_datetime(data["Date"]).dt.strftime("%Y-%m-%d")
-
-        result = data.to_dict(orient="records")
+        end_arg = request.args.get("end")
+        start_arg = request.args.get("start")
+        end = datetime.strptime(end_arg, "%Y-%m-%d").date() if end_arg else market_calendar.now_tw().date()
+        if start_arg:
+            start = datetime.strptime(start_arg, "%Y-%m-%d").date()
+        else:
+            start = period_start(request.args.get("period", "1mo"), end)
+        if start > end:
+            return jsonify(success=False, message="start 不可晚於 end")
+    except ValueError as e:
+        return jsonify(success=False, message=f"日期參數錯誤：{e}")
+
+    try:
+        data = bar_store.history(ticker, start, end)
+        if data.empty:
+            raise Exception("empty")
+
+        result = [{
+            "Date": r.date.strftime("%Y-%m-%d"),
+            "Open": r.open, "High": r.high, "Low": r.low, "Close": r.close,
+            "Volume": int(r.volume) if pd.notna(r.volume) else None,
+        } for r in data.itertuples(index=False)]
         return jsonify(success=True, data=result)
 
     except Exception as e:
         return jsonify(success=False, message=f"查詢歷史價格失敗：{str(e)}")
 
 
+# ===== 股票代號主檔（決定 TSE/OTC 與 Yahoo 後綴）=====
+symbols = SymbolMaster(app, fetch_info=lambda: api.taiwan_stock_info())
+
+# ===== 共用上游 HTTP（連線池 + 期限 + 重試）=====
+http = UpstreamClient(
+    timeout=float(os.getenv("UPSTREAM_TIMEOUT", "3")),
+    retries=int(os.getenv("UPSTREAM_RETRIES", "2")),
+    host_limits={"mis.twse.com.tw": 4, "news.google.com": 4},
+)
+
+# ===== 上游來源健康度（TWSE MIS / Yahoo）=====
+provider_health = ProviderHealth(
+    failure_threshold=int(os.getenv("PROVIDER_FAILURE_THRESHOLD", "5")),
+    cooldown=float(os.getenv("PROVIDER_COOLDOWN", "30")),
+)
+
+# ===== 共用報價快取（/price、排行榜、官價、市場別都走這裡）=====
+quote_cache = QuoteCache(max_size=int(os.getenv("QUOTE_CACHE_SIZE", "2048")),
+                         ttl_func=market_calendar.quote_ttl)
+
+MIS_URL = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
+MIS_HEADERS = {"User-Agent": "Mozilla/5.0", "Referer": "https://mis.twse.com.tw/stock/index.jsp"}
+
+def _mis_fetch(ex_ch: str, deadline: float = 6) -> list:
+    """TWSE MIS 查詢，回傳 msgArray（失敗丟例外）"""
+    data = http.get_json(MIS_URL, headers=MIS_HEADERS, params={"ex_ch": ex_ch, "json": "1"}, deadline=deadline)
+    return data.get("msgArray") or []
+
+def _mis_last_price(ticker: str) -> Optional[float]:
+    """TWSE MIS 最後成交價；無成交（z 為 "-"）回傳 None"""
+    for stock in _mis_fetch("|".join(symbols.mis_channels(ticker))):
+        z = stock.get("z")
+        if stock.get("c") == ticker and z and z != "-":
+            return float(z)
+    return None
+
+def _yahoo_last_price(ticker: str) -> Optional[float]:
+    """Yahoo 最近一筆收盤（依代號主檔決定後綴）；所有後綴都出錯才丟例外"""
+    last_error = None
+    for symbol in symbols.yahoo_candidates(ticker):
+        try:
+            hist = yf.Ticker(symbol).history(period="5d")
+        except Exception as e:
+            print(f"⚠️ Yahoo 抓 {symbol} 失敗：{e}")
+            last_error = e
+            continue
+        last_error = None
+        close_prices = hist["Close"].dropna() if not hist.empty else hist
+        if not close_prices.empty:
+            return float(close_prices.iloc[-1])
+    if last_error is not None:
+        raise last_error
+    return None
+
+# 單檔報價來源；實際嘗試順序由 provider_health 依健康度決定
+QUOTE_PROVIDERS = {"twse": _mis_last_price, "yahoo": _yahoo_last_price}
+
+def _fetch_quote_price(ticker: str) -> Optional[float]:
+    """依來源健康度依序嘗試 TWSE / Yahoo；跳脫中的來源直接略過；都抓不到回傳 None"""
+    for name in provider_health.order(QUOTE_PROVIDERS):
+        try:
+            price = provider_health.call(name, lambda: QUOTE_PROVIDERS[name](ticker))
+        except CircuitOpenError:
+            continue
+        except Exception as e:
+            print(f"⚠️ {name} 抓 {ticker} 價格失敗：{e}")
+            continue
+        if price is not None:
+            return price
+    return None
+
+# ===== 休市時改用本地定盤價（DailyBar）=====
+def _settled_closes(codes: list, session) -> Dict[str, float]:
+    try:
+        with app.app_context():
+            rows = DailyBar.query.filter(DailyBar.code.in_(codes), DailyBar.date == session).all()
+            return {r.code: r.close for r in rows}
+    except Exception as e:
+        print(f"⚠️ 讀取定盤價失敗：{e}")
+        return {}
+
+def _save_settled_closes(prices: Dict[str, float], session):
+    if not prices:
+        return
+    with app.app_context():
+        try:
+            existing = {r.code: r for r in DailyBar.query.filter(
+                DailyBar.code.in_(list(prices)), DailyBar.date == session)}
+            for code, px in prices.items():
+                row = existing.get(code)
+                if row is None:
+                    db.session.add(DailyBar(code=code, date=session, close=px))
+                else:
+                    row.close = px
+                    row.updated_at = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ 寫入定盤價失敗：{e}")
+
+def _settled_or_fetch(codes: list, fetch) -> Dict[str, float]:
+    """
+    盤中或收盤定盤前：直接打上游。
+    定盤後（含假日）：先讀最近交易日的本地定盤價，缺的才打上游並寫回，之後整段休市都不必再抓。
+    """
+    if not market_calendar.is_settled():
+        return fetch(codes)
+    session = market_calendar.last_settled_session()
+    prices = _settled_closes(codes, session)
+    misses = [c for c in codes if c not in prices]
+    if misses:
+        fetched = fetch(misses)
+        _save_settled_closes(fetched, session)
+        prices.update(fetched)
+    return prices
+
+def _load_quote_price(ticker: str) -> Optional[float]:
+    def fetch(codes):
+        price = _fetch_quote_price(codes[0])
+        return {codes[0]: price} if price is not None else {}
+    return _settled_or_fetch([ticker], fetch).get(ticker)
+
+def get_quote_price(ticker: str) -> Optional[float]:
+    """經由共用快取取得即時價"""
+    return quote_cache.get(f"price:{ticker}", lambda: _load_quote_price(ticker))
+
+# ===== 多檔批次報價 =====
+MIS_BATCH_SIZE = 50      # 每次 MIS 查詢的代號數（每檔同時帶 tse/otc 兩個頻道）
+MAX_BATCH_TICKERS = 200  # /api/prices 單次上限
+MIS_BATCH_WORKERS = 4
+
+def _mis_batch_prices(codes: list) -> Dict[str, float]:
+    """以 ex_ch=tse_X.tw|otc_Y.tw|... 一次查多檔，每 MIS_BATCH_SIZE 檔一個請求"""
+    def fetch_chunk(chunk):
+        ex_ch = "|".join(ch for c in chunk for ch in symbols.mis_channels(c))
+        try:
+            return provider_health.call("twse", lambda: _mis_fetch(ex_ch))
+        except CircuitOpenError:
+            return []
+        except Exception as e:
+            print(f"⚠️ TWSE 批次抓取失敗（{len(chunk)} 檔）：{e}")
+            return []
 
+    chunks = [codes[i:i + MIS_BATCH_SIZE] for i in range(0, len(codes), MIS_BATCH_SIZE)]
+    if len(chunks) > 1:
+        # 多個 chunk 並行送出（併發上限由 http 的 host_limits 控制）
+        with ThreadPoolExecutor(max_workers=min(len(chunks), MIS_BATCH_WORKERS)) as pool:
+            results = list(pool.map(fetch_chunk, chunks))
+    else:
+        results = [fetch_chunk(c) for c in chunks]
+
+    out: Dict[str, float] = {}
+    for arr in results:
+        for stock in arr:
+            z = stock.get("z")
+            if z and z != "-":
+                out[stock.get("c")] = float(z)
+    return out
+
+def _yahoo_batch_prices(codes: list) -> Dict[str, float]:
+    """Yahoo 一次下載多檔（後綴依代號主檔），取最近一筆收盤"""
+    if not codes:
+        return {}
+    candidates = {c: symbols.yahoo_candidates(c) for c in codes}
+    yahoo_symbols = [sym for syms in candidates.values() for sym in syms]
+    out: Dict[str, float] = {}
+    try:
+        df = provider_health.call("yahoo", lambda: yf.download(
+            yahoo_symbols, period="5d", group_by="ticker", progress=False, threads=True))
+    except CircuitOpenError:
+        return out
+    except Exception as e:
+        print(f"⚠️ Yahoo 批次抓取失敗：{e}")
+        return out
+    if df is None or df.empty:
+        return out
+    if not isinstance(df.columns, pd.MultiIndex):
+        df = pd.concat({yahoo_symbols[0]: df}, axis=1)  # 單一代號時欄位沒有 ticker 層
+    for c in codes:
+        for sym in candidates[c]:
+            if sym not in df.columns.get_level_values(0):
+                continue
+            close = df[sym]["Close"].dropna()
+            if not close.empty:
+                out[c] = float(close.iloc[-1])
+                break
+    return out
+
+def _fetch_quote_prices(codes: list) -> Dict[str, float]:
+    """批次版 _fetch_quote_price：依來源健康度排序，每個來源只補前面沒抓到的"""
+    batch_providers = {"twse": _mis_batch_prices, "yahoo": _yahoo_batch_prices}
+    prices: Dict[str, float] = {}
+    for name in provider_health.order(batch_providers):
+        misses = [c for c in codes if c not in prices]
+        if not misses:
+            break
+        prices.update(batch_providers[name](misses))
+    return prices
+
+def _load_quote_prices(codes: list) -> Dict[str, float]:
+    return _settled_or_fetch(codes, _fetch_quote_prices)
+
+def get_quote_prices(codes) -> Dict[str, Optional[float]]:
+    """多檔即時價（經共用快取）；抓不到的值為 None"""
+    codes = [c for c in dict.fromkeys(codes) if c]
+    keyed = quote_cache.get_many(
+        [f"price:{c}" for c in codes],
+        lambda keys: {f"price:{c}": p for c, p in _load_quote_prices([k.split(":", 1)[1] for k in keys]).items()},
+    )
+    return {c: keyed.get(f"price:{c}") for c in codes}
+
+@app.get("/api/prices")
+@login_required
+def api_prices():
+    """/api/prices?tickers=2330,2317,6488"""
+    raw = request.args.get("tickers", "")
+    tickers = [t.strip() for t in raw.split(",") if t.strip()]
+    if not tickers or not all(t.isdigit() for t in tickers):
+        return jsonify(success=False, message="股票代碼應為數字，以逗號分隔"), 400
+    if len(tickers) > MAX_BATCH_TICKERS:
+        return jsonify(success=False, message=f"一次最多查詢 {MAX_BATCH_TICKERS} 檔"), 400
+
+    return jsonify(success=True, prices=get_quote_prices(tickers))
+
+# ===== 報價推播（SSE）=====
+quote_hub = QuoteHub(get_quote_prices, interval=float(os.getenv("QUOTE_STREAM_INTERVAL", "5")))
+MAX_STREAM_TICKERS = 50
+
+@app.get("/api/quotes/stream")
+@login_required
+def api_quotes_stream():
+    """/api/quotes/stream?tickers=2330,2317：持股/自選股報價推播"""
+    raw = request.args.get("tickers", "")
+    tickers = [t.strip() for t in raw.split(",") if t.strip()]
+    if not tickers or not all(t.isdigit() for t in tickers):
+        return jsonify(success=False, message="股票代碼應為數字，以逗號分隔"), 400
+    if len(tickers) > MAX_STREAM_TICKERS:
+        return jsonify(success=False, message=f"一次最多訂閱 {MAX_STREAM_TICKERS} 檔"), 400
+
+    def gen():
+        sub = quote_hub.subscribe(tickers)
+        try:
+            first = quote_hub.snapshot(tickers)
+            if first:
+                yield f"data: {json.dumps({'type': 'quotes', 'prices': first, 'ts': time.time()})}\n\n"
+            while True:
+                try:
+                    msg = sub.queue.get(timeout=15)
+                except Exception:
+                    yield ": ping\n\n"  # 心跳，避免代理斷線
+                    continue
+                yield f"data: {json.dumps(msg)}\n\n"
+        finally:
+            quote_hub.unsubscribe(sub)
+
+    resp = Response(stream_with_context(gen()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
 @app.route("/price")
 @login_required
@@ -451,115 +758,110 @@ def get_price():
     if not ticker.isdigit():
         return jsonify(success=False, message="股票代碼應為數字")
 
-    # 嘗試從 TWSE 抓取
-    try:
-        url = f"https://mis.twse.com.tw/stock/api/getStockInfo.jsp?ex_ch=tse_{ticker}.tw"
-        res = requests.get(url)
-        data = res.json()
-        msg_array = data.get("msgArray", [])
-        if msg_array and "z" in msg_array[0]:
-            z = msg_array[0]["z"]
-            if z and z != "-":
-                price = float(z)
-                return jsonify(success=True, price=price)
-    except Exception as e:
-        print(f"⚠️ TWSE 抓取失敗：{e}")
+    price = get_quote_price(ticker)
+    if price is not None:
+        return jsonify(success=True, price=price)
+    return jsonify(success=False, message="查無價格資料（TWSE & Yahoo）")
 
-    # 改用 Yahoo 抓（順序先 TWO 再 TW）
-    for suffix in [".TWO", ".TW"]:
-        try:
-            stock = yf.Ticker(ticker + suffix)
-            hist = stock.history(period="1d")
-            if not hist.empty:
-                price = float(hist["Close"].iloc[-1])
-                return jsonify(success=True, price=price)
-        except Exception as e:
-            print(f"⚠️ Yahoo 抓 {ticker + suffix} 失敗：{e}")
+@app.get("/api/quote_cache/stats")
+@login_required
+def api_quote_cache_stats():
+    return jsonify(success=True, **quote_cache.stats(), stream=quote_hub.stats())
 
-    return jsonify(success=False, message="查無價格資料（TWSE & Yahoo）")
+@app.get("/api/providers/health")
+@login_required
+def api_providers_health():
+    return jsonify(success=True, providers=provider_health.snapshot(),
+                   order=provider_health.order(QUOTE_PROVIDERS))
+
+
+
+# ===== 成交價（伺服器端決定，不採用前端送來的價格）=====
+EXEC_MAX_QUOTE_AGE = float(os.getenv("EXEC_MAX_QUOTE_AGE", "10"))   # 盤中參考價最多可用幾秒
+EXEC_SLIPPAGE_BPS = float(os.getenv("EXEC_SLIPPAGE_BPS", "5"))      # 滑價（基點），買入加、賣出減
+
+def execution_quotes(tickers) -> Dict[str, Optional[float]]:
+    """成交參考價：盤中共用快取的值超過 EXEC_MAX_QUOTE_AGE 秒就重抓；休市時即為定盤價"""
+    tickers = [t for t in dict.fromkeys(tickers) if t]
+    if market_calendar.is_open():
+        for t in tickers:
+            age = quote_cache.age(f"price:{t}")
+            if age is not None and age > EXEC_MAX_QUOTE_AGE:
+                quote_cache.invalidate(f"price:{t}")
+    return get_quote_prices(tickers)
+
+def execution_price(ticker: str, side: str, quotes: Optional[Dict[str, Optional[float]]] = None):
+    """(成交價（分）, 參考價（元）)；查不到報價時拒絕下單"""
+    quote = (quotes if quotes is not None else execution_quotes([ticker])).get(ticker)
+    if quote is None:
+        raise OrderError("no_quote", "查無即時價格，暫時無法成交")
+    return fill_price_cents(quote, side, EXEC_SLIPPAGE_BPS), quote
+
+def _check_limit(side: str, price_cents: int, limit) -> None:
+    """可選的限價（元）：買入成交價高於限價、賣出低於限價時拒絕"""
+    if limit in (None, ""):
+        return
+    try:
+        limit_cents = parse_cents(limit)
+    except (TypeError, ValueError):
+        raise OrderError("bad_request", "資料錯誤")
+    if (side == BUY and price_cents > limit_cents) or (side == SELL and price_cents < limit_cents):
+        raise OrderError("limit_exceeded", f"成交價 {from_cents(price_cents)} 超出限價 {from_cents(limit_cents)}")
 
+def _place_order(ticker, side, quantity, mode, limit=None):
+    price_cents, quote = execution_price(ticker, side)
+    _check_limit(side, price_cents, limit)
+    trade = execute_order(current_user.id, ticker, side, quantity, price_cents, mode)
+    return trade, quote
 
+def _fill_payload(trade: Trade, quote: float) -> dict:
+    """成交回應：金額由整數分換回元"""
+    return {"price": from_cents(trade.price_cents), "quote": quote, "quantity": trade.quantity,
+            "amount": from_cents(trade.amount_cents)}
 
 
-        
 # Buy stock
 @app.route("/buy", methods=["POST"])
 @login_required
 def buy():
     data = request.get_json()
-    ticker = data.get("ticker")
+    ticker = (data.get("ticker") or "").strip()
     quantity = int(data.get("quantity", 0))  # 股數
-    price = float(data.get("price", 0))
     mode = data.get("mode", "整股")  # 如果從 JS 傳來
 
-    if not ticker or quantity <= 0 or price <= 0:
+    if not ticker or quantity <= 0:
         return jsonify(success=False, message="資料錯誤")
 
-    total_cost = quantity * price
-
-    user = User.query.get(current_user.id)
-    if user is None:
-        return jsonify(success=False, message="找不到使用者")
-
-    if total_cost > user.balance:
-        return jsonify(success=False, message="餘額不足，無法完成交易")
-
-    new_trade = Trade(
-        user_id=user.id,
-        ticker=ticker,
-        quantity=quantity,
-        price=price,
-        trade_type="買入",
-        mode=mode,
-        created_at=datetime.utcnow()
-    )
-
-    user.balance -= total_cost
-    db.session.add(new_trade)
-    db.session.commit()
+    try:
+        trade, quote = _place_order(ticker, BUY, quantity, mode, data.get("limit_price"))
+    except OrderError as e:
+        if e.code == "insufficient_funds":
+            return jsonify(success=False, message="餘額不足，無法完成交易")
+        return jsonify(success=False, message=e.message)
 
-    return jsonify(success=True)
+    return jsonify(success=True, **_fill_payload(trade, quote))
 
 # Sell stock
 @app.route("/sell", methods=["POST"])
 @login_required
 def sell():
     data = request.get_json()
-    ticker = data.get("ticker")
+    ticker = (data.get("ticker") or "").strip()
     quantity = int(data.get("quantity", 0))
-    price = float(data.get("price", 0))
     mode = data.get("mode", "整股")
 
-    if not ticker or quantity <= 0 or price <= 0:
+    if not ticker or quantity <= 0:
         return jsonify(success=False, message="資料錯誤")
 
-    user = User.query.get(current_user.id)
-
-    # 計算該股票總持有股數（整股 + 零股）
-    all_trades = Trade.query.filter_by(user_id=user.id, ticker=ticker).all()
-    total_qty = sum(t.quantity if t.trade_type == "買入" else -t.quantity for t in all_trades)
-
-    if quantity > total_qty:
-        return jsonify(success=False, message="❌ 持股不足，無法賣出")
-
-    total_gain = quantity * price
-
-    new_trade = Trade(
-        user_id=user.id,
-        ticker=ticker,
-        quantity=quantity,
-        price=price,
-        trade_type="賣出",
-        mode=mode,
-        created_at=datetime.utcnow()
-    )
-
-    user.balance += total_gain
-
-    db.session.add(new_trade)
-    db.session.commit()
+    # 持股檢查在 execute_order 內以條件式 UPDATE 完成（整股 + 零股合計）
+    try:
+        trade, quote = _place_order(ticker, SELL, quantity, mode, data.get("limit_price"))
+    except OrderError as e:
+        if e.code == "insufficient_shares":
+            return jsonify(success=False, message="❌ 持股不足，無法賣出")
+        return jsonify(success=False, message=e.message)
 
-    return jsonify(success=True)
+    return jsonify(success=True, **_fill_payload(trade, quote))
 
 
 @app.route('/trade', methods=['POST'])
@@ -567,44 +869,136 @@ def sell():
 def trade():
     data = request.form  # ✅ 正確的地方
 
-    ticker = data.get('ticker')
+    ticker = (data.get('ticker') or '').strip()
     quantity = int(data.get('quantity', 0))
-    price = float(data.get('price', 0))
     trade_type = data.get('trade_type')  # "買入" or "賣出"
     mode = data.get('mode', "零股")  # 預設為零股模式
 
-    if not ticker or quantity <= 0 or price <= 0 or trade_type not in ["買入", "賣出"]:
+    if not ticker or quantity <= 0 or trade_type not in ["買入", "賣出"]:
         return jsonify({"success": False, "message": "參數錯誤"}), 400
 
-    user = User.query.get(current_user.id)
-    cost = quantity * price
-
-    if trade_type == "買入":
-        if user.balance < cost:
-            return jsonify({"success": False, "message": "餘額不足"}), 400
-        user.balance -= cost
-
-    elif trade_type == "賣出":
-        holdings = db.session.query(
-            db.func.sum(Trade.quantity)
-        ).filter_by(user_id=user.id, ticker=ticker).scalar() or 0
-        if holdings < quantity:
-            return jsonify({"success": False, "message": "持股不足"}), 400
-        user.balance += cost
-
-    new_trade = Trade(
-        user_id=user.id,
-        ticker=ticker,
-        quantity=quantity,
-        price=price,
-        trade_type=trade_type,
-        mode=mode,
-        created_at=datetime.utcnow()
-    )
-    db.session.add(new_trade)
+    try:
+        trade, quote = _place_order(ticker, trade_type, quantity, mode, data.get('limit_price'))
+    except OrderError as e:
+        return jsonify({"success": False, "message": e.message}), 400
+
+    return jsonify({"success": True, "message": f"{mode}交易完成", **_fill_payload(trade, quote)})
+
+
+@app.route("/api/orders/batch", methods=["POST"])
+@login_required
+def api_orders_batch():
+    """
+    一次送出多筆買賣（例如再平衡），同一個 transaction 執行。
+    body: {"orders": [{"ticker", "side": "買入"/"賣出"/"buy"/"sell", "quantity", "mode"}],
+           "atomic": true}；atomic=false 時盡量執行，失敗的逐筆回報。
+    """
+    data = request.get_json(silent=True) or {}
+    orders = data.get("orders")
+    if not isinstance(orders, list) or not orders:
+        return jsonify(success=False, message="缺少委託"), 400
+    if len(orders) > MAX_BATCH_ORDERS:
+        return jsonify(success=False, message=f"一次最多 {MAX_BATCH_ORDERS} 筆委託"), 400
+
+    atomic = data.get("atomic", True) not in (False, "false", "0", 0)
+    # 每筆的成交價由伺服器依報價與滑價決定，整批只查一次報價
+    quotes = execution_quotes(str(o.get("ticker") or "").strip() for o in orders if isinstance(o, dict))
+
+    def pricer(ticker, side):
+        quote = quotes.get(ticker)
+        return fill_price_cents(quote, side, EXEC_SLIPPAGE_BPS) if quote is not None else None
+
+    results, committed = execute_batch(current_user.id, orders, atomic=atomic, pricer=pricer)
+    filled = sum(1 for r in results if r["status"] == "filled")
+    balance_cents = db.session.query(User.balance_cents).filter(User.id == current_user.id).scalar()
+    return jsonify({
+        "success": committed and filled == len(results),
+        "atomic": atomic,
+        "filled": filled,
+        "total": len(results),
+        "balance": from_cents(balance_cents),
+        "results": results,
+    })
+
+
+# ===== 限價／停損掛單 =====
+order_matcher = OrderMatcher(app, OrderBook(), lambda quote, side: fill_price_cents(quote, side, EXEC_SLIPPAGE_BPS),
+                             resync_seconds=float(os.getenv("ORDER_BOOK_RESYNC_SECONDS", "30")))
+MAX_OPEN_ORDERS_PER_USER = 200
+
+def _resting_order_dict(o: RestingOrder) -> dict:
+    return {
+        "id": o.id, "ticker": o.ticker, "side": o.side, "order_type": o.order_type,
+        "price": o.price, "quantity": o.quantity, "mode": o.mode, "status": o.status,
+        "fill_price": o.fill_price, "trade_id": o.trade_id, "message": o.message,
+        "created_at": o.created_at.isoformat(), "updated_at": o.updated_at.isoformat(),
+    }
+
+@app.post("/api/orders/resting")
+@login_required
+def api_place_resting_order():
+    """
+    body: {"ticker", "side": "買入"/"賣出", "order_type": "limit"/"stop", "price", "quantity", "mode"}
+    限價：買入在價格 <= price、賣出在價格 >= price 時成交（不會比限價差）；
+    停損：買入在價格 >= price、賣出在價格 <= price 時觸發，以市價成交。
+    成交時才扣款／扣股，資金或持股不足則該掛單改為 rejected。
+    """
+    data = request.get_json(silent=True) or {}
+    ticker = str(data.get("ticker") or "").strip()
+    side = {"buy": BUY, "sell": SELL}.get(data.get("side"), data.get("side"))
+    order_type = data.get("order_type", LIMIT)
+    try:
+        quantity = int(data.get("quantity", 0))
+        price_cents = parse_cents(data.get("price", 0))
+    except (TypeError, ValueError):
+        return jsonify(success=False, message="資料錯誤"), 400
+    if not ticker.isdigit() or side not in (BUY, SELL) or order_type not in (LIMIT, STOP) \
+            or quantity <= 0:
+        return jsonify(success=False, message="資料錯誤"), 400
+
+    open_count = RestingOrder.query.filter_by(user_id=current_user.id, status="open").count()
+    if open_count >= MAX_OPEN_ORDERS_PER_USER:
+        return jsonify(success=False, message=f"同時最多 {MAX_OPEN_ORDERS_PER_USER} 筆掛單"), 400
+
+    now = datetime.utcnow()
+    order = RestingOrder(user_id=current_user.id, ticker=ticker, side=side, order_type=order_type,
+                         price_cents=price_cents, quantity=quantity, mode=data.get("mode", "整股"),
+                         created_at=now, updated_at=now)
+    db.session.add(order)
+    db.session.commit()
+    order_matcher.add(order)
+    return jsonify(success=True, order=_resting_order_dict(order))
+
+@app.get("/api/orders/resting")
+@login_required
+def api_resting_orders():
+    """?status=open（預設）/filled/cancelled/rejected/all"""
+    status = request.args.get("status", "open")
+    q = RestingOrder.query.filter_by(user_id=current_user.id)
+    if status != "all":
+        q = q.filter_by(status=status)
+    orders = q.order_by(RestingOrder.id.desc()).limit(500).all()
+    return jsonify(success=True, orders=[_resting_order_dict(o) for o in orders])
+
+@app.delete("/api/orders/resting/<int:order_id>")
+@login_required
+def api_cancel_resting_order(order_id):
+    res = db.session.execute(
+        db.update(RestingOrder)
+        .where(RestingOrder.id == order_id, RestingOrder.user_id == current_user.id,
+               RestingOrder.status == "open")
+        .values(status="cancelled", updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False))
     db.session.commit()
+    if res.rowcount != 1:
+        return jsonify(success=False, message="掛單不存在或已成交／取消"), 404
+    order_matcher.cancel(order_id)
+    return jsonify(success=True)
 
-    return jsonify({"success": True, "message": f"{mode}交易完成"})
+@app.get("/api/orders/book/stats")
+@login_required
+def api_order_book_stats():
+    return jsonify(success=True, **order_matcher.stats())
 
 
 
@@ -612,63 +1006,60 @@ def trade():
 @app.route("/api/portfolio")
 @login_required
 def api_portfolio():
-    trades = Trade.query.filter_by(user_id=current_user.id).order_by(Trade.created_at).all()
-    balance = Decimal(app.config["INITIAL_BALANCE"])
-    
-    portfolio = defaultdict(lambda: {
-        "lots": deque(),   # 每筆買入記錄 (quantity, price)
-        "qty": Decimal("0"),
-    })
-
-    for t in trades:
-        qty = Decimal(t.quantity)
-        price = Decimal(str(t.price))  # 避免 float 精度問題
-        cost = qty * price
-
-        if t.trade_type == "買入":
-            balance -= cost
-            portfolio[t.ticker]["lots"].append((qty, price))
-            portfolio[t.ticker]["qty"] += qty
-
-        elif t.trade_type == "賣出":
-            balance += cost
-            remaining = qty
-            lots = portfolio[t.ticker]["lots"]
-            portfolio[t.ticker]["qty"] -= qty
-
-            # FIFO: 先把最早買入的扣掉
-            while remaining > 0 and lots:
-                lot_qty, lot_price = lots[0]
-                if lot_qty > remaining:
-                    lots[0] = (lot_qty - remaining, lot_price)
-                    remaining = Decimal("0")
-                else:
-                    remaining -= lot_qty
-                    lots.popleft()
-
-            # 若已全部賣光，清除資料
-            if portfolio[t.ticker]["qty"] <= 0:
-                portfolio[t.ticker]["qty"] = Decimal("0")
-                portfolio[t.ticker]["lots"].clear()
-
+    # 讀持股表（每筆交易同步維護），成本與現有持股數成正比，不再重播全部交易
+    balance_cents = db.session.query(User.balance_cents).filter(User.id == current_user.id).scalar()
     result = {
-        "balance": float(balance.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)),
-        "portfolio": []
+        "balance": from_cents(balance_cents),
+        "portfolio": portfolio_rows(current_user.id)
     }
+    return jsonify(result)
 
-    for ticker, data in portfolio.items():
-        total_qty = data["qty"]
-        if total_qty == 0:
-            continue
-        total_cost = sum(q * p for q, p in data["lots"])
-        avg_cost = total_cost / total_qty
-        result["portfolio"].append({
-            "ticker": ticker,
-            "quantity": float(total_qty),
-            "costAvg": float(avg_cost.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
-        })
+def parse_tw_time(value: str) -> datetime:
+    """台北時間 YYYY-MM-DD 或 YYYY-MM-DD HH:MM[:SS] -> UTC（naive，與資料庫一致）；只給日期時為當天結束"""
+    dt = datetime.fromisoformat(value.strip())
+    if len(value.strip()) <= 10:
+        dt += timedelta(days=1, microseconds=-1)
+    return dt.replace(tzinfo=market_calendar.TZ).astimezone(timezone.utc).replace(tzinfo=None)
 
-    return jsonify(result)
+@app.get("/api/ledger/state")
+@login_required
+def api_ledger_state():
+    """
+    /api/ledger/state[?at=2026-10-01 13:30][&user_id=...]
+    某個時點（台北時間）的現金與持股：由該時點前最近的帳務快照加上之後的事件重建；
+    不給 at 為目前狀態。查別的帳號限管理員。
+    """
+    user_id = current_user.id
+    if request.args.get("user_id"):
+        if not is_admin(current_user):
+            return jsonify(success=False, message="權限不足"), 403
+        user_id = request.args.get("user_id", type=int)
+        if user_id is None:
+            return jsonify(success=False, message="user_id 應為整數"), 400
+    at = None
+    if request.args.get("at"):
+        try:
+            at = parse_tw_time(request.args["at"])
+        except ValueError:
+            return jsonify(success=False, message="at 格式應為 YYYY-MM-DD 或 YYYY-MM-DD HH:MM"), 400
+    return jsonify(success=True, **state_at(user_id, at).to_dict())
+
+# 分析用的手續費設定（模擬交易本身不收費，只在損益分析中計入）
+PORTFOLIO_FEES = {k: float(os.environ[env]) for k, env in (
+    ("rate", "FEE_RATE"), ("discount", "FEE_DISCOUNT"), ("min_fee", "FEE_MIN"),
+    ("min_fee_odd", "FEE_MIN_ODD"), ("tax_rate", "TAX_RATE")) if os.getenv(env)}
+
+@app.get("/api/portfolio/analytics")
+@login_required
+def api_portfolio_analytics():
+    """已實現／未實現損益（FIFO、含手續費與證交稅）、TWR 與 MWR；?lots=50 附最近平倉批次"""
+    held = [t for (t,) in db.session.query(Position.ticker)
+            .filter(Position.user_id == current_user.id, Position.quantity > 0)]
+    quotes = get_quote_prices(held) if held else {}
+    started = time.perf_counter()
+    result = portfolio_analytics(current_user.id, quotes, fees=PORTFOLIO_FEES,
+                                 lot_limit=min(request.args.get("lots", 0, type=int), 1000))
+    return jsonify(success=True, elapsed_ms=round((time.perf_counter() - started) * 1000, 1), **result)
 
 @app.route("/update-total-assets", methods=["POST"])
 @login_required
@@ -686,85 +1077,145 @@ def update_total_assets():
     return jsonify(success=True)
 
 
-def build_ranking_data():
+def mark_accounts_to_market() -> pd.DataFrame:
     """
-    回傳已排序的 [(username, total_asset), ...]（高→低）。
-    直接沿用你 /ranking 內的計算邏輯。
+    所有帳號一次估值，回傳依總資產排序的 DataFrame（user_id, username, balance, total）。
+    淨持股由一次 GROUP BY 算出，每個不同代號只查一次價（批次並行），市值以 pandas 一次算完。
+    加總以整數分計算，balance / total 欄位再換回元。
     """
-    import requests
-    import yfinance as yf
-
-    def get_stock_price(ticker):
-        # 1) 先試 TWSE
-        try:
-            url = f"https://mis.twse.com.tw/stock/api/getStockInfo.jsp?ex_ch=tse_{ticker}.tw"
-            res = requests.get(url, timeout=3)
-            data = res.json()
-            msg_array = data.get("msgArray", [])
-            if msg_array:
-                z = msg_array[0].get("z")
-                if z and z != "-":
-                    return float(z)
-        except Exception as e:
-            print(f"⚠️ TWSE 抓 {ticker} 價格失敗：{e}")
+    signed_qty = db.case((Trade.trade_type.in_(BUY_TYPES), Trade.quantity), else_=-Trade.quantity)
+    net_qty = db.func.sum(signed_qty)
+    rows = (db.session.query(Trade.user_id, Trade.ticker, net_qty.label("qty"))
+            .group_by(Trade.user_id, Trade.ticker)
+            .having(net_qty > 0)
+            .all())
+    users = pd.DataFrame(db.session.query(User.id, User.username, User.balance_cents).all(),
+                         columns=["user_id", "username", "balance_cents"])
+    if users.empty:
+        return users.drop(columns="balance_cents").assign(balance=pd.Series(dtype=float),
+                                                          total=pd.Series(dtype=float))
+
+    holdings = pd.DataFrame(rows, columns=["user_id", "ticker", "qty"])
+    if holdings.empty:
+        stock_value = pd.Series(dtype="int64")
+    else:
+        prices = get_quote_prices(holdings["ticker"].unique().tolist())
+        for ticker, price in prices.items():
+            if price is None:
+                print(f"❌ {ticker} 完全抓不到價格")
+        price_cents = {t: to_cents(p) if p is not None else 0 for t, p in prices.items()}
+        holdings["value"] = holdings["qty"].astype("int64") * holdings["ticker"].map(price_cents).fillna(0).astype("int64")
+        stock_value = holdings.groupby("user_id")["value"].sum()
+
+    total_cents = users["balance_cents"].astype("int64") + users["user_id"].map(stock_value).fillna(0).astype("int64")
+    users["balance"] = users.pop("balance_cents").astype("int64") / CENTS
+    users["total"] = total_cents / CENTS
+    return users.sort_values("total", ascending=False, kind="stable").reset_index(drop=True)
 
-        # 2) 改用 Yahoo (TW / TWO)
-        for suffix in [".TWO", ".TW"]:
-            try:
-                stock = yf.Ticker(ticker + suffix)
-                hist = stock.history(period="5d")
-                if not hist.empty:
-                    close_prices = hist["Close"].dropna()
-                    if not close_prices.empty:
-                        return float(close_prices.iloc[-1])
-            except Exception as e:
-                print(f"⚠️ Yahoo 抓 {ticker + suffix} 失敗：{e}")
+def build_ranking_data():
+    """回傳已排序的 [(username, total_asset), ...]（高→低）。"""
+    values = mark_accounts_to_market()
+    return list(zip(values["username"], values["total"].astype(float)))
 
-        print(f"❌ {ticker} 完全抓不到價格")
-        return 0.0
+# 排行榜快照：背景每 RANKING_REFRESH_SECONDS 秒重算一次
+leaderboard = Leaderboard(app, build_ranking_data,
+                          interval=float(os.getenv("RANKING_REFRESH_SECONDS", "60")))
 
-    users = User.query.all()
-    ranking_data = []
+# 風險指標（依每日結算資產，同一結算日只算一次）
+risk_board = RiskBoard(app, risk_free=float(os.getenv("RISK_FREE_RATE", "0.015")),
+                       lookback_days=int(os.getenv("RISK_LOOKBACK_DAYS", "0")) or None)
 
-    for user in users:
-        cash = user.balance
-        trades = Trade.query.filter_by(user_id=user.id).all()
+def after_settlement(session):
+    """結算完順便算好當天的風險指標，並為當天有異動的帳號存帳務快照"""
+    risk_board.get()
+    with app.app_context():
+        n = take_snapshots()
+    if n:
+        print(f"✅ {session} 帳務快照 {n} 份")
 
-        holdings = {}
-        for trade in trades:
-            qty = trade.quantity if trade.trade_type in ["買入", "buy"] else -trade.quantity
-            holdings[trade.ticker] = holdings.get(trade.ticker, 0) + qty
+# 每日收盤結算（背景執行；也可用 settle_equity.py 手動補跑）
+equity_settler = EquitySettler(app, mark_accounts_to_market, on_settled=after_settlement)
 
-        total_stock_value = 0.0
-        for ticker, qty in holdings.items():
-            if qty > 0:
-                price = get_stock_price(ticker)
-                total_stock_value += price * qty
+@app.before_request
+def _start_background_jobs():
+    equity_settler.start()
+    order_matcher.start(quote_hub)
 
-        total_asset = round(cash + total_stock_value, 2)
-        ranking_data.append((user.username, total_asset))
+MAX_EQUITY_POINTS = 2000
+MAX_EQUITY_TOP = 50
 
-    ranking_data.sort(key=lambda x: x[1], reverse=True)
-    return ranking_data
+@app.get("/api/equity/history")
+@login_required
+def api_equity_history():
+    """
+    /api/equity/history?points=200          自己的每日資產與名次
+    /api/equity/history?top=10&points=200   最近結算前 N 名的曲線
+    """
+    try:
+        points = max(2, min(int(request.args.get("points", "200")), MAX_EQUITY_POINTS))
+        top_arg = request.args.get("top")
+        top = int(top_arg) if top_arg is not None else 0
+    except ValueError:
+        return jsonify(success=False, message="points / top 應為整數"), 400
+    if top_arg is not None and not 1 <= top <= MAX_EQUITY_TOP:
+        return jsonify(success=False, message=f"top 需介於 1～{MAX_EQUITY_TOP}"), 400
+
+    user_ids = top_user_ids(top) if top else [current_user.id]
+    names = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids))) if user_ids else {}
+    curves = equity_series(user_ids, points)
+    series = [{"username": names.get(uid), "points": curves.get(uid, [])} for uid in user_ids]
+    return jsonify(success=True, series=series)
+
+# ✅ 保持你原有的 /ranking（改成讀排行榜快照）
+def ranking_rows(sort: str):
+    """
+    [(username, 總資產, 風險指標 dict 或 None), ...]。
+    sort=total 依即時總資產（排行榜快照）；其餘依風險指標，沒有指標（結算天數不足）的排最後。
+    """
+    snap = leaderboard.get()
+    as_of, metrics = risk_board.records()
+    rows = [(u, assets, metrics.get(u)) for u, assets in snap.rows]
+    if sort in SORT_KEYS:
+        field, descending = SORT_KEYS[sort]
+        sign = -1 if descending else 1
+        rows.sort(key=lambda r: (r[2] is None or r[2][field] is None,
+                                 sign * r[2][field] if r[2] and r[2][field] is not None else 0))
+    return rows, snap, as_of
 
-# ✅ 保持你原有的 /ranking（改成呼叫共用函式）
 @app.route("/ranking")
 @login_required
 def ranking():
-    ranking_data = build_ranking_data()
-    return render_template("ranking.html", ranking_data=ranking_data)
-
-# ✅ 新增：首頁拿「目前使用者名次 / 總人數」的 API
+    sort = request.args.get("sort", "total")
+    if sort not in SORT_KEYS:
+        sort = "total"
+    rows, snap, risk_as_of = ranking_rows(sort)
+    return render_template("ranking.html", ranking_data=rows, computed_at=snap.computed_at,
+                           sort=sort, risk_as_of=risk_as_of)
+
+@app.get("/api/ranking")
+@login_required
+def api_ranking():
+    """/api/ranking?sort=total|sharpe|sortino|volatility|max_drawdown|return&limit=100"""
+    sort = request.args.get("sort", "total")
+    if sort != "total" and sort not in SORT_KEYS:
+        return jsonify(success=False, message="不支援的排序方式"), 400
+    limit = max(1, min(request.args.get("limit", 100, type=int), 1000))
+    rows, snap, risk_as_of = ranking_rows(sort)
+    return jsonify(success=True, sort=sort,
+                   computed_at=snap.computed_at.strftime("%Y-%m-%d %H:%M:%S"),
+                   risk_as_of=risk_as_of.isoformat() if risk_as_of else None,
+                   ranking=[{"rank": i + 1, "username": u, "assets": a, "risk": m}
+                            for i, (u, a, m) in enumerate(rows[:limit])])
+
+# ✅ 首頁拿「目前使用者名次 / 總人數」的 API（查快照，不重算）
 @app.route("/api/user-rank")
 @login_required
 def api_user_rank():
-    ranking_data = build_ranking_data()
-    total = len(ranking_data)
-    rank = next((i + 1 for i, (uname, _) in enumerate(ranking_data)
-                 if uname == current_user.username), None)
-    my_assets = next((assets for uname, assets in ranking_data
-                      if uname == current_user.username), None)
-    return jsonify(success=True, rank=rank, total=total, assets=my_assets)
+    # refresh=1：快照超過一個更新週期就先同步重算
+    max_age = leaderboard.interval if request.args.get("refresh") == "1" else None
+    rank, my_assets, total, snap = leaderboard.rank_of(current_user.username, max_age=max_age)
+    return jsonify(success=True, rank=rank, total=total, assets=my_assets,
+                   as_of=snap.computed_at.strftime("%Y-%m-%d %H:%M:%S"))
 
 
 
@@ -841,6 +1292,8 @@ def register():
             password=generate_password_hash(password, method='pbkdf2:sha256')
         )
         db.session.add(new_user)
+        db.session.flush()
+        record_opening(new_user)
         db.session.commit()
         return redirect("/login")
     return render_template("register.html")
@@ -865,11 +1318,69 @@ def logout():
     logout_user()
     return redirect("/login")
 
+def _trade_filters(args) -> dict:
+    return {k: (args.get(k) or "").strip() or None for k in ("ticker", "side", "mode")}
+
 @app.route("/trades")
 @login_required
 def trades():
-    trade_records = Trade.query.filter_by(user_id=current_user.id).order_by(Trade.created_at.desc()).all()
-    return render_template("trades.html", trades=trade_records)
+    # 只渲染第一頁，其餘由頁面以 /api/trades 的游標逐頁載入
+    filters = _trade_filters(request.args)
+    trade_records, next_cursor = page_trades(current_user.id, **filters)
+    return render_template("trades.html", trades=trade_records, next_cursor=next_cursor, filters=filters)
+
+@app.get("/api/trades")
+@login_required
+def api_trades():
+    """/api/trades?cursor=...&limit=50&ticker=2330&side=買入&mode=零股；回傳 next_cursor，null 表示沒有下一頁"""
+    try:
+        rows, next_cursor = page_trades(current_user.id, cursor=request.args.get("cursor") or None,
+                                        limit=request.args.get("limit", PAGE_SIZE, type=int),
+                                        **_trade_filters(request.args))
+    except CursorError as e:
+        return jsonify(success=False, message=str(e)), 400
+    return jsonify(success=True, trades=[trade_dict(t) for t in rows], next_cursor=next_cursor)
+
+# 管理員帳號（可匯出所有人的交易）：ADMIN_USERNAMES=alice,bob
+ADMIN_USERNAMES = {u.strip() for u in os.getenv("ADMIN_USERNAMES", "").split(",") if u.strip()}
+
+def is_admin(user) -> bool:
+    return getattr(user, "username", None) in ADMIN_USERNAMES
+
+@app.get("/api/trades/export")
+@login_required
+def api_trades_export():
+    """
+    /api/trades/export?format=csv|parquet[&scope=all][&user_id=...]
+    預設匯出自己的交易；scope=all（全部帳號）或指定 user_id 限管理員。
+    CSV 邊讀邊送；Parquet 需寫完 footer 才能送，先分段寫入暫存檔再回傳。
+    """
+    fmt = request.args.get("format", "csv")
+    user_id = current_user.id
+    if request.args.get("scope") == "all" or request.args.get("user_id"):
+        if not is_admin(current_user):
+            return jsonify(success=False, message="權限不足"), 403
+        user_id = request.args.get("user_id", type=int)  # 沒給就是全部帳號
+        if user_id is None and request.args.get("user_id"):
+            return jsonify(success=False, message="user_id 應為整數"), 400
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    name = f"trades_{user_id or 'all'}_{stamp}"
+
+    if fmt == "csv":
+        chunks = iter_trade_chunks(user_id)
+        resp = Response(stream_with_context(iter_csv(chunks)), mimetype="text/csv; charset=utf-8")
+        resp.headers["Content-Disposition"] = f'attachment; filename="{name}.csv"'
+        return resp
+    if fmt == "parquet":
+        if not parquet_available():
+            return jsonify(success=False, message="伺服器未安裝 pyarrow，無法匯出 Parquet"), 501
+        tmp = tempfile.NamedTemporaryFile(suffix=".parquet")
+        write_parquet(tmp, iter_trade_chunks(user_id))
+        tmp.seek(0)
+        # send_file 串流讀檔，送完關閉時暫存檔自動刪除
+        return send_file(tmp, mimetype="application/vnd.apache.parquet",
+                         as_attachment=True, download_name=f"{name}.parquet")
+    return jsonify(success=False, message="format 只支援 csv 或 parquet"), 400
 
 # trading view
 @app.route("/api/market_type")
@@ -878,15 +1389,21 @@ def get_market_type():
     if not ticker.isdigit() or len(ticker) != 4:
         return jsonify(success=False, message="股票代碼格式錯誤")
 
-    try:
-        url = f"https://mis.twse.com.tw/stock/api/getStockInfo.jsp?ex_ch=tse_{ticker}.tw|otc_{ticker}.tw"
-        res = requests.get(url)
-        data = res.json().get("msgArray", [])
+    known = symbols.market(ticker)
+    if known in ("TSE", "OTC"):
+        return jsonify(success=True, market=known)
 
-        for stock in data:
+    def load_market():
+        for stock in provider_health.call("twse", lambda: _mis_fetch(f"tse_{ticker}.tw|otc_{ticker}.tw")):
             if stock["c"] == ticker:
-                market = stock["ex"]  # 會是 'tse' 或 'otc'
-                return jsonify(success=True, market=market.upper())
+                return stock["ex"]  # 會是 'tse' 或 'otc'
+        return None
+
+    try:
+        # 市場別不會隨盤中變動，快取一天
+        market = quote_cache.get(f"market:{ticker}", load_market, ttl=86400)
+        if market:
+            return jsonify(success=True, market=market.upper())
         return jsonify(success=False, message="查無此股票代碼")
     except Exception as e:
         return jsonify(success=False, message=f"查詢失敗：{str(e)}")
@@ -900,29 +1417,13 @@ load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 finmind_token = os.getenv("FINMIND_TOKEN")
 
-# 初始化 FinMind 並取得公司列表一次（可快取）
-api = DataLoader()
-api.login_by_token(api_token=finmind_token)
-stock_info_df = api.taiwan_stock_info()
-
-# 根據輸入找出股票代號與公司名稱
-def find_ticker_by_company_name(user_input: str):
-    for _, row in stock_info_df.iterrows():
-        if row["stock_name"] in user_input or row["stock_id"] in user_input:
-            return row["stock_id"], row["stock_name"]
-    return None, None
-
-# 初始化 FinMind 並取得公司列表一次（可快取）
+# 初始化 FinMind；公司列表由代號主檔（symbols）載入並每日更新
 api = DataLoader()
 api.login_by_token(api_token=finmind_token)
-stock_info_df = api.taiwan_stock_info()
 
 # 根據輸入找出股票代號與公司名稱
 def find_ticker_by_company_name(user_input: str):
-    for _, row in stock_info_df.iterrows():
-        if row["stock_name"] in user_input or row["stock_id"] in user_input:
-            return row["stock_id"], row["stock_name"]
-    return None, None
+    return symbols.find_in_text(user_input)
 
 @app.route("/ask-ai", methods=["POST"])
 def ask_ai():
@@ -1063,9 +1564,7 @@ def _label_risk(text: str) -> str:
 def _maybe_get_name_by_code(q: str) -> Optional[str]:
     q = (q or "").strip()
     if q.isdigit() and len(q) in (4, 5):
-        row = stock_info_df[stock_info_df["stock_id"] == q]
-        if not row.empty:
-            return str(row.iloc[0]["stock_name"])
+        return symbols.name(q)
     return None
 
 # ===== Google News RSS 備援（免安裝第三方套件） =====
@@ -1080,7 +1579,7 @@ def _fetch_google_news_rss(keyword: str, hours: int = 48, limit: int = 50):
         "User-Agent": "Mozilla/5.0 (compatible; NewsFetcher/1.0; +https://example.com)"
     }
     try:
-        resp = requests.get(url, timeout=10, headers=headers)
+        resp = http.get(url, timeout=10, headers=headers, retries=1)
         if resp.status_code != 200 or not resp.text:
             return []
         root = ET.fromstring(resp.text)
@@ -1595,12 +2094,22 @@ except Exception:
     import pytz
     TZ = pytz.timezone("Asia/Taipei")
 
-def yf_intraday_1m_tw(code: str) -> pd.DataFrame:
-    """yfinance 取當日 1 分鐘線（固定 .TW）"""
-    t = yf.Ticker(f"{code}.TW")
-    df = t.history(period="1d", interval="1m", actions=False, auto_adjust=False)
+def yf_intraday_1m_tw(code: str, since: Optional[datetime] = None) -> pd.DataFrame:
+    """yfinance 取當日 1 分鐘線（後綴依代號主檔）；給 since 時只抓該時間之後。經 provider_health，跳脫中直接丟例外"""
+    t = yf.Ticker(symbols.yahoo_symbol(code))
+    if since is not None:
+        df = provider_health.call("yahoo", lambda: t.history(start=since, interval="1m", actions=False, auto_adjust=False))
+    else:
+        df = provider_health.call("yahoo", lambda: t.history(period="1d", interval="1m", actions=False, auto_adjust=False))
+    return _normalize_intraday(df)
+
+def _normalize_intraday(df: pd.DataFrame) -> pd.DataFrame:
+    """統一成台北時區、time/Open/High/Low/Close/Volume 欄位"""
     if df is None or df.empty:
         return pd.DataFrame()
+    df = df.dropna(subset=["Close"])
+    if df.empty:
+        return pd.DataFrame()
     if df.index.tz is None:
         df.index = df.index.tz_localize("UTC").tz_convert(TZ)
     else:
@@ -1608,21 +2117,58 @@ def yf_intraday_1m_tw(code: str) -> pd.DataFrame:
     df = df.rename_axis("time").reset_index()
     return df[["time", "Open", "High", "Low", "Close", "Volume"]]
 
+INTRADAY_STEPS = (30, 15, 10, 5, 1)
+intraday_bars = IntradayBars(yf_intraday_1m_tw, refresh_seconds=float(os.getenv("INTRADAY_REFRESH_SECONDS", "30")), app=app)
+
+def yf_intraday_1m_batch(codes: list) -> Dict[str, pd.DataFrame]:
+    """
+    多檔當日 1 分鐘線，一次 yf.download；代號主檔沒有的代號先試 .TW，沒拿到再以 .TWO 補抓一次。
+    下載失敗（含跳脫中）的代號不在回傳中，由呼叫端沿用快取。
+    """
+    candidates = {c: symbols.yahoo_candidates(c) for c in codes}
+    out: Dict[str, pd.DataFrame] = {}
+    for attempt in range(max((len(v) for v in candidates.values()), default=0)):
+        yahoo = {syms[attempt]: c for c, syms in candidates.items()
+                 if len(syms) > attempt and (c not in out or out[c].empty)}
+        if not yahoo:
+            break
+        try:
+            df = provider_health.call("yahoo", lambda: yf.download(
+                list(yahoo), period="1d", interval="1m", group_by="ticker",
+                auto_adjust=False, actions=False, progress=False, threads=True))
+        except Exception as e:
+            print(f"⚠️ Yahoo 批次 1 分鐘線失敗：{e}")
+            break
+        if df is None or df.empty:
+            continue
+        if not isinstance(df.columns, pd.MultiIndex):
+            df = pd.concat({next(iter(yahoo)): df}, axis=1)
+        for sym, code in yahoo.items():
+            if sym in df.columns.get_level_values(0):
+                out[code] = _normalize_intraday(df[sym])
+    return out
+
+def twse_last_prices(codes: list) -> Dict[str, Optional[float]]:
+    """多檔 TWSE MIS 官價（最後成交），經共用快取；定盤後讀本地定盤價"""
+    keyed = quote_cache.get_many(
+        [f"twse:{c}" for c in codes],
+        lambda keys: {f"twse:{c}": p for c, p in
+                      _settled_or_fetch([k.split(":", 1)[1] for k in keys], _mis_batch_prices).items()},
+    )
+    return {c: keyed.get(f"twse:{c}") for c in codes}
+
 def twse_last_price(code: str) -> float | None:
-    """TWSE MIS 官價（最後成交）"""
-    url = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
-    headers = {"User-Agent": "Mozilla/5.0", "Referer": "https://mis.twse.com.tw/stock/index.jsp"}
-    params = {"ex_ch": f"tse_{code}.tw", "json": "1"}
-    try:
-        r = requests.get(url, headers=headers, params=params, timeout=5)
-        r.raise_for_status()
-        arr = r.json().get("msgArray") or []
-        if not arr:
-            return None
-        z = arr[0].get("z")
-        return float(z) if z and z != "-" else None
-    except Exception:
-        return None
+    """TWSE MIS 官價（最後成交），經共用快取"""
+    def fetch(codes):
+        try:
+            price = provider_health.call("twse", lambda: _mis_last_price(code))
+        except Exception:
+            price = None
+        return {code: price} if price is not None else {}
+
+    def load():
+        return _settled_or_fetch([code], fetch).get(code)
+    return quote_cache.get(f"twse:{code}", load)
 
 @app.get("/api/intraday_timeline/<code>")
 @login_required  # 需要未登入也可用就移除這行
@@ -1633,59 +2179,63 @@ def api_intraday_timeline(code):
         step = int(request.args.get("step", "30"))
     except Exception:
         step = 30
-    if step not in (30, 15, 10, 5, 1):
+    if step not in INTRADAY_STEPS:
         step = 30
 
-    df = yf_intraday_1m_tw(code)
-    if df.empty:
+    entry = intraday_bars.get(code)
+    if entry.df.empty:
         return jsonify(success=False, message="no data"), 200
+    return jsonify(success=True, symbol=code, **_timeline_payload(entry, step, twse_last_price(code) if entry.market_closed else None))
 
-    # 基本資訊
-    open_px = float(df.iloc[0]["Open"] if pd.notna(df.iloc[0]["Open"]) else df.iloc[0]["Close"])
-    day_high = float(df["High"].max())
-    day_low  = float(df["Low"].min())
-    day = df.iloc[0]["time"].date()
-    t_start = datetime.combine(day, dtime(9, 0), tzinfo=TZ)
-    t_end   = datetime.combine(day, dtime(13, 30), tzinfo=TZ)
-
-    # 是否已收盤：用「資料的最後時間」或「系統時間」雙判斷，避免時區/延遲誤判
-    df_last_ts = pd.to_datetime(df["time"]).max().to_pydatetime()
-    now = datetime.now(TZ)
-    market_closed = (df_last_ts >= t_end) or ((now.hour * 60 + now.minute) >= (13 * 60 + 31))
-
-    # 取到 limit
-    limit = t_end if market_closed else min(now, t_end)
-
-    # 生成 09:00, 09:30, ... 到 limit
-    marks = []
-    ts = t_start
-    idx = 0
-    n = len(df)
-    while ts <= limit and idx < n:
-        while idx + 1 < n and df.iloc[idx + 1]["time"] <= ts:
-            idx += 1
-        px = float(df.iloc[idx]["Close"])
-        marks.append({
-            "time": ts.strftime("%H:%M"),
-            "price": round(px, 2),
-            "chg_from_open_pct": round((px / open_px - 1) * 100, 2) if open_px else None,
-            "kind": "mid",
-            "dir": "flat"
-        })
-        ts += timedelta(minutes=step)
-
-    # 開盤標記 + 方向
-    if marks:
-        marks[0]["kind"] = "open"
-        for i in range(1, len(marks)):
-            prev = marks[i-1]["price"]
-            cur  = marks[i]["price"]
-            marks[i]["dir"] = "up" if cur > prev else ("down" if cur < prev else "flat")
-
-    # 收盤：覆蓋最後一筆為官價 & 標記 close
-    official_close = None
-    if market_closed and marks:
-        official_close = twse_last_price(code)
+MAX_TIMELINE_CODES = 50
+
+@app.get("/api/intraday_timelines")
+@login_required
+def api_intraday_timelines():
+    """/api/intraday_timelines?codes=2330,2317&step=30：多檔當日概覽，一次回傳"""
+    codes = [c.strip() for c in request.args.get("codes", "").split(",") if c.strip()]
+    if not codes or not all(c.isdigit() for c in codes):
+        return jsonify(success=False, message="股票代碼應為數字，以逗號分隔"), 400
+    codes = list(dict.fromkeys(codes))
+    if len(codes) > MAX_TIMELINE_CODES:
+        return jsonify(success=False, message=f"一次最多查詢 {MAX_TIMELINE_CODES} 檔"), 400
+    try:
+        step = int(request.args.get("step", "30"))
+    except Exception:
+        step = 30
+    if step not in INTRADAY_STEPS:
+        step = 30
+
+    # 快取有新鮮資料的直接用，其餘一次批次下載
+    entries = {c: intraday_bars.peek(c) for c in codes}
+    missing = [c for c, e in entries.items() if e is None]
+    if missing:
+        fetched = yf_intraday_1m_batch(missing)
+        for code in missing:
+            df = fetched.get(code)
+            stale = intraday_bars.cached(code)
+            if df is not None and (not df.empty or stale is None):
+                entries[code] = intraday_bars.put(code, df)
+            else:
+                entries[code] = stale  # 下載失敗或這次沒拿到：沿用舊資料
+
+    closed = [c for c, e in entries.items() if e is not None and e.market_closed and not e.df.empty]
+    official = twse_last_prices(closed) if closed else {}
+
+    timelines = {}
+    for code in codes:
+        entry = entries.get(code)
+        if entry is None or entry.df.empty:
+            timelines[code] = {"success": False, "message": "no data"}
+            continue
+        timelines[code] = {"success": True, **_timeline_payload(entry, step, official.get(code))}
+    return jsonify(success=True, step=step, timelines=timelines)
+
+def _timeline_payload(entry, step: int, official_close: Optional[float]) -> dict:
+    """由快取的標記組回應；收盤時最後一筆用官價覆蓋並標記 close"""
+    marks = [dict(m) for m in entry.marks.get(step, [])]
+    open_px = entry.open_px
+    if entry.market_closed and marks:
         if official_close is not None:
             marks[-1]["price"] = round(official_close, 2)
             marks[-1]["chg_from_open_pct"] = round((official_close / open_px - 1) * 100, 2) if open_px else None
@@ -1696,14 +2246,14 @@ def api_intraday_timeline(code):
         marks[-1]["kind"] = "close"
 
     meta = {
-        "open": round(open_px, 2),
-        "high": round(day_high, 2),
-        "low": round(day_low, 2),
-        "close": None if not market_closed else (round(official_close, 2) if official_close is not None else round(float(df.iloc[-1]["Close"]), 2)),
+        "open": entry.meta["open"],
+        "high": entry.meta["high"],
+        "low": entry.meta["low"],
+        "close": None if not entry.market_closed else (round(official_close, 2) if official_close is not None else entry.meta["last"]),
         "count": len(marks),
         "step": step
     }
-    return jsonify(success=True, symbol=code, meta=meta, marks=marks)
+    return {"meta": meta, "marks": marks}
 
 # === 檔案專用 AI 路由（覆蓋版）=====================================
 
@@ -0,0 +1,29 @@
+import argparse
+from datetime import datetime
+
+from app import app, bar_store
+from models import db, Trade, StockSymbol
+
+# 日線批次回補：python backfill_bars.py 2330 2317 --start 2020-01-01
+#              python backfill_bars.py --held            （所有曾交易過的代號）
+#              python backfill_bars.py --all --start 2024-01-01（代號主檔全部）
+parser = argparse.ArgumentParser(description="回補本地日線資料")
+parser.add_argument("codes", nargs="*", help="股票代號")
+parser.add_argument("--start", default="2020-01-01", help="起始日 YYYY-MM-DD")
+parser.add_argument("--held", action="store_true", help="加入所有交易紀錄中的代號")
+parser.add_argument("--all", action="store_true", help="加入代號主檔中的所有代號")
+args = parser.parse_args()
+
+start = datetime.strptime(args.start, "%Y-%m-%d").date()
+codes = list(args.codes)
+with app.app_context():
+    if args.held:
+        codes += [t for (t,) in db.session.query(Trade.ticker).distinct()]
+    if args.all:
+        codes += [c for (c,) in db.session.query(StockSymbol.code)]
+codes = list(dict.fromkeys(codes))
+
+print(f"📥 回補 {len(codes)} 檔，自 {start} 起")
+for code, result in bar_store.backfill(codes, start).items():
+    print(f"{code}: {result if isinstance(result, str) else f'新增/更新 {result} 筆'}")
+print(f"✅ 完成，上游請求 {bar_store.upstream_calls} 次")
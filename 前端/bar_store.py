@@ -0,0 +1,128 @@
+"""本地日線（OHLCV）庫：依代號記錄已同步範圍，只向上游補缺少的交易日，查詢一律讀本地資料"""
+import threading
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+
+from models import db, DailyBar, BarSync
+import market_calendar
+
+# /history 的 period 參數 -> 往回天數（None 表示全部）
+PERIOD_DAYS = {"5d": 7, "1mo": 31, "3mo": 92, "6mo": 183, "1y": 366, "2y": 731, "5y": 1827, "10y": 3653, "max": None}
+MAX_START = date(2000, 1, 1)
+
+
+def period_start(period: str, end: date) -> date:
+    """period 轉起始日；ytd 為當年 1/1，max 為 MAX_START"""
+    if period == "ytd":
+        return date(end.year, 1, 1)
+    if period not in PERIOD_DAYS:
+        raise ValueError(f"不支援的 period：{period}")
+    days = PERIOD_DAYS[period]
+    return MAX_START if days is None else end - timedelta(days=days)
+
+
+class BarStore:
+    def __init__(self, app, fetch: Callable[[str, date, date], pd.DataFrame]):
+        """fetch(code, start, end) 回傳 [start, end] 的日線，欄位 date/open/high/low/close/volume"""
+        self.app = app
+        self.fetch = fetch
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self.upstream_calls = 0
+
+    def _lock_for(self, code: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(code, threading.Lock())
+
+    def _upsert(self, code: str, df: pd.DataFrame) -> int:
+        days = list(df["date"])
+        existing = {r.date: r for r in DailyBar.query.filter(
+            DailyBar.code == code, DailyBar.date.between(min(days), max(days)))}
+        now = datetime.utcnow()
+        for r in df.itertuples(index=False):
+            row = existing.get(r.date)
+            if row is None:
+                row = DailyBar(code=code, date=r.date)
+                db.session.add(row)
+            row.open, row.high, row.low, row.close = float(r.open), float(r.high), float(r.low), float(r.close)
+            row.volume = int(r.volume) if pd.notna(r.volume) else None
+            row.updated_at = now
+        return len(df)
+
+    def _fetch_range(self, code: str, start: date, end: date) -> Tuple[int, Optional[date]]:
+        """抓 [start, end] 寫入本地；回傳 (寫入筆數, 實際拿到的最後一個交易日)，沒拿到有效日線時後者為 None"""
+        if start > end:
+            return 0, None
+        self.upstream_calls += 1
+        df = self.fetch(code, start, end)
+        if df is None or df.empty:
+            return 0, None
+        # 上游偶爾回傳 NaN 列（停牌、資料未齊），不寫入
+        df = df.dropna(subset=["open", "high", "low", "close"])
+        if df.empty:
+            return 0, None
+        return self._upsert(code, df), max(df["date"])
+
+    def sync(self, code: str, start: date, end: Optional[date] = None) -> int:
+        """
+        確保 [start, end] 已同步（end 預設最近一個已收盤交易日）；回傳新寫入筆數。
+        上游回空（暫時失敗）時不更新同步範圍，下次再抓；covered_to 只推進到實際拿到的最後一天，
+        最新一根日線延遲時下次會補上。往前補有拿到資料時 covered_from 推到 start
+        （回應中最早一天之前即為上市前，不必每次重抓）。
+        """
+        end = min(end or market_calendar.last_settled_session(), market_calendar.last_settled_session())
+        with self._lock_for(code), self.app.app_context():
+            state = db.session.get(BarSync, code)
+            written = 0
+            try:
+                if state is None:
+                    n, last = self._fetch_range(code, start, end)
+                    written += n
+                    if last is not None:
+                        state = BarSync(code=code, covered_from=start, covered_to=last)
+                        db.session.add(state)
+                else:
+                    if start < state.covered_from:
+                        n, last = self._fetch_range(code, start, state.covered_from - timedelta(days=1))
+                        written += n
+                        if last is not None:
+                            state.covered_from = start
+                    if end > state.covered_to:
+                        n, last = self._fetch_range(code, state.covered_to + timedelta(days=1), end)
+                        written += n
+                        if last is not None:
+                            state.covered_to = max(state.covered_to, last)
+                if state is not None:
+                    state.synced_at = datetime.utcnow()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            return written
+
+    def load(self, code: str, start: date, end: date) -> pd.DataFrame:
+        """只讀本地；跳過只有收盤價（盤後定盤價）的列"""
+        with self.app.app_context():
+            rows = (db.session.query(DailyBar.date, DailyBar.open, DailyBar.high, DailyBar.low,
+                                     DailyBar.close, DailyBar.volume)
+                    .filter(DailyBar.code == code, DailyBar.date.between(start, end),
+                            DailyBar.open.isnot(None))
+                    .order_by(DailyBar.date)
+                    .all())
+        return pd.DataFrame(rows, columns=["date", "open", "high", "low", "close", "volume"])
+
+    def history(self, code: str, start: date, end: date) -> pd.DataFrame:
+        self.sync(code, start, end)
+        return self.load(code, start, end)
+
+    def backfill(self, codes: Iterable[str], start: date) -> Dict[str, object]:
+        """批次回補；單檔失敗不影響其他檔"""
+        out: Dict[str, object] = {}
+        for code in codes:
+            try:
+                out[code] = self.sync(code, start)
+            except Exception as e:
+                out[code] = f"失敗：{e}"
+        return out
@@ -0,0 +1,70 @@
+import argparse
+import random
+import statistics
+import time
+
+from order_book import LIMIT, STOP, OrderBook, triggers_below
+from orders import BUY, SELL
+
+# 掛單簿撮合延遲基準：大量 open 掛單下，每一輪報價（所有代號各一個新價）撮合要多久
+#   python bench_order_book.py --orders 50000 --symbols 500 --ticks 200
+# --naive 另外量「每輪掃全部掛單」的做法作為對照
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--orders", type=int, default=50000)
+    ap.add_argument("--symbols", type=int, default=500)
+    ap.add_argument("--ticks", type=int, default=200)
+    ap.add_argument("--vol", type=float, default=0.002, help="每輪價格隨機漫步的標準差（比例）")
+    ap.add_argument("--naive", action="store_true")
+    args = ap.parse_args()
+
+    rng = random.Random(7)
+    symbols = [str(1101 + i) for i in range(args.symbols)]
+    prices = {s: rng.uniform(20, 1000) for s in symbols}
+
+    book = OrderBook()
+    orders = {}
+    started = time.perf_counter()
+    for oid in range(1, args.orders + 1):
+        s = rng.choice(symbols)
+        side, kind = rng.choice([BUY, SELL]), rng.choice([LIMIT, LIMIT, STOP])
+        # 觸發價散在現價 ±10% 內、且尚未被穿越
+        off = prices[s] * rng.uniform(0.001, 0.10)
+        px = round((prices[s] - off if triggers_below(side, kind) else prices[s] + off) * 100)  # 分
+        book.add(oid, s, side, kind, px)
+        orders[oid] = (s, triggers_below(side, kind), px)
+    print(f"📥 建立 {args.orders} 筆掛單（{args.symbols} 檔）：{(time.perf_counter() - started) * 1000:.1f} ms")
+
+    lat, fired = [], 0
+    naive_lat = []
+    live = dict(orders)
+    for _ in range(args.ticks):
+        for s in symbols:
+            prices[s] *= 1 + rng.gauss(0, args.vol)
+        if args.naive:
+            t0 = time.perf_counter()
+            hit = [oid for oid, (s, below, px) in live.items()
+                   if (round(prices[s] * 100) <= px if below else round(prices[s] * 100) >= px)]
+            naive_lat.append((time.perf_counter() - t0) * 1000)
+        t0 = time.perf_counter()
+        got = [oid for s in symbols for oid in book.match(s, round(prices[s] * 100))]
+        lat.append((time.perf_counter() - t0) * 1000)
+        if args.naive:
+            assert sorted(hit) == sorted(got), "heap 撮合結果與全掃描不一致"
+            for oid in got:
+                live.pop(oid, None)
+        fired += len(got)
+
+    def summary(xs):
+        xs = sorted(xs)
+        return f"p50 {statistics.median(xs):.3f} ms / p99 {xs[int(len(xs) * 0.99) - 1]:.3f} ms / max {xs[-1]:.3f} ms"
+
+    print(f"⚡ heap 撮合（每輪 {args.symbols} 檔）：{summary(lat)}；共觸發 {fired} 筆，剩 {len(book)} 筆")
+    if args.naive:
+        print(f"🐢 全掃描對照：{summary(naive_lat)}")
+
+
+if __name__ == "__main__":
+    main()
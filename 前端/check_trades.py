@@ -1,11 +1,92 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
 from app import app
-from models import db, Trade
+from models import db, User
+from reconcile import CHUNK_SIZE, KIND_LABELS, REPORT_COLUMNS, partitions, reconcile_range
+
+# 帳目核對：由交易紀錄重算每個帳號的現金與持股，和餘額、持股表、帳務事件簿比對
+#   python check_trades.py                          （全部帳號，依 CPU 數平行）
+#   python check_trades.py --workers 8 --out drift.csv
+#   python check_trades.py --user alice             （單一帳號，ID 或使用者名稱）
+# 有差異時結束碼為 1，可放進排程檢查
+parser = argparse.ArgumentParser(description="核對帳目（分段串流讀取交易，各帳號區段平行處理）")
+parser.add_argument("--user", help="帳號 ID 或使用者名稱；不指定為全部帳號")
+parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1), help="平行的 process 數")
+parser.add_argument("--partitions", type=int, help="帳號區段數（預設為 workers 的 4 倍，讓負載較平均）")
+parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="每次從資料庫讀取的交易筆數")
+parser.add_argument("--no-ledger", action="store_true", help="不比對帳務事件簿（尚未執行 rebuild_ledger.py 時）")
+parser.add_argument("--out", help="把全部差異寫成 CSV")
+parser.add_argument("--limit", type=int, default=50, help="畫面上最多列出幾筆差異")
+
+
+def run_range(bounds, chunk_size, ledger):
+    lo, hi = bounds
+    with app.app_context():
+        return reconcile_range(lo, hi, chunk_size, ledger)
+
+
+def main():
+    args = parser.parse_args()
+    started = time.time()
+    with app.app_context():
+        user_ids = None
+        if args.user:
+            user = db.session.get(User, int(args.user)) if args.user.isdigit() else User.query.filter_by(username=args.user).first()
+            if user is None:
+                sys.exit(f"❌ 找不到帳號 {args.user}")
+            user_ids = [user.id]
+        ranges = partitions(args.partitions or args.workers * 4, user_ids)
+        # 子 process 不可沿用父 process 的連線
+        db.engine.dispose()
+
+    ledger = not args.no_ledger
+    stats, drifts = Counter(), []
+    if args.workers <= 1 or len(ranges) <= 1:
+        results = (run_range(r, args.chunk_size, ledger) for r in ranges)
+        for s, d in results:
+            stats.update(s)
+            drifts.extend(d)
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for s, d in pool.map(run_range, ranges, [args.chunk_size] * len(ranges), [ledger] * len(ranges)):
+                stats.update(s)
+                drifts.extend(d)
+    elapsed = time.time() - started
+
+    print(f"📊 核對 {stats['accounts']} 個帳號、{stats['trades']} 筆交易，"
+          f"{len(ranges)} 段 / {max(1, args.workers)} 個 process，耗時 {elapsed:.2f}s")
+    if ledger and stats["no_ledger"]:
+        print(f"ℹ️ {stats['no_ledger']} 個帳號沒有帳務事件，未比對事件簿（可執行 rebuild_ledger.py）")
+    if not drifts:
+        print("✅ 帳目全部一致")
+        return 0
+
+    by_kind = Counter(d.kind for d in drifts)
+    accounts = len({d.user_id for d in drifts})
+    print(f"❌ {accounts} 個帳號有差異："
+          + "、".join(f"{KIND_LABELS[k]} {n} 筆" for k, n in by_kind.most_common()))
+    drifts.sort(key=lambda d: (d.user_id, d.kind, d.ticker or ""))
+    for d in drifts[:args.limit]:
+        uid, name, kind, ticker, expected, actual, diff, trade_id = d.row()
+        where = f" {ticker}" if ticker else ""
+        extra = f"（首筆交易 #{trade_id}）" if trade_id else ""
+        print(f"  - [{uid}] {name} {KIND_LABELS[kind]}{where}：應為 {expected}，實際 {actual}，差 {diff}{extra}")
+    if len(drifts) > args.limit:
+        print(f"  …另有 {len(drifts) - args.limit} 筆" + ("，完整清單見 --out" if not args.out else ""))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_COLUMNS)
+            writer.writerows(d.row() for d in drifts)
+        print(f"📝 差異清單已寫入 {args.out}")
+    return 1
 
-with app.app_context():
-    user_id = 2  # 你要查的帳號 ID
-    ticker = "2330"
-    trades = Trade.query.filter_by(user_id=user_id, trade_type="買入", ticker=ticker).all()
 
-    print(f"📊 查詢帳號 ID={user_id}，股票代號 {ticker} 的買入紀錄：\n")
-    for t in trades:
-        print(f"🧾 買入股數: {t.quantity} | 單價: {t.price} | 成本: {t.quantity * t.price}")
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""每日收盤結算：所有帳號一次估值後寫入 EquitySnapshot；歷史曲線依需求點數降採樣（LTTB）"""
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from models import db, EquitySnapshot
+import market_calendar
+
+
+def settle_day(session: date, values: pd.DataFrame) -> int:
+    """
+    values：已依總資產排序的 DataFrame（user_id, balance, total）。
+    同一天已結算過就略過；回傳寫入筆數。需在 app context 內呼叫。
+    """
+    if values.empty or db.session.query(EquitySnapshot.id).filter_by(date=session).first():
+        return 0
+    records = pd.DataFrame({
+        "user_id": values["user_id"].astype(int),
+        "date": session,
+        "cash": values["balance"].astype(float).round(2),
+        "equity": values["total"].astype(float).round(2),
+        "rank": np.arange(1, len(values) + 1),
+    }).to_dict(orient="records")
+    try:
+        db.session.bulk_insert_mappings(EquitySnapshot, records)
+        db.session.commit()
+    except Exception:
+        # 多個 worker 同時結算時，唯一鍵擋下後到者
+        db.session.rollback()
+        return 0
+    return len(records)
+
+
+class EquitySettler:
+    """背景檢查：最近一個交易日已定盤且尚未結算時執行 settle_day"""
+
+    def __init__(self, app, mark_to_market: Callable[[], pd.DataFrame], check_interval: float = 300,
+                 on_settled: Optional[Callable[[date], None]] = None):
+        """on_settled(session)：新的一天結算寫入後呼叫（例如預先算好風險指標）"""
+        self.app = app
+        self.mark_to_market = mark_to_market
+        self.check_interval = check_interval
+        self.on_settled = on_settled
+        self.last_settled: Optional[date] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def settle(self, session: Optional[date] = None) -> int:
+        """
+        結算最近一個已收盤交易日。估值用的是當下的餘額與報價，只有對這一天才等於收盤狀態，
+        指定其他日期會寫出錯的歷史，直接拒絕（ValueError）。
+        """
+        latest = market_calendar.last_settled_session()
+        if session is not None and session != latest:
+            raise ValueError(f"只能結算最近一個已收盤交易日 {latest}，無法補結算 {session}")
+        session = latest
+        with self.app.app_context():
+            if db.session.query(EquitySnapshot.id).filter_by(date=session).first():
+                self.last_settled = session
+                return 0
+            n = settle_day(session, self.mark_to_market())
+        self.last_settled = session
+        if n:
+            print(f"✅ {session} 資產結算完成，共 {n} 個帳號")
+            if self.on_settled is not None:
+                self.on_settled(session)
+        return n
+
+    def _run(self):
+        while True:
+            try:
+                if market_calendar.is_settled() and self.last_settled != market_calendar.last_settled_session():
+                    self.settle()
+            except Exception as e:
+                print(f"⚠️ 每日資產結算失敗：{e}")
+            time.sleep(self.check_interval)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="equity-settler", daemon=True)
+                self._thread.start()
+
+
+def downsample_lttb(y: np.ndarray, n: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets：保留 n 個最能代表曲線形狀的點，回傳索引"""
+    size = len(y)
+    if n >= size or n < 3:
+        return np.arange(size) if n >= size else np.linspace(0, size - 1, max(n, 1)).round().astype(int)
+    x = np.arange(size, dtype=float)
+    edges = np.linspace(1, size - 1, n - 1).astype(int)  # 中間 n-2 個桶的邊界
+    keep = np.empty(n, dtype=int)
+    keep[0], keep[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else size
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+
+def equity_series(user_ids: Iterable[int], points: int) -> Dict[int, List[dict]]:
+    """多個帳號的每日資產曲線（一次查詢），每條降採樣到 points 點"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    rows = (db.session.query(EquitySnapshot.user_id, EquitySnapshot.date,
+                             EquitySnapshot.equity, EquitySnapshot.rank)
+            .filter(EquitySnapshot.user_id.in_(user_ids))
+            .order_by(EquitySnapshot.user_id, EquitySnapshot.date)
+            .all())
+    grouped = defaultdict(list)
+    for uid, d, eq, rk in rows:
+        grouped[uid].append((d, eq, rk))
+
+    out: Dict[int, List[dict]] = {}
+    for uid in user_ids:
+        series = grouped.get(uid, [])
+        if not series:
+            out[uid] = []
+            continue
+        idx = downsample_lttb(np.array([s[1] for s in series], dtype=float), points)
+        out[uid] = [{"date": series[i][0].isoformat(), "equity": series[i][1], "rank": series[i][2]} for i in idx]
+    return out
+
+
+def top_user_ids(n: int) -> List[int]:
+    """最近一次結算的前 n 名"""
+    latest = db.session.query(db.func.max(EquitySnapshot.date)).scalar()
+    if latest is None:
+        return []
+    return [uid for (uid,) in (db.session.query(EquitySnapshot.user_id)
+                               .filter(EquitySnapshot.date == latest)
+                               .order_by(EquitySnapshot.rank)
+                               .limit(n))]
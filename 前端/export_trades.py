@@ -0,0 +1,47 @@
+import argparse
+import sys
+from datetime import datetime
+
+from app import app
+from models import User
+from trade_export import CHUNK_SIZE, iter_csv, iter_trade_chunks, write_parquet
+
+# 交易紀錄匯出：python export_trades.py --format csv --out trades.csv           （全部帳號）
+#              python export_trades.py --user alice --format parquet --out alice.parquet
+#              python export_trades.py --user 2 --since 2025-01-01 > user2.csv     （CSV 未指定 --out 時寫到 stdout）
+parser = argparse.ArgumentParser(description="匯出交易紀錄（分段讀取，不會一次載入全部）")
+parser.add_argument("--user", help="帳號 ID 或使用者名稱；不指定為全部帳號")
+parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+parser.add_argument("--out", help="輸出檔案（parquet 必填）")
+parser.add_argument("--since", help="起始日 YYYY-MM-DD（含）")
+parser.add_argument("--until", help="結束日 YYYY-MM-DD（不含）")
+parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="每段筆數（Parquet 的 row group 大小）")
+args = parser.parse_args()
+
+since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+until = datetime.strptime(args.until, "%Y-%m-%d") if args.until else None
+if args.format == "parquet" and not args.out:
+    parser.error("parquet 需要指定 --out")
+
+with app.app_context():
+    user_id = None
+    if args.user:
+        user = User.query.get(int(args.user)) if args.user.isdigit() else User.query.filter_by(username=args.user).first()
+        if user is None:
+            sys.exit(f"❌ 找不到帳號 {args.user}")
+        user_id = user.id
+
+    chunks = iter_trade_chunks(user_id, args.chunk_size, since, until)
+    if args.format == "parquet":
+        n = write_parquet(args.out, chunks)
+        print(f"✅ 已匯出 {n} 筆到 {args.out}", file=sys.stderr)
+    else:
+        out = open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout
+        try:
+            for part in iter_csv(chunks):
+                out.write(part)
+        finally:
+            if args.out:
+                out.close()
+        if args.out:
+            print(f"✅ 已匯出到 {args.out}", file=sys.stderr)
@@ -0,0 +1,229 @@
+"""
+當日 1 分鐘線快取（盤中增量更新）與向量化的固定步長概覽標記。
+定盤後的整天資料另存於 IntradayBar（每檔只留最近一天），收盤期間新啟動的程序直接讀本地，不再向上游抓。
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from models import db, IntradayBar
+import market_calendar
+from market_calendar import TZ
+
+STEPS = (30, 15, 10, 5, 1)
+
+
+def compute_marks(df: pd.DataFrame, t_start: datetime, limit: datetime,
+                  open_px: float, steps=STEPS) -> Dict[int, List[dict]]:
+    """
+    所有步長一次算完：每個標記時間點取「時間 <= 該點」的最後一根 K 棒收盤（都沒有就取第一根）。
+    """
+    closes = df["Close"].to_numpy(dtype=float)
+    start64 = np.datetime64(pd.Timestamp(t_start).tz_convert("UTC").tz_localize(None), "ns")
+    limit64 = np.datetime64(pd.Timestamp(limit).tz_convert("UTC").tz_localize(None), "ns")
+    # yfinance 的時間欄位是 tz-aware，轉成 UTC naive 後才能和 numpy 比較
+    times = pd.to_datetime(df["time"]).dt.tz_convert("UTC").dt.tz_localize(None).to_numpy(dtype="datetime64[ns]")
+
+    out: Dict[int, List[dict]] = {}
+    for step in steps:
+        n = int((limit64 - start64) // np.timedelta64(step, "m")) + 1 if limit64 >= start64 else 0
+        if n <= 0:
+            out[step] = []
+            continue
+        marks64 = start64 + np.arange(n) * np.timedelta64(step, "m")
+        idx = np.clip(np.searchsorted(times, marks64, side="right") - 1, 0, len(closes) - 1)
+        px = np.round(closes[idx], 2)
+        pct = np.round((closes[idx] / open_px - 1) * 100, 2) if open_px else None
+        diff = np.sign(np.diff(px, prepend=px[0]))
+        dirs = np.where(diff > 0, "up", np.where(diff < 0, "down", "flat"))
+        labels = (pd.DatetimeIndex(marks64).tz_localize("UTC").tz_convert(TZ).strftime("%H:%M"))
+        marks = [{
+            "time": labels[i],
+            "price": float(px[i]),
+            "chg_from_open_pct": float(pct[i]) if pct is not None else None,
+            "kind": "mid",
+            "dir": str(dirs[i]),
+        } for i in range(n)]
+        marks[0]["kind"] = "open"
+        out[step] = marks
+    return out
+
+
+class IntradayEntry:
+    __slots__ = ("df", "fetched_at", "day", "final", "market_closed", "open_px", "meta", "marks")
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.fetched_at = time.time()
+        self.day = df.iloc[0]["time"].date() if not df.empty else None
+        self.final = False
+        self.market_closed = False
+        self.open_px = 0.0
+        self.meta: dict = {}
+        self.marks: Dict[int, List[dict]] = {}
+
+    def build(self, now: datetime):
+        """算 meta 與所有步長的標記（每次資料更新只算一次）"""
+        df = self.df
+        if df.empty:
+            # 定盤後上游仍沒資料（停牌、代號錯誤）：到下次開盤前不再重抓
+            self.final = market_calendar.is_settled(now)
+            return
+        first = df.iloc[0]
+        open_px = self.open_px = float(first["Open"] if pd.notna(first["Open"]) else first["Close"])
+        t_start, t_end = market_calendar.session_bounds(self.day)
+        last_ts = pd.to_datetime(df["time"]).max().to_pydatetime()
+        self.market_closed = (last_ts >= t_end) or not (self.day == now.date() and market_calendar.is_open(now))
+        limit = t_end if self.market_closed else min(now, t_end)
+        self.meta = {
+            "open": round(open_px, 2),
+            "high": round(float(df["High"].max()), 2),
+            "low": round(float(df["Low"].min()), 2),
+            "last": round(float(df.iloc[-1]["Close"]), 2),
+        }
+        self.marks = compute_marks(df, t_start, limit, open_px)
+        # 收盤且已定盤：這天的資料不會再變
+        self.final = self.market_closed and (self.day < now.date() or market_calendar.is_settled(now))
+
+
+def load_session(code: str, day) -> pd.DataFrame:
+    """本地存的某交易日 1 分鐘線（台北時間）；沒有時為空表。需在 app context 內呼叫"""
+    start, end = market_calendar.session_bounds(day)
+    utc = lambda t: pd.Timestamp(t).tz_convert("UTC").tz_localize(None).to_pydatetime()
+    rows = (db.session.query(IntradayBar.time, IntradayBar.open, IntradayBar.high, IntradayBar.low,
+                             IntradayBar.close, IntradayBar.volume)
+            .filter(IntradayBar.code == code, IntradayBar.time.between(utc(start), utc(end)))
+            .order_by(IntradayBar.time).all())
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(rows, columns=["time", "Open", "High", "Low", "Close", "Volume"])
+    df["time"] = pd.to_datetime(df["time"]).dt.tz_localize("UTC").dt.tz_convert(TZ)
+    return df
+
+
+def save_session(code: str, df: pd.DataFrame):
+    """以 df 取代該代號本地存的 1 分鐘線（只留這一天）；由呼叫端 commit"""
+    times = pd.to_datetime(df["time"]).dt.tz_convert("UTC").dt.tz_localize(None)
+    db.session.query(IntradayBar).filter(IntradayBar.code == code).delete()
+    db.session.bulk_insert_mappings(IntradayBar, [{
+        "code": code, "time": t.to_pydatetime(),
+        "open": float(o) if pd.notna(o) else None, "high": float(h) if pd.notna(h) else None,
+        "low": float(lo) if pd.notna(lo) else None, "close": float(c),
+        "volume": int(v) if pd.notna(v) else None,
+    } for t, o, h, lo, c, v in zip(times, df["Open"], df["High"], df["Low"], df["Close"], df["Volume"])])
+
+
+class IntradayBars:
+    def __init__(self, fetch: Callable[[str, Optional[datetime]], pd.DataFrame],
+                 refresh_seconds: float = 30, max_symbols: int = 500, app=None):
+        """
+        fetch(code, since) 回傳 time/Open/High/Low/Close/Volume；since 為 None 時抓整天。
+        給 app 時定盤後的資料寫入 IntradayBar，收盤期間快取沒有的代號先讀本地。
+        """
+        self.fetch = fetch
+        self.app = app
+        self.refresh_seconds = refresh_seconds
+        self.max_symbols = max_symbols
+        self._entries: Dict[str, IntradayEntry] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self.fetches = 0
+
+    def _lock_for(self, code: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(code, threading.Lock())
+
+    def _fresh(self, entry: Optional[IntradayEntry], now: datetime) -> bool:
+        if entry is None:
+            return False
+        if entry.final:
+            # 已定盤的舊資料一直用到下個交易日開盤
+            return not market_calendar.is_open(now) or entry.day == now.date()
+        return time.time() - entry.fetched_at < self.refresh_seconds
+
+    def _keep(self, code: str, entry: IntradayEntry) -> IntradayEntry:
+        with self._guard:
+            self._entries[code] = entry
+            if len(self._entries) > self.max_symbols:
+                oldest = min(self._entries, key=lambda k: self._entries[k].fetched_at)
+                self._entries.pop(oldest, None)
+        return entry
+
+    def _save(self, code: str, entry: IntradayEntry):
+        with self.app.app_context():
+            try:
+                save_session(code, entry.df)
+                db.session.commit()
+            except Exception as e:
+                # 多個 worker 同時寫入時主鍵會擋下後到者，本地已有資料即可
+                db.session.rollback()
+                print(f"⚠️ {code} 1 分鐘線寫入本地失敗：{e}")
+
+    def _load_settled(self, code: str, now: datetime) -> Optional[IntradayEntry]:
+        """收盤期間：本地有最近一個交易日的資料就直接用"""
+        if self.app is None or market_calendar.is_open(now):
+            return None
+        with self.app.app_context():
+            df = load_session(code, market_calendar.current_session(now))
+        if df.empty:
+            return None
+        entry = IntradayEntry(df)
+        entry.build(now)
+        return self._keep(code, entry) if entry.final else None
+
+    def put(self, code: str, df: pd.DataFrame, now: Optional[datetime] = None) -> IntradayEntry:
+        """寫入整天資料（供批次下載使用）；已定盤的資料同時存到本地"""
+        entry = IntradayEntry(df)
+        entry.build(now or market_calendar.now_tw())
+        if self.app is not None and entry.final and not entry.df.empty:
+            self._save(code, entry)
+        return self._keep(code, entry)
+
+    def peek(self, code: str, now: Optional[datetime] = None) -> Optional[IntradayEntry]:
+        """回傳仍新鮮的快取（收盤期間含本地定盤資料）；需要向上游更新時回傳 None"""
+        now = now or market_calendar.now_tw()
+        entry = self._entries.get(code)
+        if self._fresh(entry, now):
+            return entry
+        return self._load_settled(code, now)
+
+    def cached(self, code: str) -> Optional[IntradayEntry]:
+        """快取中的資料，不論是否過期（上游失敗時沿用）"""
+        return self._entries.get(code)
+
+    def get(self, code: str) -> IntradayEntry:
+        now = market_calendar.now_tw()
+        entry = self._entries.get(code)
+        if self._fresh(entry, now):
+            return entry
+        with self._lock_for(code):
+            # 等鎖期間可能已被其他請求更新
+            entry = self._entries.get(code)
+            if self._fresh(entry, now):
+                return entry
+            settled = self._load_settled(code, now)
+            if settled is not None:
+                return settled
+            self.fetches += 1
+            try:
+                if entry is not None and not entry.df.empty and entry.day == market_calendar.current_session(now):
+                    # 同一交易日：只抓最後一根之後（含最後一根，可能尚未收完）
+                    last_ts = entry.df.iloc[-1]["time"]
+                    tail = self.fetch(code, last_ts.to_pydatetime())
+                    df = entry.df
+                    if tail is not None and not tail.empty:
+                        df = pd.concat([df[df["time"] < tail.iloc[0]["time"]], tail], ignore_index=True)
+                else:
+                    df = self.fetch(code, None)
+            except Exception as e:
+                # 上游失敗或跳脫中：有舊資料就沿用，不寫入快取，下次再試
+                print(f"⚠️ {code} 1 分鐘線更新失敗：{e}")
+                return entry if entry is not None else IntradayEntry(pd.DataFrame())
+            return self.put(code, df if df is not None else pd.DataFrame(), now)
+
+    def stats(self) -> dict:
+        return {"symbols": len(self._entries), "fetches": self.fetches}
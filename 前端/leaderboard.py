@@ -0,0 +1,73 @@
+"""排行榜快照：背景定時重算並保存排序結果，名次查詢為字典查找"""
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class LeaderboardSnapshot:
+    __slots__ = ("rows", "index", "computed_at", "elapsed")
+
+    def __init__(self, rows: List[Tuple[str, float]], elapsed: float):
+        self.rows = rows
+        # username -> (名次, 總資產)
+        self.index: Dict[str, Tuple[int, float]] = {u: (i + 1, a) for i, (u, a) in enumerate(rows)}
+        self.computed_at = datetime.now()
+        self.elapsed = elapsed
+
+    @property
+    def age(self) -> float:
+        return (datetime.now() - self.computed_at).total_seconds()
+
+
+class Leaderboard:
+    def __init__(self, app, compute: Callable[[], List[Tuple[str, float]]], interval: float = 60):
+        """compute() 回傳已排序的 [(username, total_asset), ...]，會在 app context 內執行"""
+        self.app = app
+        self.compute = compute
+        self.interval = interval
+        self._snapshot: Optional[LeaderboardSnapshot] = None
+        self._refresh_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def refresh(self) -> LeaderboardSnapshot:
+        """同步重算；已有其他執行緒在算時等它算完直接用結果"""
+        started_wait = time.time()
+        with self._refresh_lock:
+            snap = self._snapshot
+            if snap is not None and snap.computed_at.timestamp() >= started_wait:
+                return snap
+            started = time.monotonic()
+            with self.app.app_context():
+                rows = self.compute()
+            self._snapshot = LeaderboardSnapshot(rows, time.monotonic() - started)
+            return self._snapshot
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️ 排行榜背景重算失敗：{e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="leaderboard", daemon=True)
+                self._thread.start()
+
+    def get(self, max_age: Optional[float] = None) -> LeaderboardSnapshot:
+        """回傳目前快照；尚無快照、或指定 max_age 且已過期時同步重算"""
+        self.start()
+        snap = self._snapshot
+        if snap is None or (max_age is not None and snap.age > max_age):
+            snap = self.refresh()
+        return snap
+
+    def rank_of(self, username: str, max_age: Optional[float] = None):
+        """(名次, 總資產, 總人數, 快照)；不在榜上時名次與資產為 None"""
+        snap = self.get(max_age)
+        rank, assets = snap.index.get(username, (None, None))
+        return rank, assets, len(snap.rows), snap
@@ -0,0 +1,235 @@
+"""
+帳務事件簿：現金與持股的每一筆變動追加一列 LedgerEvent（不修改、不刪除），
+並定期為每個帳號存一份 AccountSnapshot。任一時點的狀態 = 該時點前最近的快照 + 之後的事件，
+查詢成本只與快照之後的事件數有關，不必從第一筆交易重播。
+同一帳號的事件以 id 為序；下單時事件與 Trade 在同一個 transaction 內寫入。
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from models import db, AccountSnapshot, LedgerEvent, Trade, User
+from money import from_cents
+from positions import BUY_TYPES
+
+OPEN, TRADE, ADJUST = "open", "trade", "adjust"
+SNAPSHOT_EVERY = 500                  # 重建歷史時每個帳號每這麼多筆事件存一份快照
+SNAPSHOT_LAG = timedelta(seconds=60)  # 定期快照只收這麼久以前的事件，避免漏掉還沒 commit 的較小 id
+CHUNK_SIZE = 5000
+INITIAL_CAPITAL_CENTS = User.__table__.c.balance_cents.default.arg  # 開戶入金（User.balance_cents 的預設值）
+
+
+@dataclass
+class AccountState:
+    user_id: int
+    balance_cents: int = 0
+    holdings: Dict[str, int] = field(default_factory=dict)
+    event_id: int = 0                 # 已累加到的最後一筆事件
+    as_of: Optional[datetime] = None  # 已累加事件中最晚的時間
+    replayed: int = 0                 # 這次查詢實際重播的事件數（快照之後）
+
+    def apply(self, event_id: int, created_at: datetime, cash_delta: int, ticker: Optional[str], qty_delta: int):
+        self.balance_cents += cash_delta
+        if ticker and qty_delta:
+            qty = self.holdings.get(ticker, 0) + qty_delta
+            if qty:
+                self.holdings[ticker] = qty
+            else:
+                self.holdings.pop(ticker, None)
+        self.event_id = event_id
+        # 同帳號的 id 與時間可能些微錯序（賣出的 created_at 在取得鎖之前就決定），取最晚的時間
+        self.as_of = created_at if self.as_of is None else max(self.as_of, created_at)
+        self.replayed += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "balance": from_cents(self.balance_cents),
+            "holdings": [{"ticker": t, "quantity": q} for t, q in sorted(self.holdings.items())],
+            "event_id": self.event_id,
+            "as_of": self.as_of.isoformat(sep=" ") if self.as_of else None,
+            "replayed": self.replayed,
+        }
+
+
+def trade_event(trade: Trade) -> dict:
+    """一筆成交對應的事件欄位：買入扣現金加股數，賣出相反"""
+    sign = 1 if trade.trade_type in BUY_TYPES else -1
+    return {
+        "user_id": trade.user_id,
+        "kind": TRADE,
+        "cash_delta_cents": -sign * trade.quantity * trade.price_cents,
+        "ticker": trade.ticker,
+        "qty_delta": sign * trade.quantity,
+        "trade_id": trade.id,
+        "created_at": trade.created_at,
+    }
+
+
+def record_trade(trade: Trade) -> LedgerEvent:
+    """交易已 flush 後呼叫，由呼叫端 commit"""
+    event = LedgerEvent(**trade_event(trade))
+    db.session.add(event)
+    return event
+
+
+def record_opening(user: User) -> LedgerEvent:
+    """開戶入金；user 已 flush（有 id）後呼叫，由呼叫端 commit"""
+    event = LedgerEvent(user_id=user.id, kind=OPEN, cash_delta_cents=user.balance_cents,
+                        created_at=user.created_at or datetime.utcnow())
+    db.session.add(event)
+    return event
+
+
+def _events(user_id: int, after_id: int, at: Optional[datetime], through_id: Optional[int]):
+    q = (db.session.query(LedgerEvent.id, LedgerEvent.created_at, LedgerEvent.cash_delta_cents,
+                          LedgerEvent.ticker, LedgerEvent.qty_delta)
+         .filter(LedgerEvent.user_id == user_id, LedgerEvent.id > after_id))
+    if at is not None:
+        q = q.filter(LedgerEvent.created_at <= at)
+    if through_id is not None:
+        q = q.filter(LedgerEvent.id <= through_id)
+    return q.order_by(LedgerEvent.id).yield_per(CHUNK_SIZE)
+
+
+def latest_snapshot(user_id: int, at: Optional[datetime] = None,
+                    through_id: Optional[int] = None) -> Optional[AccountSnapshot]:
+    q = AccountSnapshot.query.filter_by(user_id=user_id)
+    if at is not None:
+        q = q.filter(AccountSnapshot.as_of <= at)
+    if through_id is not None:
+        q = q.filter(AccountSnapshot.event_id <= through_id)
+    return q.order_by(AccountSnapshot.event_id.desc()).first()
+
+
+def state_at(user_id: int, at: Optional[datetime] = None, through_id: Optional[int] = None) -> AccountState:
+    """
+    帳號在 at（UTC，含）當下的現金與持股；at 為 None 表示目前。需在 app context 內呼叫。
+    through_id：只累加 id <= through_id 的事件（存快照用，快照必須涵蓋 event_id 以下的每一筆）。
+    """
+    state = AccountState(user_id)
+    snap = latest_snapshot(user_id, at, through_id)
+    if snap is not None:
+        state.balance_cents = snap.balance_cents
+        state.holdings = {t: int(q) for t, q in snap.holdings.items()}
+        state.event_id, state.as_of = snap.event_id, snap.as_of
+    for row in _events(user_id, state.event_id, at, through_id):
+        state.apply(*row)
+    return state
+
+
+def _snapshot_row(state: AccountState) -> dict:
+    return {"user_id": state.user_id, "event_id": state.event_id, "as_of": state.as_of,
+            "balance_cents": state.balance_cents, "holdings": dict(state.holdings),
+            "created_at": datetime.utcnow()}
+
+
+def take_snapshots(min_events: int = 1, now: Optional[datetime] = None) -> int:
+    """
+    為上次快照之後已累積 min_events 筆以上事件的帳號各存一份快照。
+    截止點以 id 決定：now - SNAPSHOT_LAG 以前最後一筆事件的 id，快照收進 id 不大於它的每一筆事件
+    （之後的查詢只重播 id > event_id，不能依時間挑，否則 id 較小但時間較晚的事件會永遠漏掉）。
+    每個帳號只重播自己快照之後的事件；多個 worker 同時執行時由唯一鍵擋下重複。回傳寫入份數。
+    """
+    cutoff = (now or datetime.utcnow()) - SNAPSHOT_LAG
+    through_id = db.session.query(db.func.max(LedgerEvent.id)).filter(LedgerEvent.created_at <= cutoff).scalar()
+    if through_id is None:
+        return 0
+    last = (db.session.query(AccountSnapshot.user_id, db.func.max(AccountSnapshot.event_id).label("event_id"))
+            .group_by(AccountSnapshot.user_id).subquery())
+    pending = (db.session.query(LedgerEvent.user_id)
+               .outerjoin(last, last.c.user_id == LedgerEvent.user_id)
+               .filter(LedgerEvent.id <= through_id,
+                       LedgerEvent.id > db.func.coalesce(last.c.event_id, 0))
+               .group_by(LedgerEvent.user_id)
+               .having(db.func.count(LedgerEvent.id) >= min_events)
+               .all())
+    written = 0
+    for (user_id,) in pending:
+        state = state_at(user_id, through_id=through_id)
+        try:
+            db.session.add(AccountSnapshot(**_snapshot_row(state)))
+            db.session.commit()
+            written += 1
+        except IntegrityError:
+            db.session.rollback()
+    return written
+
+
+def _user_filter(column, user_ids: Optional[List[int]]):
+    return column.in_(user_ids) if user_ids is not None else db.true()
+
+
+def rebuild_ledger(user_ids: Optional[Iterable[int]] = None, every: int = SNAPSHOT_EVERY) -> int:
+    """
+    由 Trade 重建事件簿（舊資料或帳目修正後使用），覆寫指定帳號的事件與快照；回傳寫入事件數。
+    開戶入金一律記為 INITIAL_CAPITAL_CENTS；目前餘額與「入金 + 交易現金流」的差額另記一筆 adjust 事件，
+    事件累加後與 User.balance_cents 一致，但帳目差異不會被併進入金（check_trades.py 仍會報出）。
+    之後依事件順序每 every 筆存一份快照，歷史時點查詢也不必從頭重播。
+    """
+    if user_ids is not None:
+        user_ids = list(user_ids)
+    db.session.execute(delete(AccountSnapshot).where(_user_filter(AccountSnapshot.user_id, user_ids)))
+    db.session.execute(delete(LedgerEvent).where(_user_filter(LedgerEvent.user_id, user_ids)))
+
+    signed = db.case((Trade.trade_type.in_(BUY_TYPES), -Trade.quantity), else_=Trade.quantity) * Trade.price_cents
+    trade_cash = dict(db.session.query(Trade.user_id, db.func.sum(signed))
+                      .filter(_user_filter(Trade.user_id, user_ids))
+                      .group_by(Trade.user_id).all())
+    users = (db.session.query(User.id, User.balance_cents, User.created_at)
+             .filter(_user_filter(User.id, user_ids)).all())
+    first_trade = dict(db.session.query(Trade.user_id, db.func.min(Trade.created_at))
+                       .filter(_user_filter(Trade.user_id, user_ids))
+                       .group_by(Trade.user_id).all())
+    opening, adjust = [], []
+    now = datetime.utcnow()
+    for uid, balance, created in users:
+        opening.append({"user_id": uid, "kind": OPEN, "cash_delta_cents": INITIAL_CAPITAL_CENTS, "qty_delta": 0,
+                        "created_at": min(filter(None, (created, first_trade.get(uid))))})
+        diff = balance - INITIAL_CAPITAL_CENTS - int(trade_cash.get(uid) or 0)
+        if diff:
+            adjust.append({"user_id": uid, "kind": ADJUST, "cash_delta_cents": diff, "qty_delta": 0,
+                           "created_at": now})
+    db.session.bulk_insert_mappings(LedgerEvent, opening)
+
+    # 依 Trade.id 分段讀取後寫入（不邊串流邊寫，MySQL 同一連線不允許）；同帳號的事件順序與成交順序一致
+    n = len(users)
+    last_id = 0
+    while True:
+        trades = (Trade.query.filter(_user_filter(Trade.user_id, user_ids), Trade.id > last_id)
+                  .order_by(Trade.id).limit(CHUNK_SIZE).all())
+        if not trades:
+            break
+        db.session.bulk_insert_mappings(LedgerEvent, [trade_event(t) for t in trades])
+        n += len(trades)
+        last_id = trades[-1].id
+        db.session.expire_all()
+    # 差額記在所有交易之後（id 較大），時點查詢在重建當下才反映
+    db.session.bulk_insert_mappings(LedgerEvent, adjust)
+    n += len(adjust)
+    db.session.flush()
+
+    if every > 0:
+        db.session.bulk_insert_mappings(AccountSnapshot, snapshot_history(user_ids, every))
+    db.session.commit()
+    return n
+
+
+def snapshot_history(user_ids: Optional[List[int]], every: int) -> List[dict]:
+    """依事件順序重播一次，回傳每個帳號每 every 筆事件一份的快照列（由呼叫端寫入）"""
+    rows = []
+    state: Optional[AccountState] = None
+    q = (db.session.query(LedgerEvent.user_id, LedgerEvent.id, LedgerEvent.created_at,
+                          LedgerEvent.cash_delta_cents, LedgerEvent.ticker, LedgerEvent.qty_delta)
+         .filter(_user_filter(LedgerEvent.user_id, user_ids))
+         .order_by(LedgerEvent.user_id, LedgerEvent.id))
+    for uid, *event in q.yield_per(CHUNK_SIZE):
+        if state is None or state.user_id != uid:
+            state = AccountState(uid)  # 依 user_id 排序，換帳號時前一個帳號已處理完
+        state.apply(*event)
+        if state.replayed % every == 0:
+            rows.append(_snapshot_row(state))
+    return rows
@@ -0,0 +1,129 @@
+"""台股交易日曆：交易時段、休市日、半日市，以及依開收盤決定報價 TTL"""
+import os
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Dict, Optional, Tuple
+
+try:
+    from zoneinfo import ZoneInfo
+    TZ = ZoneInfo("Asia/Taipei")
+except Exception:
+    import pytz
+    TZ = pytz.timezone("Asia/Taipei")
+
+SESSION_OPEN = dtime(9, 0)
+SESSION_CLOSE = dtime(13, 30)
+
+# 證交所公告休市日（含春節前無交易僅交割日）；新年度公告後補上，或用環境變數 TW_MARKET_HOLIDAYS 追加
+HOLIDAYS = {
+    # 2025
+    "2025-01-01", "2025-01-23", "2025-01-24", "2025-01-27", "2025-01-28", "2025-01-29",
+    "2025-01-30", "2025-01-31", "2025-02-28", "2025-04-03", "2025-04-04", "2025-05-01",
+    "2025-05-30", "2025-09-29", "2025-10-06", "2025-10-10", "2025-10-24", "2025-12-25",
+    # 2026
+    "2026-01-01", "2026-02-12", "2026-02-13", "2026-02-16", "2026-02-17", "2026-02-18",
+    "2026-02-19", "2026-02-20", "2026-02-27", "2026-04-03", "2026-04-06", "2026-05-01",
+    "2026-06-19", "2026-09-25", "2026-09-28", "2026-10-09", "2026-10-26", "2026-12-25",
+}
+
+# 提早收盤日 -> 收盤時間（例如颱風假下午停市），格式 TW_MARKET_HALF_DAYS=2026-07-01@11:00,...
+HALF_DAYS: Dict[str, dtime] = {}
+
+# 盤中 / 收盤後定盤前（官方收盤價可能還在更新）/ 其他時間
+TTL_OPEN = 5
+TTL_SETTLING = 60
+SETTLE_GRACE = timedelta(minutes=30)
+TTL_CLOSED_MAX = 6 * 3600
+
+
+def _load_env():
+    for d in filter(None, (x.strip() for x in os.getenv("TW_MARKET_HOLIDAYS", "").split(","))):
+        HOLIDAYS.add(d)
+    for item in filter(None, (x.strip() for x in os.getenv("TW_MARKET_HALF_DAYS", "").split(","))):
+        d, _, hm = item.partition("@")
+        hh, mm = (int(x) for x in hm.split(":"))
+        HALF_DAYS[d] = dtime(hh, mm)
+
+
+_load_env()
+
+
+def now_tw() -> datetime:
+    return datetime.now(TZ)
+
+
+def is_trading_day(d: date) -> bool:
+    return d.weekday() < 5 and d.isoformat() not in HOLIDAYS
+
+
+def session_bounds(d: date) -> Tuple[datetime, datetime]:
+    """該日開盤、收盤時間（含半日市）"""
+    close = HALF_DAYS.get(d.isoformat(), SESSION_CLOSE)
+    return datetime.combine(d, SESSION_OPEN, tzinfo=TZ), datetime.combine(d, close, tzinfo=TZ)
+
+
+def is_open(now: Optional[datetime] = None) -> bool:
+    now = now or now_tw()
+    if not is_trading_day(now.date()):
+        return False
+    start, end = session_bounds(now.date())
+    return start <= now <= end
+
+
+def previous_trading_day(d: date) -> date:
+    d -= timedelta(days=1)
+    while not is_trading_day(d):
+        d -= timedelta(days=1)
+    return d
+
+
+def next_trading_day(d: date) -> date:
+    d += timedelta(days=1)
+    while not is_trading_day(d):
+        d += timedelta(days=1)
+    return d
+
+
+def last_settled_session(now: Optional[datetime] = None) -> date:
+    """最近一個已收盤的交易日（盤中則為前一交易日）"""
+    now = now or now_tw()
+    today = now.date()
+    if is_trading_day(today) and now > session_bounds(today)[1]:
+        return today
+    return previous_trading_day(today)
+
+
+def current_session(now: Optional[datetime] = None) -> date:
+    """盤中回傳今天；其餘時間回傳最近一個已收盤的交易日"""
+    now = now or now_tw()
+    return now.date() if is_open(now) else last_settled_session(now)
+
+
+def next_open(now: Optional[datetime] = None) -> datetime:
+    now = now or now_tw()
+    today = now.date()
+    if is_trading_day(today) and now < session_bounds(today)[0]:
+        return session_bounds(today)[0]
+    return session_bounds(next_trading_day(today))[0]
+
+
+def is_settled(now: Optional[datetime] = None) -> bool:
+    """收盤已超過定盤緩衝時間，最後價格不會再變"""
+    now = now or now_tw()
+    if is_open(now):
+        return False
+    today = now.date()
+    if is_trading_day(today):
+        start, end = session_bounds(today)
+        if end < now < end + SETTLE_GRACE:
+            return False
+    return True
+
+
+def quote_ttl(now: Optional[datetime] = None) -> float:
+    """盤中短 TTL；收盤後定盤前中等；休市時放寬到下次開盤（上限 TTL_CLOSED_MAX）"""
+    now = now or now_tw()
+    if is_open(now):
+        return TTL_OPEN
+    if not is_settled(now):
+        return TTL_SETTLING
+    return max(TTL_SETTLING, min(TTL_CLOSED_MAX, (next_open(now) - now).total_seconds()))
@@ -0,0 +1,88 @@
+import sys
+
+from sqlalchemy import inspect, text
+
+from app import app
+from models import db
+
+# 金額欄位由浮點（元）改為整數（分）：python migrate_money.py [--dry-run]
+# 每個欄位：新增 *_cents 欄 -> 依 id 分段 ROUND(舊值 * 100) 回填 -> 逐筆核對 -> 刪除舊欄。
+# 已遷移過的欄位（舊欄不存在）會略過，可重複執行。刪除欄位需要 SQLite 3.35+ 或 MySQL。
+# 另補上既有資料表缺少的索引（create_all 不會替已存在的表加索引）。
+COLUMNS = [
+    # (資料表, 舊欄位, 新欄位, 是否必填)
+    ("user", "balance", "balance_cents", True),
+    ("trade", "price", "price_cents", True),
+    ("lot", "price", "price_cents", True),
+    ("resting_order", "price", "price_cents", True),
+    ("resting_order", "fill_price", "fill_price_cents", False),
+]
+INDEXES = [
+    # (資料表, 索引名稱, 欄位)：交易紀錄分頁與匯出的 (user_id, created_at, id) 游標
+    ("trade", "ix_trade_user_created", ("user_id", "created_at", "id")),
+]
+BATCH = 10000
+DRY_RUN = "--dry-run" in sys.argv[1:]
+
+
+def migrate(conn, table, old, new, required):
+    q = conn.dialect.identifier_preparer.quote
+    t, o, n = q(table), q(old), q(new)
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if old not in columns:
+        print(f"ℹ️ {table}.{old} 已遷移過，略過")
+        return
+    if new not in columns:
+        print(f"➕ {table} 新增欄位 {new}")
+        if not DRY_RUN:
+            conn.execute(text(f"ALTER TABLE {t} ADD COLUMN {n} BIGINT"))
+
+    lo, hi = conn.execute(text(f"SELECT MIN(id), MAX(id) FROM {t}")).one()
+    if lo is not None and not DRY_RUN:
+        for start in range(lo, hi + 1, BATCH):
+            conn.execute(text(f"UPDATE {t} SET {n} = ROUND({o} * 100) "
+                              f"WHERE id >= :a AND id < :b AND {o} IS NOT NULL"),
+                         {"a": start, "b": start + BATCH})
+    total = conn.execute(text(f"SELECT COUNT(*) FROM {t} WHERE {o} IS NOT NULL")).scalar()
+    if DRY_RUN:
+        print(f"🔍 {table}.{old} -> {new}：{total} 筆待轉換")
+        return
+
+    # 核對：每筆新值與舊值 * 100 的差距都要在半分以內
+    bad = conn.execute(text(f"SELECT COUNT(*) FROM {t} WHERE {o} IS NOT NULL "
+                            f"AND ({n} IS NULL OR ABS({n} - {o} * 100) > 0.5)")).scalar()
+    if bad:
+        raise RuntimeError(f"{table}.{new} 有 {bad} 筆與舊值不符，已中止（舊欄位保留）")
+    conn.execute(text(f"ALTER TABLE {t} DROP COLUMN {o}"))
+    if required and conn.dialect.name == "mysql":
+        conn.execute(text(f"ALTER TABLE {t} MODIFY {n} BIGINT NOT NULL"))
+    print(f"✅ {table}.{old} -> {new}：{total} 筆")
+
+
+def ensure_index(conn, table, name, columns):
+    # 等同 CREATE INDEX IF NOT EXISTS（MySQL 不支援該語法，先查既有索引）
+    if name in {i["name"] for i in inspect(conn).get_indexes(table)}:
+        print(f"ℹ️ {table}.{name} 已存在，略過")
+        return
+    if DRY_RUN:
+        print(f"🔍 {table} 待建立索引 {name}")
+        return
+    q = conn.dialect.identifier_preparer.quote
+    conn.execute(text(f"CREATE INDEX {q(name)} ON {q(table)} ({', '.join(q(c) for c in columns)})"))
+    print(f"✅ {table} 已建立索引 {name}")
+
+
+with app.app_context():
+    tables = set(inspect(db.engine).get_table_names())
+    for table, old, new, required in COLUMNS:
+        if table not in tables:
+            print(f"ℹ️ 沒有資料表 {table}，略過（init_db.py 會直接建立新欄位）")
+            continue
+        # 每個欄位一個交易：核對失敗時整個欄位的回填一起回滾（MySQL 的 DDL 會自動提交，失敗時可重跑）
+        with db.engine.begin() as conn:
+            migrate(conn, table, old, new, required)
+    for table, name, columns in INDEXES:
+        if table in tables:
+            with db.engine.begin() as conn:
+                ensure_index(conn, table, name, columns)
+    print("🔍 僅檢查，未修改資料" if DRY_RUN else "✅ 金額欄位遷移完成")
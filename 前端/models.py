@@ -1,6 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy.ext.hybrid import hybrid_property
+
+from money import to_cents, from_cents
 
 # 初始化 SQLAlchemy 實例（僅此一處）
 db = SQLAlchemy()
@@ -11,22 +14,45 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    balance = db.Column(db.Float, default=10000000, nullable=False)  # 💰 初始資金一千萬
+    balance_cents = db.Column(db.BigInteger, default=10000000 * 100, nullable=False)  # 💰 初始資金一千萬（單位：分）
     # 關聯交易紀錄與測驗結果
     trades = db.relationship('Trade', backref='user', lazy=True)
     results = db.relationship('Result', backref='user', lazy=True)
 
+    # 以元讀寫的便利屬性；運算請直接用 balance_cents
+    @hybrid_property
+    def balance(self):
+        return from_cents(self.balance_cents)
+
+    @balance.setter
+    def balance(self, value):
+        self.balance_cents = to_cents(value)
+
 # 交易紀錄資料表
 class Trade(db.Model):
+    # 交易紀錄分頁（keyset）依 (user_id, created_at, id) 往回翻
+    __table_args__ = (db.Index("ix_trade_user_created", "user_id", "created_at", "id"),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     ticker = db.Column(db.String(10), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    price_cents = db.Column(db.BigInteger, nullable=False)  # 成交價（單位：分）
     trade_type = db.Column(db.String(10), nullable=False)  # "買入" 或 "賣出"
     mode = db.Column(db.String(10), default="整股")  # 整股或零股
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    @hybrid_property
+    def price(self):
+        return from_cents(self.price_cents)
+
+    @price.setter
+    def price(self, value):
+        self.price_cents = to_cents(value)
+
+    @property
+    def amount_cents(self) -> int:
+        return self.quantity * self.price_cents
+
 # 投資個性測驗結果資料表
 class Result(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -35,3 +61,127 @@ class Result(db.Model):
     style = db.Column(db.String(20), nullable=False)
     suggestion = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# 股票代號主檔（FinMind taiwan_stock_info，每日更新）
+class StockSymbol(db.Model):
+    code = db.Column(db.String(10), primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    market = db.Column(db.String(10), nullable=False)  # "TSE"（上市）或 "OTC"（上櫃）等
+    industry = db.Column(db.String(50))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# 日線資料（代號 + 交易日）；收盤後的定盤價也存在這裡
+class DailyBar(db.Model):
+    code = db.Column(db.String(10), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    open = db.Column(db.Float)
+    high = db.Column(db.Float)
+    low = db.Column(db.Float)
+    close = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.BigInteger)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# 日線同步範圍：已向上游抓過 [covered_from, covered_to]，範圍內不再重抓
+class BarSync(db.Model):
+    code = db.Column(db.String(10), primary_key=True)
+    covered_from = db.Column(db.Date, nullable=False)
+    covered_to = db.Column(db.Date, nullable=False)
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# 最近一個已定盤交易日的 1 分鐘線（每檔只留一天，time 為 UTC）；收盤後的當日概覽直接讀這裡
+class IntradayBar(db.Model):
+    code = db.Column(db.String(10), primary_key=True)
+    time = db.Column(db.DateTime, primary_key=True)
+    open = db.Column(db.Float)
+    high = db.Column(db.Float)
+    low = db.Column(db.Float)
+    close = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.BigInteger)
+
+# 目前持股（每次交易同步更新，讀取不必重播全部交易）
+class Position(db.Model):
+    __table_args__ = (db.UniqueConstraint("user_id", "ticker", name="uq_position_user_ticker"),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    ticker = db.Column(db.String(10), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# 尚未賣出的買入批次（FIFO 由 id 小到大扣）
+class Lot(db.Model):
+    __table_args__ = (db.Index("ix_lot_user_ticker", "user_id", "ticker", "id"),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    ticker = db.Column(db.String(10), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)  # 剩餘股數
+    price_cents = db.Column(db.BigInteger, nullable=False)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    @hybrid_property
+    def price(self):
+        return from_cents(self.price_cents)
+
+# 每日結算：每個帳號收盤後的總資產與名次
+class EquitySnapshot(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "date", name="uq_equity_user_date"),
+        db.Index("ix_equity_date_rank", "date", "rank"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    cash = db.Column(db.Float, nullable=False)
+    equity = db.Column(db.Float, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+
+# 掛單（限價／停損），觸發後成交為一筆 Trade
+class RestingOrder(db.Model):
+    __table_args__ = (db.Index("ix_resting_status_ticker", "status", "ticker"),
+                      db.Index("ix_resting_user_status", "user_id", "status"))
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    ticker = db.Column(db.String(10), nullable=False)
+    side = db.Column(db.String(10), nullable=False)        # "買入" 或 "賣出"
+    order_type = db.Column(db.String(10), nullable=False)  # "limit" 或 "stop"
+    price_cents = db.Column(db.BigInteger, nullable=False)  # 限價或停損觸發價（單位：分）
+    quantity = db.Column(db.Integer, nullable=False)
+    mode = db.Column(db.String(10), default="整股")
+    status = db.Column(db.String(10), default="open", nullable=False)  # open / filled / cancelled / rejected
+    fill_price_cents = db.Column(db.BigInteger)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'))
+    message = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    @hybrid_property
+    def price(self):
+        return from_cents(self.price_cents)
+
+    @property
+    def fill_price(self):
+        return from_cents(self.fill_price_cents) if self.fill_price_cents is not None else None
+
+# 帳務事件（只追加）：現金與持股的每一筆變動；帳號狀態 = 依 id 順序累加所有事件
+class LedgerEvent(db.Model):
+    __table_args__ = (db.Index("ix_ledger_user_id", "user_id", "id"),)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # "open"（開戶入金）/ "trade" / "adjust"
+    cash_delta_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    ticker = db.Column(db.String(10))
+    qty_delta = db.Column(db.Integer, nullable=False, default=0)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trade.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# 帳號快照：累加到 event_id（含）為止的狀態；時點查詢從最近的快照往後補事件
+class AccountSnapshot(db.Model):
+    __table_args__ = (db.UniqueConstraint("user_id", "event_id", name="uq_snapshot_user_event"),
+                      db.Index("ix_snapshot_user_asof", "user_id", "as_of"))
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    event_id = db.Column(db.BigInteger, nullable=False)
+    as_of = db.Column(db.DateTime, nullable=False)  # event_id 那筆事件的時間
+    balance_cents = db.Column(db.BigInteger, nullable=False)
+    holdings = db.Column(db.JSON, nullable=False)   # {代號: 股數}，只列非零
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
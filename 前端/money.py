@@ -0,0 +1,34 @@
+"""金額以整數「分」（新台幣 0.01 元）保存與運算；只有在輸入（報價、表單）與輸出（JSON、畫面）時換算成元"""
+import math
+from decimal import Decimal, ROUND_HALF_UP
+
+CENTS = 100
+
+
+def to_cents(value) -> int:
+    """元 -> 分（四捨五入）；經由 str 轉 Decimal，避免 0.29 * 100 = 28.999... 這類誤差"""
+    if isinstance(value, int):
+        return value * CENTS
+    return int((Decimal(str(value)) * CENTS).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def parse_cents(value) -> int:
+    """使用者輸入的價格（元）-> 分；不是數字、NaN / inf、或換算後不到 1 分都拋 ValueError"""
+    price = float(value)
+    if not math.isfinite(price):
+        raise ValueError(f"價格無效：{value}")
+    cents = to_cents(price)
+    if cents <= 0:
+        raise ValueError(f"價格需大於 0：{value}")
+    return cents
+
+
+def from_cents(cents):
+    """分 -> 元；也可用在 SQL 運算式與 NumPy 陣列上"""
+    return cents / CENTS
+
+
+def div_round(a: int, b: int) -> int:
+    """整數除法四捨五入（b > 0），例如總成本 / 股數 得到平均成本（分）"""
+    q, r = divmod(a, b)
+    return q + (1 if 2 * r >= b else 0)
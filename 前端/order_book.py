@@ -0,0 +1,247 @@
+"""限價／停損掛單：記憶體內每個代號兩個依觸發價（分）排序的 heap，每次報價只取出價位被穿越的掛單"""
+import heapq
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import update
+
+from models import db, RestingOrder
+from money import to_cents
+from orders import BUY, OrderError, execute_order
+import market_calendar
+
+LIMIT, STOP = "limit", "stop"
+
+
+def triggers_below(side: str, order_type: str) -> bool:
+    """
+    價格跌到觸發價以下才成交：買入限價、賣出停損；
+    其餘（賣出限價、買入停損）是價格漲到觸發價以上。
+    """
+    return (side == BUY) == (order_type == LIMIT)
+
+
+class OrderBook:
+    """
+    純記憶體索引，不碰資料庫。
+    below[代號]：max-heap（存 -價格），價格 <= 觸發價的都要觸發，堆頂是最高觸發價；
+    above[代號]：min-heap，價格 >= 觸發價的都要觸發，堆頂是最低觸發價。
+    取消採延遲刪除：只從 _live 移除，彈出時略過；某代號已取消的殘留過多時才重建該代號的 heap。
+    """
+
+    def __init__(self):
+        self._below: Dict[str, List[Tuple[float, int]]] = {}
+        self._above: Dict[str, List[Tuple[float, int]]] = {}
+        self._live: Dict[int, str] = {}    # order_id -> 代號
+        self._count: Dict[str, int] = {}   # 代號 -> 有效掛單數
+        self._stale: Dict[str, int] = {}   # 代號 -> heap 中已取消的殘留數
+        self._lock = threading.Lock()
+
+    def add(self, order_id: int, ticker: str, side: str, order_type: str, price: int):
+        with self._lock:
+            if order_id in self._live:
+                return
+            self._live[order_id] = ticker
+            self._count[ticker] = self._count.get(ticker, 0) + 1
+            if triggers_below(side, order_type):
+                heapq.heappush(self._below.setdefault(ticker, []), (-price, order_id))
+            else:
+                heapq.heappush(self._above.setdefault(ticker, []), (price, order_id))
+
+    def cancel(self, order_id: int) -> bool:
+        with self._lock:
+            ticker = self._live.pop(order_id, None)
+            if ticker is None:
+                return False
+            self._dec(ticker)
+            self._stale[ticker] = self._stale.get(ticker, 0) + 1
+            if self._stale[ticker] > 64 and self._stale[ticker] > self._count.get(ticker, 0):
+                self._rebuild(ticker)
+            return True
+
+    def _dec(self, ticker: str):
+        """需持有 _lock"""
+        n = self._count.get(ticker, 0) - 1
+        if n > 0:
+            self._count[ticker] = n
+        else:
+            self._count.pop(ticker, None)
+
+    def _rebuild(self, ticker: str):
+        """需持有 _lock；丟掉該代號 heap 中已取消的項目"""
+        for book in (self._below, self._above):
+            heap = [e for e in book.get(ticker, ()) if e[1] in self._live]
+            if heap:
+                heapq.heapify(heap)
+                book[ticker] = heap
+            else:
+                book.pop(ticker, None)
+        self._stale.pop(ticker, None)
+
+    def _pop_crossed(self, book: Dict[str, List[Tuple[float, int]]], ticker: str,
+                     crossed: Callable[[float], bool], out: List[int]):
+        """需持有 _lock"""
+        heap = book.get(ticker)
+        while heap and crossed(heap[0][0]):
+            _, oid = heapq.heappop(heap)
+            if self._live.pop(oid, None) is not None:
+                self._dec(ticker)
+                out.append(oid)
+            elif self._stale.get(ticker):
+                self._stale[ticker] -= 1
+        if heap is not None and not heap:
+            del book[ticker]
+
+    def match(self, ticker: str, price: int) -> List[int]:
+        """取出所有被 price 穿越的掛單（同價位依掛單先後），O(k log n)；沒被穿越時只看兩個堆頂"""
+        out: List[int] = []
+        with self._lock:
+            self._pop_crossed(self._below, ticker, lambda neg: -neg >= price, out)
+            self._pop_crossed(self._above, ticker, lambda p: p <= price, out)
+        return out
+
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return list(self._count)
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open_orders": len(self._live),
+                "symbols": len(self._count),
+                "heap_entries": sum(len(h) for h in self._below.values()) + sum(len(h) for h in self._above.values()),
+            }
+
+
+def resting_fill_price(order: RestingOrder, quote: float, fill: Callable[[float, str], int]) -> int:
+    """成交價（分）：停損觸發後以市價（含滑價）成交；限價單不會比限價差"""
+    px = fill(quote, order.side)
+    if order.order_type == LIMIT:
+        px = min(px, order.price_cents) if order.side == BUY else max(px, order.price_cents)
+    return px
+
+
+class OrderMatcher:
+    """把 OrderBook 接到報價輪詢：每輪報價只處理被觸發的掛單，成交走 execute_order"""
+
+    def __init__(self, app, book: OrderBook, fill: Callable[[float, str], int], resync_seconds: float = 30):
+        """fill(quote, side) -> 成交價（分，含滑價與升降單位）"""
+        self.app = app
+        self.book = book
+        self.fill = fill
+        self.resync_seconds = resync_seconds
+        self._max_loaded_id = 0
+        self._last_resync = 0.0
+        self._load_lock = threading.Lock()
+        self.hub = None
+        self.ticks = 0
+        self.triggered = 0
+        self.filled = 0
+        self.rejected = 0
+        self.last_match_ms = 0.0
+
+    def load(self) -> int:
+        """把資料庫中尚未載入的 open 掛單放進記憶體（其他 worker 新增的也會在下次 resync 補上）"""
+        with self._load_lock, self.app.app_context():
+            rows = (db.session.query(RestingOrder.id, RestingOrder.ticker, RestingOrder.side,
+                                     RestingOrder.order_type, RestingOrder.price_cents)
+                    .filter(RestingOrder.status == "open", RestingOrder.id > self._max_loaded_id)
+                    .order_by(RestingOrder.id)
+                    .all())
+            for oid, ticker, side, order_type, price in rows:
+                self.book.add(oid, ticker, side, order_type, price)
+                self._max_loaded_id = max(self._max_loaded_id, oid)
+            self._last_resync = time.time()
+            return len(rows)
+
+    def start(self, hub):
+        """載入 open 掛單並掛到報價輪詢器；重複呼叫無作用"""
+        with self._load_lock:
+            if self.hub is not None:
+                return
+            self.hub = hub
+        self.load()
+        hub.add_listener(self.on_prices, self.symbols)
+
+    def add(self, order: RestingOrder):
+        self.book.add(order.id, order.ticker, order.side, order.order_type, order.price_cents)
+        if self.hub is not None:
+            self.hub.wake()
+
+    def cancel(self, order_id: int):
+        self.book.cancel(order_id)
+
+    def symbols(self) -> Iterable[str]:
+        if time.time() - self._last_resync > self.resync_seconds:
+            try:
+                self.load()
+            except Exception as e:
+                print(f"⚠️ 掛單重新載入失敗：{e}")
+        return self.book.symbols()
+
+    def on_prices(self, prices: Dict[str, float], now: Optional[datetime] = None):
+        """報價輪詢的 listener；休市時不撮合"""
+        if not market_calendar.is_open(now):
+            return
+        started = time.perf_counter()
+        triggered = [(oid, px) for t, px in prices.items() if px is not None
+                     for oid in self.book.match(t, to_cents(px))]
+        self.ticks += 1
+        self.last_match_ms = (time.perf_counter() - started) * 1000
+        if triggered:
+            self.triggered += len(triggered)
+            with self.app.app_context():
+                for oid, quote in triggered:
+                    self._execute(oid, quote)
+
+    def _execute(self, order_id: int, quote: float):
+        """以 open -> filled 的條件式 UPDATE 認領，多個 worker 不會重複成交"""
+        order = db.session.get(RestingOrder, order_id)
+        if order is None or order.status != "open":
+            return
+        px = resting_fill_price(order, quote, self.fill)
+        now = datetime.utcnow()
+        try:
+            claimed = db.session.execute(
+                update(RestingOrder)
+                .where(RestingOrder.id == order_id, RestingOrder.status == "open")
+                .values(status="filled", fill_price_cents=px, updated_at=now)
+                .execution_options(synchronize_session=False)).rowcount
+            if claimed != 1:
+                db.session.rollback()
+                return
+            trade = execute_order(order.user_id, order.ticker, order.side, order.quantity, px,
+                                  order.mode or "整股", commit=False)
+            db.session.execute(update(RestingOrder).where(RestingOrder.id == order_id)
+                               .values(trade_id=trade.id)
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+            self.filled += 1
+        except OrderError as e:
+            db.session.rollback()
+            db.session.execute(update(RestingOrder)
+                               .where(RestingOrder.id == order_id, RestingOrder.status == "open")
+                               .values(status="rejected", message=e.message, updated_at=now)
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+            self.rejected += 1
+        except Exception as e:
+            db.session.rollback()
+            # 沒成交，放回簿中下輪再試
+            self.book.add(order.id, order.ticker, order.side, order.order_type, order.price_cents)
+            print(f"⚠️ 掛單 {order_id} 成交失敗：{e}")
+
+    def stats(self) -> dict:
+        return {
+            **self.book.stats(),
+            "ticks": self.ticks,
+            "triggered": self.triggered,
+            "filled": self.filled,
+            "rejected": self.rejected,
+            "last_match_ms": round(self.last_match_ms, 3),
+        }
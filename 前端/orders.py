@@ -0,0 +1,226 @@
+"""下單執行：餘額以條件式 UPDATE 扣款、持股以條件式 UPDATE 扣減，不在 Python 端讀出再寫回；金額一律為整數分"""
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import update
+
+from models import db, User, Trade, Position
+from money import from_cents, parse_cents, to_cents
+from ledger import record_trade
+from positions import apply_trade
+
+BUY, SELL = "買入", "賣出"
+
+
+# 台股升降單位（價格區間上限, 跳動點），單位：分
+TICK_TABLE = ((1000, 1), (5000, 5), (10000, 10), (50000, 50), (100000, 100), (float("inf"), 500))
+
+
+class OrderError(Exception):
+    """下單被拒；code 供呼叫端判斷原因，message 可直接回給使用者"""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def tick_size(price_cents: int) -> int:
+    for upper, tick in TICK_TABLE:
+        if price_cents < upper:
+            return tick
+    return TICK_TABLE[-1][1]
+
+
+def fill_price_cents(quote: float, side: str, slippage_bps: float = 0) -> int:
+    """
+    參考價（元）加上滑價後的成交價（分）：買入往上、賣出往下偏 slippage_bps 個基點，
+    再對齊升降單位（買入進位、賣出捨去），不會比參考價對使用者更有利。
+    報價換成分之後全用整數：滑價以 1/10000 分為單位計算再進位／捨去。
+    """
+    q = to_cents(quote)
+    bps = round(slippage_bps * 100)  # 1/100 基點，支援 2.5 這類設定
+    num = q * (1000000 + (bps if side == BUY else -bps))
+    raw = -(-num // 1000000) if side == BUY else num // 1000000
+    tick = tick_size(raw)
+    return -(-raw // tick) * tick if side == BUY else raw // tick * tick
+
+
+def fill_price(quote: float, side: str, slippage_bps: float = 0) -> float:
+    """同 fill_price_cents，回傳元（顯示用）"""
+    return from_cents(fill_price_cents(quote, side, slippage_bps))
+
+
+def execute_order(user_id: int, ticker: str, side: str, quantity: int, price_cents: int,
+                  mode: str = "整股", commit: bool = True) -> Trade:
+    """
+    price_cents：成交價（分），金額 = 股數 × 價格，全程整數。
+    買入：UPDATE user SET balance_cents = balance_cents - cost WHERE id = ? AND balance_cents >= cost
+    賣出：UPDATE position SET quantity = quantity - q WHERE ... AND quantity >= q，再入帳
+    兩個併發委託不會超買或超賣；帳務事件與交易同一個 transaction 寫入。
+    commit=False 時由呼叫端控制 transaction。
+    """
+    if side not in (BUY, SELL):
+        raise OrderError("bad_side", "買賣別錯誤")
+    if not ticker or quantity <= 0 or price_cents <= 0:
+        raise OrderError("bad_request", "資料錯誤")
+
+    amount = int(quantity) * int(price_cents)
+    try:
+        if side == BUY:
+            res = db.session.execute(
+                update(User)
+                .where(User.id == user_id, User.balance_cents >= amount)
+                .values(balance_cents=User.balance_cents - amount)
+                .execution_options(synchronize_session=False))
+            if res.rowcount != 1:
+                raise OrderError("insufficient_funds", "餘額不足")
+
+        trade = Trade(
+            user_id=user_id,
+            ticker=ticker,
+            quantity=quantity,
+            price_cents=price_cents,
+            trade_type=side,
+            mode=mode,
+            created_at=datetime.utcnow()
+        )
+        db.session.add(trade)
+        db.session.flush()
+
+        if not apply_trade(trade):
+            raise OrderError("insufficient_shares", "持股不足")
+        record_trade(trade)
+        if side == SELL:
+            db.session.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(balance_cents=User.balance_cents + amount)
+                .execution_options(synchronize_session=False))
+
+        if commit:
+            db.session.commit()
+        return trade
+    except Exception:
+        if commit:
+            db.session.rollback()
+        raise
+
+
+MAX_BATCH_ORDERS = 100
+
+
+def parse_leg(raw, pricer: Optional[Callable[[str, str], Optional[int]]] = None) -> dict:
+    """
+    批次委託的一筆；格式錯誤拋 OrderError。price_cents 為成交價（分）：
+    有 pricer(ticker, side) -> 分 時由它決定，忽略 price 欄位；否則取 price（元）換算。
+    """
+    if not isinstance(raw, dict):
+        raise OrderError("bad_request", "資料錯誤")
+    side = raw.get("side") or raw.get("trade_type")
+    side = {"buy": BUY, "sell": SELL}.get(side, side)
+    try:
+        leg = {
+            "ticker": str(raw.get("ticker") or "").strip(),
+            "side": side,
+            "quantity": int(raw.get("quantity", 0)),
+            "price_cents": parse_cents(raw.get("price", 0)) if pricer is None else 0,
+            "mode": raw.get("mode", "整股"),
+        }
+    except (TypeError, ValueError):
+        raise OrderError("bad_request", "資料錯誤")
+    if side not in (BUY, SELL):
+        raise OrderError("bad_side", "買賣別錯誤")
+    if not leg["ticker"] or leg["quantity"] <= 0:
+        raise OrderError("bad_request", "資料錯誤")
+    if pricer is not None:
+        leg["price_cents"] = pricer(leg["ticker"], side)
+        if leg["price_cents"] is None:
+            raise OrderError("no_quote", "查無即時價格，暫時無法成交")
+    if leg["price_cents"] <= 0:
+        raise OrderError("bad_request", "資料錯誤")
+    return leg
+
+
+def execute_batch(user_id: int, orders: list, atomic: bool = True,
+                  pricer: Optional[Callable[[str, str], Optional[int]]] = None):
+    """
+    一次送出多筆委託，全部在同一個 transaction 內執行、最後只 commit 一次。
+    先鎖住帳號列，以同一份餘額／持股快照依序試算（賣出先於買入，賣出款可支應同批買入）；
+    atomic=True 時任一筆不成立就全部不執行，否則每筆各自一個 savepoint，失敗的只退回該筆。
+    回傳 (results, committed)；results 與 orders 順序相同。
+    """
+    results = [{"index": i, "status": "pending"} for i in range(len(orders))]
+    legs = {}
+    for i, raw in enumerate(orders):
+        try:
+            legs[i] = parse_leg(raw, pricer)
+            results[i].update({k: legs[i][k] for k in ("ticker", "side", "quantity")},
+                              price=from_cents(legs[i]["price_cents"]))
+        except OrderError as e:
+            results[i].update(status="rejected", code=e.code, message=e.message)
+
+    # 快照：帳號列加鎖，同一帳號的其他委託等這批做完
+    balance = (db.session.query(User.balance_cents).filter(User.id == user_id)
+               .with_for_update().scalar())
+    tickers = {leg["ticker"] for leg in legs.values()}
+    held = dict(db.session.query(Position.ticker, Position.quantity)
+                .filter(Position.user_id == user_id, Position.ticker.in_(tickers))) if tickers else {}
+
+    order = sorted(legs, key=lambda i: legs[i]["side"] != SELL)
+    planned = []
+    for i in order:
+        leg = legs[i]
+        amount = leg["quantity"] * leg["price_cents"]
+        if leg["side"] == SELL:
+            if held.get(leg["ticker"], 0) < leg["quantity"]:
+                results[i].update(status="rejected", code="insufficient_shares", message="持股不足")
+                continue
+            held[leg["ticker"]] -= leg["quantity"]
+            balance += amount
+        else:
+            if balance < amount:
+                results[i].update(status="rejected", code="insufficient_funds", message="餘額不足")
+                continue
+            balance -= amount
+            held[leg["ticker"]] = held.get(leg["ticker"], 0) + leg["quantity"]
+        planned.append(i)
+
+    failed = any(r["status"] == "rejected" for r in results)
+    if atomic and failed:
+        db.session.rollback()
+        for r in results:
+            if r["status"] == "pending":
+                r.update(status="skipped", code="batch_rejected", message="同批其他委託不成立，未執行")
+        return results, False
+
+    try:
+        for i in planned:
+            leg = legs[i]
+            try:
+                if atomic:
+                    trade = execute_order(user_id, leg["ticker"], leg["side"], leg["quantity"],
+                                          leg["price_cents"], leg["mode"], commit=False)
+                else:
+                    with db.session.begin_nested():
+                        trade = execute_order(user_id, leg["ticker"], leg["side"], leg["quantity"],
+                                              leg["price_cents"], leg["mode"], commit=False)
+            except OrderError as e:
+                # 帳號列已鎖，正常不會走到這裡；保險起見仍照語意處理
+                results[i].update(status="rejected", code=e.code, message=e.message)
+                if atomic:
+                    raise
+                continue
+            results[i].update(status="filled", trade_id=trade.id)
+        db.session.commit()
+    except OrderError:
+        db.session.rollback()
+        for r in results:
+            if r["status"] in ("pending", "filled"):
+                r.pop("trade_id", None)
+                r.update(status="skipped", code="batch_rejected", message="同批其他委託不成立，未執行")
+        return results, False
+    except Exception:
+        db.session.rollback()
+        raise
+    return results, True
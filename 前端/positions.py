@@ -0,0 +1,145 @@
+"""持股與 FIFO 批次的增量維護：交易寫入時同一個 transaction 內更新，另提供由 Trade 重建"""
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Trade, Position, Lot
+from money import div_round, from_cents
+
+BUY_TYPES = ("買入", "buy")
+
+
+def get_position(user_id: int, ticker: str, for_update: bool = False) -> Optional[Position]:
+    q = Position.query.filter_by(user_id=user_id, ticker=ticker)
+    if for_update:
+        q = q.with_for_update()
+    return q.first()
+
+
+def holding_qty(user_id: int, ticker: str) -> int:
+    pos = get_position(user_id, ticker)
+    return pos.quantity if pos else 0
+
+
+def apply_trade(trade: Trade) -> bool:
+    """
+    把一筆剛寫入（已 flush）的交易套用到 Position / Lot；由呼叫端 commit。
+    一律用條件式 UPDATE，不做讀出再寫回；賣出時持股不足回傳 False 且不做任何異動。
+    """
+    if trade.trade_type in BUY_TYPES:
+        _add_buy(trade)
+        return True
+    return _take_sell(trade)
+
+
+def _add_buy(trade: Trade):
+    now = datetime.utcnow()
+    inc = (update(Position)
+           .where(Position.user_id == trade.user_id, Position.ticker == trade.ticker)
+           .values(quantity=Position.quantity + trade.quantity, updated_at=now)
+           .execution_options(synchronize_session=False))
+    if db.session.execute(inc).rowcount == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Position(user_id=trade.user_id, ticker=trade.ticker,
+                                        quantity=trade.quantity, updated_at=now))
+        except IntegrityError:
+            # 同時有另一筆首次買入已建立持股列，改為遞增
+            db.session.execute(inc)
+    db.session.add(Lot(user_id=trade.user_id, ticker=trade.ticker, quantity=trade.quantity,
+                       price_cents=trade.price_cents, trade_id=trade.id, created_at=trade.created_at))
+
+
+def _take_sell(trade: Trade) -> bool:
+    dec = (update(Position)
+           .where(Position.user_id == trade.user_id, Position.ticker == trade.ticker,
+                  Position.quantity >= trade.quantity)
+           .values(quantity=Position.quantity - trade.quantity, updated_at=datetime.utcnow())
+           .execution_options(synchronize_session=False))
+    if db.session.execute(dec).rowcount != 1:
+        return False
+
+    # FIFO：先把最早買入的扣掉（鎖住批次列，併發賣出依序處理）
+    remaining = trade.quantity
+    lots = (Lot.query.filter_by(user_id=trade.user_id, ticker=trade.ticker)
+            .order_by(Lot.id).with_for_update())
+    for lot in lots:
+        if remaining <= 0:
+            break
+        if lot.quantity > remaining:
+            lot.quantity -= remaining
+            remaining = 0
+        else:
+            remaining -= lot.quantity
+            db.session.delete(lot)
+
+    # 全部賣光就刪除持股列
+    db.session.execute(delete(Position)
+                       .where(Position.user_id == trade.user_id, Position.ticker == trade.ticker,
+                              Position.quantity <= 0)
+                       .execution_options(synchronize_session=False))
+    return True
+
+
+def portfolio_rows(user_id: int) -> list:
+    """[{ticker, quantity, costAvg}]，只讀目前持股與未平倉批次；成本以整數分加總，平均成本四捨五入到分"""
+    positions = Position.query.filter(Position.user_id == user_id, Position.quantity > 0).all()
+    cost = defaultdict(int)
+    for ticker, qty, price_cents in (db.session.query(Lot.ticker, Lot.quantity, Lot.price_cents)
+                                     .filter(Lot.user_id == user_id)):
+        cost[ticker] += qty * price_cents
+
+    return [{
+        "ticker": pos.ticker,
+        "quantity": float(pos.quantity),
+        "costAvg": from_cents(div_round(cost[pos.ticker], pos.quantity)),
+    } for pos in positions]
+
+
+def rebuild_positions(user_ids: Optional[Iterable[int]] = None) -> int:
+    """依 Trade 時間順序重播 FIFO，覆寫 Position / Lot；回傳處理的交易筆數"""
+    q = Trade.query
+    lot_q, pos_q = Lot.query, Position.query
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        q = q.filter(Trade.user_id.in_(user_ids))
+        lot_q = lot_q.filter(Lot.user_id.in_(user_ids))
+        pos_q = pos_q.filter(Position.user_id.in_(user_ids))
+
+    books = defaultdict(lambda: {"qty": 0, "lots": deque()})
+    n = 0
+    for t in q.order_by(Trade.user_id, Trade.created_at, Trade.id).yield_per(1000):
+        n += 1
+        book = books[(t.user_id, t.ticker)]
+        if t.trade_type in BUY_TYPES:
+            book["qty"] += t.quantity
+            book["lots"].append([t.quantity, t.price_cents, t.id, t.created_at])
+            continue
+        book["qty"] -= t.quantity
+        remaining = t.quantity
+        lots = book["lots"]
+        while remaining > 0 and lots:
+            if lots[0][0] > remaining:
+                lots[0][0] -= remaining
+                remaining = 0
+            else:
+                remaining -= lots[0][0]
+                lots.popleft()
+        if book["qty"] <= 0:
+            book["qty"] = 0
+            lots.clear()
+
+    lot_q.delete(synchronize_session=False)
+    pos_q.delete(synchronize_session=False)
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(Position, [
+        {"user_id": uid, "ticker": ticker, "quantity": b["qty"], "updated_at": now}
+        for (uid, ticker), b in books.items() if b["qty"] > 0])
+    db.session.bulk_insert_mappings(Lot, [
+        {"user_id": uid, "ticker": ticker, "quantity": q, "price_cents": p, "trade_id": tid, "created_at": ts}
+        for (uid, ticker), b in books.items() if b["qty"] > 0 for q, p, tid, ts in b["lots"]])
+    db.session.commit()
+    return n
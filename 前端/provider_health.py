@@ -0,0 +1,127 @@
+"""上游報價來源健康度：滾動錯誤率與延遲、連續失敗跳脫（circuit breaker），並依健康度排序備援順序"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, TypeVar
+
+T = TypeVar("T")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """來源目前處於跳脫狀態，暫不呼叫"""
+
+
+class _Provider:
+    def __init__(self, window: int):
+        self.calls = deque(maxlen=window)  # (時間, 成功?, 延遲秒)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.total = 0
+        self.failures = 0
+
+
+class ProviderHealth:
+    def __init__(self, window: int = 50, failure_threshold: int = 5,
+                 error_rate_threshold: float = 0.5, min_calls: int = 10, cooldown: float = 30.0):
+        """
+        window：滾動統計的最近呼叫數；連續失敗達 failure_threshold，
+        或最近 min_calls 次以上錯誤率超過 error_rate_threshold 就跳脫 cooldown 秒。
+        """
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._providers: Dict[str, _Provider] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> _Provider:
+        p = self._providers.get(name)
+        if p is None:
+            p = self._providers[name] = _Provider(self.window)
+        return p
+
+    @staticmethod
+    def _error_rate(p: _Provider) -> float:
+        return sum(1 for _, ok, _ in p.calls if not ok) / len(p.calls) if p.calls else 0.0
+
+    @staticmethod
+    def _latency(p: _Provider, q: float) -> float:
+        lat = sorted(l for _, ok, l in p.calls if ok)
+        return lat[min(len(lat) - 1, int(q * len(lat)))] if lat else 0.0
+
+    def allow(self, name: str) -> bool:
+        """跳脫中回傳 False；冷卻結束後只放行一個試探請求（half-open）"""
+        with self._lock:
+            p = self._get(name)
+            if p.state == CLOSED:
+                return True
+            if p.state == OPEN and time.time() - p.opened_at >= self.cooldown:
+                p.state = HALF_OPEN
+            if p.state == HALF_OPEN and not p.probing:
+                p.probing = True
+                return True
+            return False
+
+    def record(self, name: str, ok: bool, latency: float):
+        with self._lock:
+            p = self._get(name)
+            p.calls.append((time.time(), ok, latency))
+            p.total += 1
+            p.probing = False
+            if ok:
+                p.consecutive_failures = 0
+                if p.state != CLOSED:
+                    p.state = CLOSED
+                    p.calls.clear()  # 恢復後重新統計，避免舊錯誤立刻再跳脫
+                return
+            p.failures += 1
+            p.consecutive_failures += 1
+            tripped = (p.consecutive_failures >= self.failure_threshold
+                       or (len(p.calls) >= self.min_calls and self._error_rate(p) > self.error_rate_threshold))
+            if p.state == HALF_OPEN or tripped:
+                if p.state != OPEN:
+                    print(f"⚠️ {name} 連續失敗，暫停呼叫 {self.cooldown:.0f} 秒")
+                p.state = OPEN
+                p.opened_at = time.time()
+
+    def call(self, name: str, fn: Callable[[], T]) -> T:
+        """經健康度控管呼叫來源；fn 丟例外即記為失敗"""
+        if not self.allow(name):
+            raise CircuitOpenError(f"{name} 暫停中")
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception:
+            self.record(name, False, time.monotonic() - started)
+            raise
+        self.record(name, True, time.monotonic() - started)
+        return result
+
+    def order(self, names: Iterable[str]) -> List[str]:
+        """依健康度排序：未跳脫優先，再比錯誤率、p50 延遲；同分維持原順序"""
+        names = list(names)
+        with self._lock:
+            def key(item):
+                idx, name = item
+                p = self._get(name)
+                return (p.state == OPEN, round(self._error_rate(p), 1), round(self._latency(p, 0.5), 1), idx)
+            return [name for _, name in sorted(enumerate(names), key=key)]
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: {
+                "state": p.state,
+                "error_rate": round(self._error_rate(p), 3),
+                "p50_ms": round(self._latency(p, 0.5) * 1000, 1),
+                "p95_ms": round(self._latency(p, 0.95) * 1000, 1),
+                "window_calls": len(p.calls),
+                "consecutive_failures": p.consecutive_failures,
+                "total_calls": p.total,
+                "total_failures": p.failures,
+                "opened_at": p.opened_at or None,
+            } for name, p in self._providers.items()}
@@ -0,0 +1,182 @@
+"""程序內共用報價快取：TTL 由 ttl_func 決定（app 依交易日曆給盤中/盤後不同值）、同代號併發 miss 合併（single-flight）、LRU 上限與命中統計"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_TTL = 5
+
+
+class _Flight:
+    """一次進行中的上游查詢；其他等待者共用結果"""
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class QuoteCache:
+    def __init__(self, max_size: int = 2048, ttl_func: Callable[[], float] = lambda: DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl_func = ttl_func
+        self._data: "OrderedDict[str, tuple[float, float, Any]]" = OrderedDict()  # key -> (到期時間, 取得時間, 值)
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def _lookup(self, key: str, now: float):
+        """需持有 _lock；命中回傳 entry 並移到 LRU 尾端，過期就刪除"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, value: Any, ttl: float, now: float):
+        """需持有 _lock"""
+        self._data[key] = (now + ttl, now, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str, loader: Callable[[], Any], ttl: Optional[float] = None,
+            cache_none: bool = False) -> Any:
+        """
+        取快取；miss 時由第一個呼叫者執行 loader，同 key 的其他執行緒等待同一結果。
+        loader 回傳 None 預設不快取（下次再試）。
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._lookup(key, now)
+            if entry is not None:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = loader()
+            flight.value = value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self.loads += 1
+                if flight.error is None and (flight.value is not None or cache_none):
+                    self._store(key, flight.value, ttl if ttl is not None else self.ttl_func(), time.time())
+                self._flights.pop(key, None)
+            flight.event.set()
+        return value
+
+    def get_many(self, keys, batch_loader: Callable[[list], Dict[str, Any]],
+                 ttl: Optional[float] = None) -> Dict[str, Any]:
+        """
+        批次版 get：命中的直接回傳，其餘 key 一次交給 batch_loader(keys) -> {key: value}。
+        其他執行緒已在查的 key 不重複查詢，等對方結果即可。
+        """
+        now = time.time()
+        out: Dict[str, Any] = {}
+        mine: Dict[str, _Flight] = {}
+        theirs: Dict[str, _Flight] = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._lookup(key, now)
+                if entry is not None:
+                    self.hits += 1
+                    out[key] = entry[2]
+                    continue
+                self.misses += 1
+                flight = self._flights.get(key)
+                if flight is not None:
+                    theirs[key] = flight
+                else:
+                    flight = _Flight()
+                    self._flights[key] = flight
+                    mine[key] = flight
+
+        if mine:
+            loaded: Dict[str, Any] = {}
+            error: Optional[BaseException] = None
+            try:
+                loaded = batch_loader(list(mine)) or {}
+            except BaseException as e:
+                error = e
+            with self._lock:
+                self.loads += 1
+                stored_at = time.time()
+                for key, flight in mine.items():
+                    flight.error = error
+                    flight.value = loaded.get(key)
+                    if error is None and flight.value is not None:
+                        self._store(key, flight.value, ttl if ttl is not None else self.ttl_func(), stored_at)
+                    self._flights.pop(key, None)
+            for flight in mine.values():
+                flight.event.set()
+            if error is not None:
+                raise error
+            for key, flight in mine.items():
+                out[key] = flight.value
+
+        for key, flight in theirs.items():
+            flight.event.wait()
+            out[key] = flight.value if flight.error is None else None
+        return out
+
+    def peek(self, key: str) -> Any:
+        """只讀快取、不觸發查詢（也不計入命中統計）"""
+        with self._lock:
+            entry = self._lookup(key, time.time())
+            return entry[2] if entry is not None else None
+
+    def age(self, key: str) -> Optional[float]:
+        """快取值已存在幾秒；沒有或已過期回傳 None"""
+        with self._lock:
+            now = time.time()
+            entry = self._lookup(key, now)
+            return now - entry[1] if entry is not None else None
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._store(key, value, ttl if ttl is not None else self.ttl_func(), time.time())
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "inflight": len(self._flights),
+            }
@@ -0,0 +1,134 @@
+"""報價推播中心：單一背景輪詢器每輪抓所有訂閱代號的聯集，再把更新分送給每個 SSE 訂閱者與 listener（如掛單撮合）"""
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class Subscription:
+    __slots__ = ("symbols", "queue")
+
+    def __init__(self, symbols: Set[str], maxsize: int):
+        self.symbols = symbols
+        self.queue: "queue.Queue[dict]" = queue.Queue(maxsize=maxsize)
+
+
+class QuoteHub:
+    def __init__(self, fetch_prices: Callable[[List[str]], Dict[str, Optional[float]]],
+                 interval: float = 5.0, queue_size: int = 20):
+        self.fetch_prices = fetch_prices
+        self.interval = interval
+        self.queue_size = queue_size
+        self._subs: Set[Subscription] = set()
+        self._last: Dict[str, float] = {}
+        # (callback(prices), symbols())：每輪抓完價後呼叫，symbols() 是它另外需要輪詢的代號
+        self._listeners: List[Tuple[Callable[[Dict[str, float]], None], Callable[[], Iterable[str]]]] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.rounds = 0
+
+    def _ensure_running(self):
+        """需持有 _lock"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="quote-hub", daemon=True)
+            self._thread.start()
+
+    def subscribe(self, symbols: Iterable[str]) -> Subscription:
+        sub = Subscription(set(symbols), self.queue_size)
+        with self._lock:
+            self._subs.add(sub)
+            self._ensure_running()
+        return sub
+
+    def add_listener(self, callback: Callable[[Dict[str, float]], None],
+                     symbols: Callable[[], Iterable[str]]):
+        """每輪報價（含未變動的）交給 callback；symbols() 的代號即使沒有 SSE 訂閱者也會輪詢"""
+        with self._lock:
+            self._listeners.append((callback, symbols))
+            self._ensure_running()
+
+    def wake(self):
+        """listener 需要的代號變多時呼叫，確保輪詢器在跑"""
+        with self._lock:
+            self._ensure_running()
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def snapshot(self, symbols: Iterable[str]) -> Dict[str, float]:
+        """最近一輪已知的價格（新訂閱者先拿這份，不必等下一輪）"""
+        with self._lock:
+            return {s: self._last[s] for s in symbols if s in self._last}
+
+    def _listener_symbols(self) -> Set[str]:
+        with self._lock:
+            listeners = list(self._listeners)
+        wanted: Set[str] = set()
+        for _, symbols in listeners:
+            try:
+                wanted.update(symbols())
+            except Exception as e:
+                print(f"⚠️ 報價 listener 取代號失敗：{e}")
+        return wanted
+
+    def _run(self):
+        while True:
+            extra = self._listener_symbols()
+            with self._lock:
+                if not self._subs and not extra:
+                    self._thread = None
+                    return  # 沒人訂閱就停，下次 subscribe / wake 再啟動
+                wanted = sorted(set().union(extra, *(s.symbols for s in self._subs)))
+            started = time.monotonic()
+            try:
+                prices = {k: v for k, v in self.fetch_prices(wanted).items() if v is not None}
+            except Exception as e:
+                print(f"⚠️ 報價推播輪詢失敗：{e}")
+                prices = {}
+            self._publish(prices)
+            self._notify(prices)
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def _publish(self, prices: Dict[str, float]):
+        with self._lock:
+            changed = {k: v for k, v in prices.items() if self._last.get(k) != v}
+            self._last.update(prices)
+            subs = list(self._subs)
+            self.rounds += 1
+        if not changed:
+            return
+        ts = time.time()
+        for sub in subs:
+            mine = {k: v for k, v in changed.items() if k in sub.symbols}
+            if not mine:
+                continue
+            msg = {"type": "quotes", "prices": mine, "ts": ts}
+            try:
+                sub.queue.put_nowait(msg)
+            except queue.Full:
+                # 慢的訂閱者丟掉最舊的一筆，保留最新價
+                try:
+                    sub.queue.get_nowait()
+                    sub.queue.put_nowait(msg)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _notify(self, prices: Dict[str, float]):
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback, _ in listeners:
+            try:
+                callback(prices)
+            except Exception as e:
+                print(f"⚠️ 報價 listener 執行失敗：{e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._subs),
+                "symbols": len(set().union(*(s.symbols for s in self._subs))) if self._subs else 0,
+                "listeners": len(self._listeners),
+                "rounds": self.rounds,
+                "interval": self.interval,
+            }
@@ -0,0 +1,12 @@
+import sys
+
+from app import app
+from ledger import SNAPSHOT_EVERY, rebuild_ledger
+
+# 由 Trade 與目前餘額重建帳務事件簿與歷史快照：python rebuild_ledger.py [user_id ...]
+# 既有資料庫升級時先跑 init_db.py 建表，再跑一次本程式；之後事件由下單時同步寫入
+with app.app_context():
+    user_ids = [int(x) for x in sys.argv[1:]] or None
+    n = rebuild_ledger(user_ids)
+    target = "全部帳號" if user_ids is None else f"帳號 {user_ids}"
+    print(f"✅ 已重建{target}的帳務事件簿，共 {n} 筆事件（每 {SNAPSHOT_EVERY} 筆一份快照）")
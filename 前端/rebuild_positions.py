@@ -0,0 +1,11 @@
+import sys
+
+from app import app
+from positions import rebuild_positions
+
+# 由 Trade 重建 Position / Lot：python rebuild_positions.py [user_id ...]
+with app.app_context():
+    user_ids = [int(x) for x in sys.argv[1:]] or None
+    n = rebuild_positions(user_ids)
+    target = "全部帳號" if user_ids is None else f"帳號 {user_ids}"
+    print(f"✅ 已重建{target}的持股，共重播 {n} 筆交易")
@@ -0,0 +1,165 @@
+"""
+帳目核對：由 Trade 重算每個帳號的現金與持股，和 User.balance_cents、Position、帳務事件簿比對並列出差異。
+帳號依 id 切成數段，每段以 (user_id, created_at, id) 索引範圍掃描、yield_per 分段讀取；
+同一時間只累加一個帳號的交易，記憶體與該段的帳號數（而非交易筆數）成正比，各段可平行執行。
+"""
+import math
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from models import db, LedgerEvent, Position, Trade, User
+from ledger import INITIAL_CAPITAL_CENTS, OPEN
+from money import from_cents
+from positions import BUY_TYPES
+
+CHUNK_SIZE = 5000
+
+# 差異種類
+CASH = "cash"                        # 餘額 ≠ 開戶入金 + 交易現金流（adjust 事件不計入，差額照樣報出）
+POSITION = "position"                # 持股表 ≠ 由交易重算（超賣處以 0 為底，與 rebuild_positions 相同）
+OVERSOLD = "oversold"                # 賣出時持股不足（舊版 /trade 賣出未檢查買賣別造成）
+LEDGER_CASH = "ledger_cash"          # 帳務事件累計現金 ≠ 餘額
+LEDGER_POSITION = "ledger_position"  # 帳務事件累計股數 ≠ 持股表
+KIND_LABELS = {
+    CASH: "餘額", POSITION: "持股", OVERSOLD: "超賣",
+    LEDGER_CASH: "事件簿現金", LEDGER_POSITION: "事件簿持股",
+}
+
+
+@dataclass
+class Drift:
+    user_id: int
+    username: str
+    kind: str
+    ticker: Optional[str]
+    expected: int   # 現金類為分，持股類為股數
+    actual: int
+    trade_id: Optional[int] = None  # 超賣：第一筆超賣的交易
+
+    @property
+    def diff(self) -> int:
+        return self.actual - self.expected
+
+    def row(self) -> list:
+        money = self.kind in (CASH, LEDGER_CASH)
+        fmt = from_cents if money else int
+        return [self.user_id, self.username, self.kind, self.ticker or "",
+                fmt(self.expected), fmt(self.actual), fmt(self.diff), self.trade_id or ""]
+
+
+REPORT_COLUMNS = ["user_id", "username", "kind", "ticker", "expected", "actual", "diff", "trade_id"]
+
+
+def partitions(n: int, user_ids: Optional[List[int]] = None) -> List[Tuple[int, int]]:
+    """帳號依 id 排序後切成最多 n 段帳號數相近的 [lo, hi]"""
+    q = db.session.query(User.id)
+    if user_ids is not None:
+        q = q.filter(User.id.in_(user_ids))
+    ids = [r[0] for r in q.order_by(User.id)]
+    if not ids:
+        return []
+    size = math.ceil(len(ids) / max(n, 1))
+    return [(ids[i], ids[min(i + size, len(ids)) - 1]) for i in range(0, len(ids), size)]
+
+
+class _Range:
+    """一段帳號的比對基準；先以幾個 GROUP BY 一次讀好，串流交易時不再對同一連線發查詢"""
+
+    def __init__(self, lo: int, hi: int, ledger: bool):
+        in_range = lambda col: col.between(lo, hi)
+        self.users = {uid: (name, bal) for uid, name, bal in
+                      db.session.query(User.id, User.username, User.balance_cents).filter(in_range(User.id))}
+        self.positions: Dict[int, Dict[str, int]] = defaultdict(dict)
+        for uid, ticker, qty in (db.session.query(Position.user_id, Position.ticker, Position.quantity)
+                                 .filter(in_range(Position.user_id), Position.quantity != 0)):
+            self.positions[uid][ticker] = qty
+        self.opening = dict(db.session.query(LedgerEvent.user_id, db.func.sum(LedgerEvent.cash_delta_cents))
+                            .filter(in_range(LedgerEvent.user_id), LedgerEvent.kind == OPEN)
+                            .group_by(LedgerEvent.user_id))
+        self.ledger_cash: Dict[int, int] = {}
+        self.ledger_qty: Dict[int, Dict[str, int]] = defaultdict(dict)
+        if ledger:
+            self.ledger_cash = dict(db.session.query(LedgerEvent.user_id, db.func.sum(LedgerEvent.cash_delta_cents))
+                                    .filter(in_range(LedgerEvent.user_id))
+                                    .group_by(LedgerEvent.user_id))
+            for uid, ticker, qty in (db.session.query(LedgerEvent.user_id, LedgerEvent.ticker,
+                                                      db.func.sum(LedgerEvent.qty_delta))
+                                     .filter(in_range(LedgerEvent.user_id), LedgerEvent.ticker.isnot(None))
+                                     .group_by(LedgerEvent.user_id, LedgerEvent.ticker)):
+                if qty:
+                    self.ledger_qty[uid][ticker] = int(qty)
+
+    def check(self, uid: int, cash: int, held: Dict[str, int], oversold: Dict[str, Tuple[int, int]]) -> List[Drift]:
+        name, balance = self.users[uid]
+        out = []
+        # 開戶入金只看 open 事件（開戶當下記下的金額，rebuild_ledger 則記預設入金），沒有事件時為預設入金
+        expected = int(self.opening.get(uid, INITIAL_CAPITAL_CENTS)) + cash
+        if balance != expected:
+            out.append(Drift(uid, name, CASH, None, expected, balance))
+        positions = self.positions.get(uid, {})
+        for ticker in sorted(set(held) | set(positions)):
+            if held.get(ticker, 0) != positions.get(ticker, 0):
+                out.append(Drift(uid, name, POSITION, ticker, held.get(ticker, 0), positions.get(ticker, 0)))
+        for ticker, (trade_id, short) in sorted(oversold.items()):
+            out.append(Drift(uid, name, OVERSOLD, ticker, 0, -short, trade_id))
+        if uid in self.opening and uid in self.ledger_cash:
+            if int(self.ledger_cash[uid]) != balance:
+                out.append(Drift(uid, name, LEDGER_CASH, None, int(self.ledger_cash[uid]), balance))
+            ledger_qty = self.ledger_qty.get(uid, {})
+            for ticker in sorted(set(ledger_qty) | set(positions)):
+                if ledger_qty.get(ticker, 0) != positions.get(ticker, 0):
+                    out.append(Drift(uid, name, LEDGER_POSITION, ticker,
+                                     ledger_qty.get(ticker, 0), positions.get(ticker, 0)))
+        return out
+
+
+def reconcile_range(lo: int, hi: int, chunk_size: int = CHUNK_SIZE, ledger: bool = True) -> Tuple[dict, List[Drift]]:
+    """
+    核對 id 介於 [lo, hi] 的帳號；回傳 (統計, 差異列表)。需在 app context 內呼叫。
+    事件簿只比對有開戶事件的帳號；ledger=False 時完全略過（事件簿尚未建立時使用）。
+    """
+    base = _Range(lo, hi, ledger)
+    stats = {"accounts": len(base.users), "trades": 0, "no_ledger": 0}
+    drifts: List[Drift] = []
+
+    current = None
+    cash, held, oversold = 0, defaultdict(int), {}
+    done = set()
+
+    def finish():
+        if current in base.users:
+            drifts.extend(base.check(current, cash, {t: q for t, q in held.items() if q}, oversold))
+        done.add(current)
+
+    q = (db.session.query(Trade.id, Trade.user_id, Trade.ticker, Trade.trade_type, Trade.quantity, Trade.price_cents)
+         .filter(Trade.user_id.between(lo, hi))
+         .order_by(Trade.user_id, Trade.created_at, Trade.id))
+    for trade_id, uid, ticker, trade_type, qty, price_cents in q.yield_per(chunk_size):
+        if uid != current:
+            if current is not None:
+                finish()
+            current, cash, held, oversold = uid, 0, defaultdict(int), {}
+        stats["trades"] += 1
+        if trade_type in BUY_TYPES:
+            cash -= qty * price_cents
+            held[ticker] += qty
+            continue
+        cash += qty * price_cents
+        if qty > held[ticker]:
+            first, short = oversold.get(ticker, (trade_id, 0))
+            oversold[ticker] = (first, short + qty - held[ticker])
+            held[ticker] = 0
+        else:
+            held[ticker] -= qty
+    if current is not None:
+        finish()
+
+    # 沒有任何交易的帳號：餘額應等於開戶入金
+    for uid in base.users:
+        if uid not in done:
+            drifts.extend(base.check(uid, 0, {}, {}))
+    if ledger:
+        stats["no_ledger"] = sum(1 for uid in base.users if uid not in base.opening)
+    db.session.expire_all()
+    return stats, drifts
@@ -0,0 +1,146 @@
+"""風險調整後績效：所有帳號的每日結算資產排成 (帳號 × 日期) 矩陣，一次算出波動度、最大回撤、Sharpe、Sortino"""
+import threading
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from models import db, EquitySnapshot, User
+
+TRADING_DAYS = 252
+MIN_RETURNS = 5  # 少於這麼多個日報酬不給指標
+
+# /ranking?sort= 可用的排序鍵：(欄位, 由大到小)
+SORT_KEYS = {
+    "sharpe": ("sharpe", True),
+    "sortino": ("sortino", True),
+    "volatility": ("volatility", False),
+    "max_drawdown": ("max_drawdown", True),  # 回撤為負值，越接近 0 越好
+    "return": ("total_return", True),
+}
+
+
+def equity_matrix(start: Optional[date] = None):
+    """(user_ids, dates, E)；E[i, j] 為帳號 i 在第 j 天的結算資產，沒有結算紀錄為 NaN"""
+    q = db.session.query(EquitySnapshot.user_id, EquitySnapshot.date, EquitySnapshot.equity)
+    if start is not None:
+        q = q.filter(EquitySnapshot.date >= start)
+    df = pd.DataFrame(q.all(), columns=["user_id", "date", "equity"])
+    if df.empty:
+        return np.array([], dtype=int), [], np.empty((0, 0))
+    users, ui = np.unique(df["user_id"].to_numpy(), return_inverse=True)
+    dates, di = np.unique(pd.to_datetime(df["date"]).to_numpy(dtype="datetime64[D]"), return_inverse=True)
+    E = np.full((len(users), len(dates)), np.nan)
+    E[ui, di] = df["equity"].to_numpy(dtype=float)
+    return users, dates.astype(object).tolist(), E
+
+
+def risk_metrics(E: np.ndarray, risk_free: float = 0.0, periods: int = TRADING_DAYS) -> Dict[str, np.ndarray]:
+    """
+    E：(帳號 × 日期) 資產矩陣，缺值為 NaN（例如中途加入的帳號）。整個矩陣一次運算，不逐帳號迴圈。
+    risk_free 為年化無風險利率；波動度與 Sharpe / Sortino 皆年化。
+    """
+    n_users = E.shape[0]
+    nan = np.full(n_users, np.nan)
+    if E.shape[1] < 2:
+        return {k: nan.copy() for k in ("volatility", "max_drawdown", "sharpe", "sortino", "total_return", "days")}
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = E[:, 1:] / E[:, :-1] - 1
+        r[~np.isfinite(r)] = np.nan
+        n = np.sum(~np.isnan(r), axis=1)
+        enough = n >= MIN_RETURNS
+
+        rf = risk_free / periods
+        excess = r - rf
+        mean = np.nanmean(excess, axis=1)
+        std = np.nanstd(r, axis=1, ddof=1)
+        downside = np.sqrt(np.nanmean(np.minimum(excess, 0.0) ** 2, axis=1))
+        scale = np.sqrt(periods)
+
+        volatility = std * scale
+        sharpe = np.where(std > 0, mean / std * scale, np.nan)
+        sortino = np.where(downside > 0, mean / downside * scale, np.nan)
+
+        # 最大回撤：fmax 會略過 NaN，累積高點不受缺值影響
+        peak = np.fmax.accumulate(np.where(np.isnan(E), -np.inf, E), axis=1)
+        max_drawdown = np.nanmin(np.where(np.isnan(E), np.nan, E / peak - 1), axis=1)
+
+        # 區間報酬：第一個與最後一個有值的日期
+        valid = ~np.isnan(E)
+        first = E[np.arange(n_users), valid.argmax(axis=1)]
+        last = E[np.arange(n_users), E.shape[1] - 1 - valid[:, ::-1].argmax(axis=1)]
+        total_return = last / first - 1
+
+    return {
+        "volatility": np.where(enough, volatility, np.nan),
+        "max_drawdown": np.where(enough, max_drawdown, np.nan),
+        "sharpe": np.where(enough, sharpe, np.nan),
+        "sortino": np.where(enough, sortino, np.nan),
+        "total_return": total_return,
+        "days": n.astype(float),
+    }
+
+
+class RiskBoard:
+    """依最近結算日快取：同一個結算日只算一次，新的結算寫入後下次查詢才重算"""
+
+    def __init__(self, app, risk_free: float = 0.0, lookback_days: Optional[int] = None):
+        self.app = app
+        self.risk_free = risk_free
+        self.lookback_days = lookback_days
+        self._as_of: Optional[date] = None
+        self._table: Optional[pd.DataFrame] = None
+        self._records: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.computations = 0
+
+    def _compute(self, as_of: date) -> pd.DataFrame:
+        start = None
+        if self.lookback_days:
+            start = as_of - timedelta(days=self.lookback_days)
+        users, _, E = equity_matrix(start)
+        metrics = risk_metrics(E, self.risk_free)
+        names = dict(db.session.query(User.id, User.username).filter(User.id.in_(users.tolist()))) if len(users) else {}
+        table = pd.DataFrame({"user_id": users, **metrics})
+        table["username"] = table["user_id"].map(names)
+        return table.dropna(subset=["username"]).set_index("username")
+
+    def get(self):
+        """(結算日, DataFrame 以 username 為索引)；尚無結算資料時為 (None, 空表)"""
+        with self.app.app_context():
+            as_of = db.session.query(db.func.max(EquitySnapshot.date)).scalar()
+            if as_of is None:
+                return None, pd.DataFrame()
+            if self._as_of == as_of and self._table is not None:
+                return self._as_of, self._table
+            with self._lock:
+                if self._as_of != as_of or self._table is None:
+                    self._table = self._compute(as_of)
+                    self._records = {u: metrics_dict(r) for u, r in self._table.to_dict("index").items()}
+                    self._as_of = as_of
+                    self.computations += 1
+                return self._as_of, self._table
+
+    def records(self):
+        """(結算日, {username: 指標 dict})，同一結算日重用同一份"""
+        as_of, _ = self.get()
+        return as_of, self._records if as_of is not None else {}
+
+    def metrics_for(self, username: str) -> Optional[dict]:
+        return self.records()[1].get(username)
+
+
+def metrics_dict(row) -> dict:
+    def clean(v, digits):
+        return None if v is None or not np.isfinite(v) else round(float(v), digits)
+
+    return {
+        "volatility": clean(row["volatility"], 4),
+        "max_drawdown": clean(row["max_drawdown"], 4),
+        "sharpe": clean(row["sharpe"], 3),
+        "sortino": clean(row["sortino"], 3),
+        "total_return": clean(row["total_return"], 4),
+        "days": int(row["days"]) if np.isfinite(row["days"]) else 0,
+    }
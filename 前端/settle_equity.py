@@ -0,0 +1,14 @@
+import sys
+from datetime import datetime
+
+from app import equity_settler
+
+# 每日資產結算（補跑用）：python settle_equity.py [YYYY-MM-DD]
+# 只能結算最近一個已收盤的交易日（不給日期即為該日）：估值使用當下的餘額與報價，定盤後即為收盤價；
+# 更早的日期無法重現當天的狀態，會拒絕執行
+session = datetime.strptime(sys.argv[1], "%Y-%m-%d").date() if len(sys.argv) > 1 else None
+try:
+    n = equity_settler.settle(session)
+except ValueError as e:
+    sys.exit(f"❌ {e}")
+print(f"✅ 結算完成，寫入 {n} 筆" if n else "ℹ️ 該日已結算過或沒有帳號")
@@ -12,25 +12,11 @@ function formatCurrency(v) {
 }
 
 
-// 即時價格取得
-function getRealTimePrice(ticker, callback) {
-  fetch(`/price?ticker=${ticker}`)
-    .then(res => res.json())
-    .then(data => {
-      if (data.success) {
-        const price = parseFloat(data.price);
-        priceData[ticker] = priceData[ticker] || [];
-        priceData[ticker].push(price);
-        if (priceData[ticker].length > 30) priceData[ticker].shift();
-        callback(price);
-      } else {
-        alert("查無資料：" + data.message);
-      }
-    })
-    .catch(err => {
-      console.error("取得價格失敗", err);
-      alert("取得價格失敗");
-    });
+// 成交價由伺服器依即時報價決定，不再先查價
+function fillMessage(action, data) {
+  return data.price !== undefined
+    ? `✅ ${action}成功，成交價 ${data.price}（${data.quantity} 股，${formatCurrency(data.amount)}）`
+    : `✅ ${action}成功`;
 }
 
 // 整股買入
@@ -41,26 +27,24 @@ function buyStock() {
 
   const totalShares = quantity * 1000;
 
-  getRealTimePrice(ticker, (price) => {
-    fetch('/buy', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ ticker, quantity: totalShares, price })
+  fetch('/buy', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ ticker, quantity: totalShares })
+  })
+    .then(res => res.json())
+    .then(data => {
+      if (data.success) {
+        alert(fillMessage("買入", data));
+        loadPortfolio();
+      } else {
+        alert("❌ " + data.message);
+      }
     })
-      .then(res => res.json())
-      .then(data => {
-        if (data.success) {
-          alert("✅ 買入成功");
-          loadPortfolio();
-        } else {
-          alert("❌ " + data.message);
-        }
-      })
-      .catch(err => {
-        console.error("❌ 請求失敗", err);
-        alert("⚠️ 請求失敗，請稍後再試");
-      });
-  });
+    .catch(err => {
+      console.error("❌ 請求失敗", err);
+      alert("⚠️ 請求失敗，請稍後再試");
+    });
 }
 
 // 整股賣出
@@ -71,26 +55,24 @@ function sellStock() {
 
   const totalShares = quantity * 1000;
 
-  getRealTimePrice(ticker, (price) => {
-    fetch('/sell', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ ticker, quantity: totalShares, price })
+  fetch('/sell', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ ticker, quantity: totalShares })
+  })
+    .then(res => res.json())
+    .then(data => {
+      if (data.success) {
+        alert(fillMessage("賣出", data));
+        loadPortfolio();
+      } else {
+        alert("❌ " + data.message);
+      }
     })
-      .then(res => res.json())
-      .then(data => {
-        if (data.success) {
-          alert("✅ 賣出成功");
-          loadPortfolio();
-        } else {
-          alert("❌ " + data.message);
-        }
-      })
-      .catch(err => {
-        console.error("❌ 請求失敗", err);
-        alert("⚠️ 請求失敗，請稍後再試");
-      });
-  });
+    .catch(err => {
+      console.error("❌ 請求失敗", err);
+      alert("⚠️ 請求失敗，請稍後再試");
+    });
 }
 
 // 零股交易（買入或賣出）
@@ -99,32 +81,29 @@ function tradeLot(type) {
   const quantity = Number(document.getElementById('quantity-lot').value);
   if (!ticker || quantity <= 0) return alert('請輸入正確資料');
 
-  getRealTimePrice(ticker, (price) => {
-    fetch('/trade', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-      body: new URLSearchParams({
-        ticker,
-        quantity,
-        price,
-        trade_type: type,
-        mode: '零股'
-      })
+  fetch('/trade', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
+    body: new URLSearchParams({
+      ticker,
+      quantity,
+      trade_type: type,
+      mode: '零股'
     })
-      .then(res => res.redirected ? window.location.href = res.url : res.json())
-      .then(data => {
-        if (data?.success === false) {
-          alert("❌ " + data.message);
-        } else {
-          alert(`✅ ${type}成功`);
-          loadPortfolio();
-        }
-      })
-      .catch(err => {
-        console.error("❌ 零股交易失敗", err);
-        alert("⚠️ 零股交易請求失敗");
-      });
-  });
+  })
+    .then(res => res.redirected ? window.location.href = res.url : res.json())
+    .then(data => {
+      if (data?.success === false) {
+        alert("❌ " + data.message);
+      } else {
+        alert(fillMessage(type, data || {}));
+        loadPortfolio();
+      }
+    })
+    .catch(err => {
+      console.error("❌ 零股交易失敗", err);
+      alert("⚠️ 零股交易請求失敗");
+    });
 }
 
 // 取得並更新投資組合資料
@@ -141,24 +120,58 @@ function loadPortfolio() {
         tickers.push(p.ticker);
       });
 
-      return Promise.all(tickers.map(ticker => {
-        return fetch(`/price?ticker=${ticker}`)
-          .then(res => res.json())
-          .then(data => {
-            if (data.success) {
-              priceData[ticker] = priceData[ticker] || [];
-              priceData[ticker].push(parseFloat(data.price));
-              if (priceData[ticker].length > 30) priceData[ticker].shift();
-            }
-          });
-      }));
+      if (tickers.length === 0) return;
+
+      // 一次取回所有持股報價
+      return fetch(`/api/prices?tickers=${tickers.map(encodeURIComponent).join(',')}`)
+        .then(res => res.json())
+        .then(data => {
+          if (!data.success) return;
+          for (const ticker of tickers) {
+            const price = data.prices[ticker];
+            if (price == null) continue;
+            priceData[ticker] = priceData[ticker] || [];
+            priceData[ticker].push(parseFloat(price));
+            if (priceData[ticker].length > 30) priceData[ticker].shift();
+          }
+        });
+    })
+    .then(() => {
+      renderAll();
+      startPortfolioStream(Object.keys(portfolio));
     })
-    .then(() => renderAll())
     .catch(err => {
       console.error("載入投資組合失敗", err);
     });
 }
 
+// 持股報價推播（取代逐檔輪詢）
+let portfolioES = null;
+let portfolioESKey = '';
+function startPortfolioStream(tickers) {
+  const key = [...tickers].sort().join(',');
+  if (key === portfolioESKey && portfolioES) return;
+  if (portfolioES) { portfolioES.close(); portfolioES = null; }
+  portfolioESKey = key;
+  if (!key) return;
+
+  portfolioES = new EventSource(`/api/quotes/stream?tickers=${encodeURIComponent(key)}`);
+  portfolioES.onmessage = (evt) => {
+    try {
+      const msg = JSON.parse(evt.data);
+      if (msg.type !== 'quotes') return;
+      for (const [ticker, price] of Object.entries(msg.prices)) {
+        priceData[ticker] = priceData[ticker] || [];
+        priceData[ticker].push(parseFloat(price));
+        if (priceData[ticker].length > 30) priceData[ticker].shift();
+      }
+      renderAll();
+    } catch (e) {
+      console.error('報價推播解析失敗', e);
+    }
+  };
+}
+
 // 渲染投資組合表格
 function renderPortfolio() {
   const tbody = document.querySelector('#portfolio-table tbody');
@@ -0,0 +1,116 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import Flask
+
+from ledger import SNAPSHOT_LAG, record_opening, state_at, take_snapshots
+from models import db, User, Trade, Position, Lot
+from money import from_cents, to_cents
+from orders import BUY, SELL, OrderError, execute_order
+
+# 併發下單壓力測試：同時送出大量買賣委託，最後核對餘額與持股是否一致
+#   python stress_orders.py [委託數] [執行緒數]
+# 預設用暫存 SQLite；設定 STRESS_DATABASE_URI 可對 MySQL 測（會建立並清空資料表，請勿指向正式庫）
+N_ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+N_THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+N_USERS = 10
+TICKERS = ["2330", "2317", "2454"]
+INITIAL_CENTS = to_cents(1_000_000)
+
+app = Flask(__name__)
+uri = os.getenv("STRESS_DATABASE_URI")
+if not uri:
+    uri = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="stress_"), "stress.db")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"connect_args": {"timeout": 60}}
+app.config["SQLALCHEMY_DATABASE_URI"] = uri
+app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+db.init_app(app)
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    users = [User(username=f"stress{i}", password="x", balance_cents=INITIAL_CENTS) for i in range(N_USERS)]
+    db.session.add_all(users)
+    db.session.flush()
+    for u in users:
+        record_opening(u)
+    db.session.commit()
+    user_ids = [u.id for u in User.query.all()]
+
+rng = random.Random(42)
+orders = [(rng.choice(user_ids), rng.choice(TICKERS), rng.choice([BUY, BUY, SELL]),
+           rng.randint(1, 50) * 100, to_cents(round(rng.uniform(50, 150), 2))) for _ in range(N_ORDERS)]
+
+
+def submit(order):
+    uid, ticker, side, qty, price_cents = order
+    with app.app_context():
+        try:
+            execute_order(uid, ticker, side, qty, price_cents, "整股")
+            return "ok"
+        except OrderError as e:
+            return e.code
+
+
+started = time.time()
+with ThreadPoolExecutor(max_workers=N_THREADS) as pool:
+    results = list(pool.map(submit, orders))
+elapsed = time.time() - started
+
+counts = defaultdict(int)
+for r in results:
+    counts[r] += 1
+print(f"📨 {N_ORDERS} 筆委託 / {N_THREADS} 執行緒，耗時 {elapsed:.2f}s（{N_ORDERS / elapsed:.0f} 筆/秒）：{dict(counts)}")
+
+# ---- 核對（整數分，必須完全相等）----
+errors = []
+with app.app_context():
+    cash = defaultdict(lambda: INITIAL_CENTS)
+    net = defaultdict(int)
+    for t in Trade.query.yield_per(1000):
+        sign = -1 if t.trade_type == BUY else 1
+        cash[t.user_id] += sign * t.amount_cents
+        net[(t.user_id, t.ticker)] -= sign * t.quantity
+    if Trade.query.count() != counts["ok"]:
+        errors.append(f"成交筆數 {Trade.query.count()} ≠ 成功回應 {counts['ok']}")
+
+    for u in User.query.all():
+        if u.balance_cents < 0:
+            errors.append(f"{u.username} 餘額為負：{from_cents(u.balance_cents)}")
+        if u.balance_cents != cash[u.id]:
+            errors.append(f"{u.username} 餘額 {from_cents(u.balance_cents):.2f} ≠ 由交易重算 {from_cents(cash[u.id]):.2f}")
+
+    positions = {(p.user_id, p.ticker): p.quantity for p in Position.query.all()}
+    lot_qty = defaultdict(int)
+    for l in Lot.query.all():
+        lot_qty[(l.user_id, l.ticker)] += l.quantity
+    for key in set(net) | set(positions):
+        if net[key] < 0:
+            errors.append(f"{key} 超賣：淨持股 {net[key]}")
+        if positions.get(key, 0) != net[key]:
+            errors.append(f"{key} 持股表 {positions.get(key, 0)} ≠ 由交易重算 {net[key]}")
+        if lot_qty[key] != positions.get(key, 0):
+            errors.append(f"{key} 批次合計 {lot_qty[key]} ≠ 持股 {positions.get(key, 0)}")
+
+    # 帳務事件簿：全部重播、以及存快照後由快照讀出，都要與餘額、持股表一致
+    replayed = {u.id: state_at(u.id) for u in User.query.all()}
+    take_snapshots(now=datetime.utcnow() + SNAPSHOT_LAG)
+    for u in User.query.all():
+        held = {t: q for (uid, t), q in positions.items() if uid == u.id and q}
+        for label, state in (("事件重播", replayed[u.id]), ("快照", state_at(u.id))):
+            if state.balance_cents != u.balance_cents or state.holdings != held:
+                errors.append(f"{u.username} {label} 現金 {state.balance_cents} / 持股 {state.holdings} "
+                              f"≠ 帳戶 {u.balance_cents} / {held}")
+
+if errors:
+    print(f"❌ 發現 {len(errors)} 個不一致：")
+    for e in errors[:50]:
+        print("  -", e)
+    sys.exit(1)
+print("✅ 餘額、持股與帳務事件簿全部一致")
@@ -0,0 +1,146 @@
+"""股票代號主檔：代號／名稱／市場別／產業，來源 FinMind taiwan_stock_info，存於資料庫並每日更新"""
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import db, StockSymbol
+
+# FinMind type 欄位 -> 市場別
+_MARKET_MAP = {"twse": "TSE", "tpex": "OTC"}
+# 市場別 -> (Yahoo 後綴, TWSE MIS 頻道前綴)
+_SUFFIX = {"TSE": (".TW", "tse"), "OTC": (".TWO", "otc")}
+
+
+class SymbolMaster:
+    def __init__(self, app, fetch_info: Callable, max_age: float = 86400, retry_after: float = 300):
+        """fetch_info() 回傳 FinMind taiwan_stock_info 的 DataFrame；更新失敗後 retry_after 秒再試"""
+        self.app = app
+        self.fetch_info = fetch_info
+        self.max_age = max_age
+        self.retry_after = retry_after
+        self._rows: Dict[str, dict] = {}
+        self._loaded_at = 0.0   # 上次成功載入（資料庫仍新鮮或 FinMind 更新成功）
+        self._retry_at = 0.0    # 更新失敗時，下次可重試的時間
+        self._lock = threading.Lock()
+        self._db_loaded = False
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    # ---- 載入／更新 ----
+    def _load_from_db(self) -> Optional[datetime]:
+        rows = StockSymbol.query.all()
+        self._rows = {r.code: {"code": r.code, "name": r.name, "market": r.market, "industry": r.industry}
+                      for r in rows}
+        return max((r.updated_at for r in rows), default=None)
+
+    def _refresh_from_finmind(self):
+        df = self.fetch_info()
+        if df is None or df.empty:
+            raise ValueError("taiwan_stock_info 無資料")
+        df = df.drop_duplicates(subset="stock_id", keep="last")
+        now = datetime.utcnow()
+        records = [{
+            "code": str(r.stock_id),
+            "name": str(r.stock_name),
+            "market": _MARKET_MAP.get(str(r.type).lower(), str(r.type).upper()),
+            "industry": r.industry_category if isinstance(r.industry_category, str) and r.industry_category else None,
+            "updated_at": now,
+        } for r in df.itertuples(index=False)]
+        StockSymbol.query.delete()
+        db.session.bulk_insert_mappings(StockSymbol, records)
+        db.session.commit()
+        self._rows = {r["code"]: {k: r[k] for k in ("code", "name", "market", "industry")} for r in records}
+
+    def _stale(self) -> bool:
+        now = time.time()
+        return now - self._loaded_at > self.max_age and now >= self._retry_at
+
+    def refresh(self, force: bool = False):
+        """資料庫有一天內的資料就直接用，否則向 FinMind 重新抓並寫回；失敗時 retry_after 秒後再試"""
+        with self._lock:
+            if not force and not self._stale():
+                return  # 其他執行緒剛更新過，或還在失敗後的等待時間內
+            with self.app.app_context():
+                try:
+                    updated_at = None if force else self._load_from_db()
+                    if force or updated_at is None or (datetime.utcnow() - updated_at).total_seconds() > self.max_age:
+                        self._refresh_from_finmind()
+                except Exception as e:
+                    db.session.rollback()
+                    self._retry_at = time.time() + self.retry_after
+                    print(f"⚠️ 代號主檔更新失敗（沿用現有資料 {len(self._rows)} 筆，{self.retry_after:.0f} 秒後重試）：{e}")
+                    return
+            self._loaded_at = time.time()
+
+    def start_refresh(self):
+        """在背景執行 refresh()；已在更新中就不重複啟動，更新完成前查詢沿用現有資料"""
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.refresh, name="symbol-master", daemon=True)
+                self._thread.start()
+
+    def _load_initial(self):
+        """程序啟動後第一次查詢：只讀資料庫（不向 FinMind 抓），資料仍在一天內就不必背景更新"""
+        with self._thread_lock:
+            if self._db_loaded:
+                return
+            with self.app.app_context():
+                try:
+                    updated_at = self._load_from_db()
+                    if updated_at is not None and (datetime.utcnow() - updated_at).total_seconds() <= self.max_age:
+                        self._loaded_at = time.time()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"⚠️ 代號主檔讀取失敗：{e}")
+            self._db_loaded = True
+
+    def _ensure(self):
+        """過期時在背景更新，這次查詢不等下載，直接用現有的表（未知代號本來就會兩個市場都試）"""
+        if not self._stale():
+            return
+        if not self._db_loaded:
+            self._load_initial()
+        if self._stale():
+            self.start_refresh()
+
+    # ---- 查詢 ----
+    def lookup(self, code: str) -> Optional[dict]:
+        self._ensure()
+        return self._rows.get(code)
+
+    def name(self, code: str) -> Optional[str]:
+        row = self.lookup(code)
+        return row["name"] if row else None
+
+    def find_in_text(self, text: str) -> Tuple[Optional[str], Optional[str]]:
+        """文字中出現的第一個公司名稱或代號 -> (代號, 名稱)；都沒有時為 (None, None)"""
+        self._ensure()
+        for row in self._rows.values():
+            if row["name"] in text or row["code"] in text:
+                return row["code"], row["name"]
+        return None, None
+
+    def market(self, code: str) -> Optional[str]:
+        row = self.lookup(code)
+        return row["market"] if row else None
+
+    def yahoo_candidates(self, code: str) -> List[str]:
+        """已知市場只回一個 Yahoo 代號；未知才兩種都試"""
+        m = self.market(code)
+        if m in _SUFFIX:
+            return [code + _SUFFIX[m][0]]
+        return [code + ".TW", code + ".TWO"]
+
+    def yahoo_symbol(self, code: str) -> str:
+        return self.yahoo_candidates(code)[0]
+
+    def mis_channels(self, code: str) -> List[str]:
+        """TWSE MIS ex_ch 頻道；未知市場同時查 tse 與 otc"""
+        m = self.market(code)
+        if m in _SUFFIX:
+            return [f"{_SUFFIX[m][1]}_{code}.tw"]
+        return [f"tse_{code}.tw", f"otc_{code}.tw"]
+
+    def stats(self) -> dict:
+        return {"count": len(self._rows), "loaded_at": self._loaded_at, "retry_at": self._retry_at}
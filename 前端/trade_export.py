@@ -0,0 +1,83 @@
+"""交易紀錄匯出：依 id 以固定大小分段讀取（keyset），CSV 逐段串流、Parquet 每段一個 row group，記憶體只放一段"""
+import csv
+import io
+from datetime import datetime
+from typing import IO, Iterator, List, Optional, Tuple, Union
+
+from models import db, Trade, User
+from money import from_cents
+
+CHUNK_SIZE = 5000
+COLUMNS = ["id", "user_id", "username", "created_at", "ticker", "trade_type", "mode", "quantity", "price", "amount"]
+
+
+def iter_trade_chunks(user_id: Optional[int] = None, chunk_size: int = CHUNK_SIZE,
+                      since: Optional[datetime] = None, until: Optional[datetime] = None) -> Iterator[List[Tuple]]:
+    """
+    每次 yield 一段（最多 chunk_size 筆）依 id 遞增的列；user_id 為 None 時為所有帳號。
+    每段都是獨立的 WHERE id > ? LIMIT ? 查詢，不會長時間佔用連線或把全部結果載入。
+    需在 app context 內呼叫。
+    """
+    last_id = 0
+    while True:
+        q = (db.session.query(Trade.id, Trade.user_id, User.username, Trade.created_at, Trade.ticker,
+                              Trade.trade_type, Trade.mode, Trade.quantity, Trade.price_cents)
+             .join(User, User.id == Trade.user_id)
+             .filter(Trade.id > last_id))
+        if user_id is not None:
+            q = q.filter(Trade.user_id == user_id)
+        if since is not None:
+            q = q.filter(Trade.created_at >= since)
+        if until is not None:
+            q = q.filter(Trade.created_at < until)
+        rows = q.order_by(Trade.id).limit(chunk_size).all()
+        # 段與段之間不留 ORM 物件在 session 中
+        db.session.expire_all()
+        if not rows:
+            return
+        # 價格與金額以整數分計算，輸出時才換成元
+        yield [(*r[:-1], from_cents(r.price_cents), from_cents(r.quantity * r.price_cents)) for r in rows]
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1].id
+
+
+def iter_csv(chunks: Iterator[List[Tuple]]) -> Iterator[str]:
+    """表頭一段，之後每個 chunk 轉成一段 CSV 文字；開頭加 BOM 讓 Excel 正確辨識中文"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    yield "\ufeff" + buf.getvalue()
+    for chunk in chunks:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows((*r[:3], r[3].isoformat(sep=" "), *r[4:]) for r in chunk)
+        yield buf.getvalue()
+
+
+def write_parquet(target: Union[str, IO[bytes]], chunks: Iterator[List[Tuple]]) -> int:
+    """每個 chunk 寫成一個 row group；回傳總筆數。需要 pyarrow（選用相依套件）"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()), ("user_id", pa.int64()), ("username", pa.string()),
+        ("created_at", pa.timestamp("us")), ("ticker", pa.string()), ("trade_type", pa.string()),
+        ("mode", pa.string()), ("quantity", pa.int64()), ("price", pa.float64()), ("amount", pa.float64()),
+    ])
+    total = 0
+    with pq.ParquetWriter(target, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+            total += len(chunk)
+    return total
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
@@ -0,0 +1,73 @@
+"""交易紀錄 keyset 分頁：以 (created_at, id) 為游標往回翻，每頁成本固定，不隨紀錄總數成長"""
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+from models import Trade
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+SIDE_ALIASES = {"buy": "買入", "sell": "賣出"}
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, trade_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{trade_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        ts, trade_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(trade_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise CursorError("游標格式錯誤") from e
+
+
+def trade_query(user_id: int, ticker: Optional[str] = None, side: Optional[str] = None,
+                mode: Optional[str] = None):
+    """套用篩選條件的查詢（尚未排序）"""
+    q = Trade.query.filter(Trade.user_id == user_id)
+    if ticker:
+        q = q.filter(Trade.ticker == ticker)
+    if side:
+        q = q.filter(Trade.trade_type == SIDE_ALIASES.get(side, side))
+    if mode:
+        q = q.filter(Trade.mode == mode)
+    return q
+
+
+def page_trades(user_id: int, cursor: Optional[str] = None, limit: int = PAGE_SIZE,
+                **filters) -> Tuple[List[Trade], Optional[str]]:
+    """
+    新到舊一頁；cursor 為上一頁最後一筆的游標。回傳 (紀錄, 下一頁游標)，沒有下一頁時游標為 None。
+    多取一筆判斷是否還有下一頁，不做 COUNT。
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    q = trade_query(user_id, **filters)
+    if cursor:
+        ts, last_id = decode_cursor(cursor)
+        q = q.filter(or_(Trade.created_at < ts, and_(Trade.created_at == ts, Trade.id < last_id)))
+    rows = q.order_by(Trade.created_at.desc(), Trade.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def trade_dict(t: Trade) -> dict:
+    return {
+        "id": t.id,
+        "created_at": t.created_at.strftime("%Y-%m-%d %H:%M"),
+        "ticker": t.ticker,
+        "trade_type": t.trade_type,
+        "mode": t.mode,
+        "price": t.price,
+        "quantity": t.quantity,
+    }
@@ -0,0 +1,91 @@
+"""共用上游 HTTP 層：每個 host 一組 keep-alive 連線池、單次期限、有限次數重試（含抖動退避）與 host 併發上限"""
+import random
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """上游在期限內仍無法取得成功回應"""
+
+
+class UpstreamClient:
+    def __init__(self, timeout: float = 5, retries: int = 2, backoff: float = 0.3,
+                 pool_size: int = 10, host_limit: int = 8,
+                 host_limits: Optional[Dict[str, int]] = None,
+                 headers: Optional[Dict[str, str]] = None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.host_limit = host_limit
+        self.host_limits = dict(host_limits or {})
+        self.headers = dict(headers or {})
+        self._sessions: Dict[str, requests.Session] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host_state(self, host: str):
+        with self._lock:
+            sess = self._sessions.get(host)
+            if sess is None:
+                sess = requests.Session()
+                # 重試由本層控制，adapter 本身不重試
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                sess.mount("https://", adapter)
+                sess.mount("http://", adapter)
+                sess.headers.update(self.headers)
+                self._sessions[host] = sess
+                self._slots[host] = threading.BoundedSemaphore(self.host_limits.get(host, self.host_limit))
+            return sess, self._slots[host]
+
+    def _sleep_backoff(self, attempt: int, deadline: float):
+        # full jitter：0 ~ backoff * 2^attempt，且不超過剩餘期限
+        delay = random.uniform(0, self.backoff * (2 ** attempt))
+        time.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+
+    def get(self, url: str, params=None, headers=None, timeout: Optional[float] = None,
+            retries: Optional[int] = None, deadline: Optional[float] = None) -> requests.Response:
+        """
+        timeout：單次請求秒數；deadline：含重試與排隊的總秒數（預設 timeout × (retries+1)）。
+        429/5xx 與連線錯誤會重試；其他 4xx 直接回傳交給呼叫端判斷。
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        total = deadline if deadline is not None else timeout * (retries + 1)
+        end = time.monotonic() + total
+        host = urlsplit(url).netloc
+        sess, slot = self._host_state(host)
+
+        last_error: Optional[BaseException] = None
+        for attempt in range(retries + 1):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            if not slot.acquire(timeout=remaining):
+                raise UpstreamError(f"{host} 併發已滿，等待逾時")
+            try:
+                resp = sess.get(url, params=params, headers=headers,
+                                timeout=min(timeout, max(0.1, end - time.monotonic())))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            else:
+                if resp.status_code not in RETRY_STATUS:
+                    return resp
+                last_error = requests.HTTPError(f"HTTP {resp.status_code}", response=resp)
+            finally:
+                slot.release()
+            if attempt < retries:
+                self._sleep_backoff(attempt, end)
+        raise UpstreamError(f"{host} 請求失敗：{last_error or '超過期限'}")
+
+    def get_json(self, url: str, **kwargs):
+        resp = self.get(url, **kwargs)
+        resp.raise_for_status()
+        return resp.json()